@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def normalize_prompt(prompt: str) -> str:
+    # Line endings and trailing whitespace do not change what the model sees
+    lines = prompt.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def cache_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_prompt(prompt)}".encode()).hexdigest()
+
+
+class DiskTier:
+    """SQLite-backed second tier, evicted least-recently-used by size."""
+
+    def __init__(self, db_path: Path, max_bytes: int):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key: str, value, ttl: float):
+        raw = json.dumps(value)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, expires, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, raw, len(raw), now + ttl, now),
+            )
+            conn.execute("DELETE FROM responses WHERE expires < ?", (now,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            evicted = 0
+            if total > self.max_bytes:
+                for old_key, size in conn.execute(
+                    "SELECT key, size FROM responses ORDER BY last_used"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                    total -= size
+                    evicted += 1
+        return evicted
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": count, "bytes": size}
+
+
+class _Inflight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class ResponseCache:
+    """Two-tier cache for model responses keyed on model + normalized prompt.
+
+    Concurrent requests for the same key share one upstream call instead of
+    each going to the provider.
+    """
+
+    def __init__(self, ttl=3600.0, max_entries=1000, max_bytes=64 * 1024 * 1024, disk=None, run_io=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.run_io = run_io or asyncio.to_thread
+        self._memory = OrderedDict()
+        self._bytes = 0
+        self._inflight = {}
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    def _memory_get(self, key):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires, value, size = entry
+        if expires < time.time():
+            del self._memory[key]
+            self._bytes -= size
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key, value, expires):
+        size = len(json.dumps(value))
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+        self._memory[key] = (expires, value, size)
+        self._bytes += size
+        while self._memory and (len(self._memory) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self._memory.popitem(last=False)
+            self._bytes -= evicted_size
+            self.counters["evictions"] += 1
+
+    async def get_or_compute(self, model: str, prompt: str, compute, cacheable=None):
+        """Return the cached response or await compute() and cache it when
+        cacheable(result) is true (errors should not be cached).
+
+        compute() runs as its own task, which every caller for the key
+        awaits through a shield: a caller that is cancelled just stops
+        waiting, and the task itself is only cancelled once nobody is
+        left waiting for it.
+        """
+        key = cache_key(model, prompt)
+        value = self._memory_get(key)
+        if value is not None:
+            self.counters["memory_hits"] += 1
+            return value
+        entry = self._inflight.get(key)
+        if entry is not None:
+            self.counters["coalesced"] += 1
+        else:
+            entry = self._inflight[key] = _Inflight(asyncio.ensure_future(self._load(key, compute, cacheable)))
+            entry.task.add_done_callback(lambda task, e=entry: self._settled(key, e))
+        entry.waiters += 1
+        try:
+            return await asyncio.shield(entry.task)
+        finally:
+            entry.waiters -= 1
+            if not entry.waiters and not entry.task.done():
+                # Forget it now, so a request arriving before the task has
+                # wound down starts a fresh one instead of joining it
+                self._settled(key, entry)
+                entry.task.cancel()
+
+    async def _load(self, key, compute, cacheable):
+        value = await self.run_io(self.disk.get, key) if self.disk else None
+        if value is not None:
+            self.counters["disk_hits"] += 1
+            self._memory_put(key, value, time.time() + self.ttl)
+            return value
+        self.counters["misses"] += 1
+        value = await compute()
+        if cacheable is None or cacheable(value):
+            self._memory_put(key, value, time.time() + self.ttl)
+            if self.disk:
+                self.counters["evictions"] += await self.run_io(self.disk.put, key, value, self.ttl)
+        return value
+
+    def _settled(self, key, entry):
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+
+    async def clear(self):
+        # The memory tier is only touched from the event loop
+        self._memory.clear()
+        self._bytes = 0
+        if self.disk:
+            await self.run_io(self.disk.clear)
+
+    def stats(self) -> dict:
+        lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        return {
+            **self.counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "inflight": len(self._inflight),
+            "memory": {"entries": len(self._memory), "bytes": self._bytes,
+                       "max_entries": self.max_entries, "max_bytes": self.max_bytes},
+            "disk": self.disk.stats() if self.disk else None,
+            "ttl": self.ttl,
+        }
@@ -0,0 +1,107 @@
+"""Terminal keystroke latency with and without 50 AI requests in flight.
+
+Starts a stub model provider that answers every call after --delay
+seconds and a backend pointed at it, measures keystroke echo latency on
+an idle terminal, then again while --concurrency /ai/* requests wait on
+the stub. If provider calls blocked the event loop, the second
+measurement would be --delay seconds worse; it should stay flat.
+
+    cd backend && python bench/ai_load.py
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from harness import Backend, echo_latency, open_terminal, summarize
+
+STUB_RESPONSE = {
+    "candidates": [{"content": {"parts": [{"text": "def stub():\n    pass"}]}}],
+    "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": 5},
+    "response": "def stub():\n    pass",
+}
+
+
+async def stub_provider(delay: float):
+    """Minimal HTTP/1.1 server standing in for Gemini and Ollama."""
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.decode("latin-1").split("\r\n"):
+                    name, _, value = line.partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                await asyncio.sleep(delay)
+                body = json.dumps(STUB_RESPONSE).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+async def ai_request(client: httpx.AsyncClient, i: int):
+    # Distinct code every time, so the response cache cannot short-circuit
+    code = f"def f{i}():\n    return {i}\n"
+    started = time.perf_counter()
+    if i % 3 == 0:
+        r = await client.post("/ai/suggest/", json={"code": code, "language": "python"})
+    elif i % 3 == 1:
+        r = await client.post("/ai/review/", json={"code": code, "language": "python"})
+    else:
+        r = await client.post("/ai/chat/", json={"history": [{"role": "user", "content": code}]})
+    r.raise_for_status()
+    return time.perf_counter() - started
+
+
+async def main(args):
+    server = await stub_provider(args.delay)
+    port = server.sockets[0].getsockname()[1]
+    env = {
+        "GEMINI_API_KEY": "stub",
+        "GEMINI_MODELS_URL": f"http://127.0.0.1:{port}/v1beta/models",
+        "DEEPSEEK_URL": f"http://127.0.0.1:{port}/api/generate",
+        "ONPOINT_GEMINI_CONCURRENCY": str(args.concurrency),
+    }
+    async with server, Backend(env) as backend:
+        ws = await open_terminal(backend)
+        idle = await echo_latency(ws, args.probes)
+        timeout = httpx.Timeout(args.delay * 10 + 30)
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=backend.url, timeout=timeout, limits=limits) as client:
+            requests = asyncio.gather(*(ai_request(client, i) for i in range(args.concurrency)))
+            # Give the requests time to reach the stub before probing
+            await asyncio.sleep(min(0.5, args.delay / 4))
+            loaded = await echo_latency(ws, args.probes)
+            ai_seconds = await requests
+        await ws.close()
+    idle_stats, loaded_stats = summarize(idle), summarize(loaded)
+    print(f"stub provider delay {args.delay:g}s, {args.concurrency} concurrent /ai/* requests")
+    print(f"  terminal echo, idle:       {idle_stats}")
+    print(f"  terminal echo, under load: {loaded_stats}")
+    print(f"  ai requests:               {summarize(ai_seconds)}")
+    flat = loaded_stats["p99_ms"] <= max(idle_stats["p99_ms"] * 3, idle_stats["p99_ms"] + args.slack_ms)
+    print("terminal latency stayed flat" if flat else "terminal latency degraded under AI load")
+    return 0 if flat else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=2.0, help="seconds the stub takes per call")
+    parser.add_argument("--probes", type=int, default=60, help="keystrokes per measurement")
+    parser.add_argument("--slack-ms", type=float, default=50.0,
+                        help="loaded p99 may exceed idle p99 by this much (or 3x) and still count as flat")
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,95 @@
+"""Event loop lag while a large workspace is deleted.
+
+Builds a tree of --files small files in --dirs directories on a fresh
+backend, deletes it with DELETE /workspaces/ and, until the delete job
+finishes, keeps timing a request that is answered on the event loop.
+The tree is emptied on the I/O pool, so the loop should stay responsive
+throughout; exits non-zero if the slowest request exceeds --max-lag-ms.
+
+    cd backend && python bench/delete_load.py
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import httpx
+
+from harness import Backend, summarize
+
+# Handled on the loop without touching disk, so its latency is the loop's
+PROBE = "/terminal/sessions/"
+
+
+def build_tree(root, dirs: int, files: int):
+    per_dir = max(files // dirs, 1)
+    for d in range(dirs):
+        sub = root / f"pkg{d // 100}" / f"mod{d}"
+        sub.mkdir(parents=True)
+        for f in range(per_dir):
+            (sub / f"file{f}.py").write_text(f"VALUE = {f}\n")
+
+
+async def timed_probe(client: httpx.AsyncClient) -> float:
+    started = time.perf_counter()
+    await client.get(PROBE)
+    return time.perf_counter() - started
+
+
+async def probe_until(client: httpx.AsyncClient, done: asyncio.Event, interval: float):
+    samples = []
+    while not done.is_set():
+        samples.append(await timed_probe(client))
+        await asyncio.sleep(interval)
+    return samples
+
+
+async def wait_for_job(client: httpx.AsyncClient, job_id: str, done: asyncio.Event):
+    try:
+        while True:
+            job = (await client.get(f"/delete_jobs/{job_id}")).json()
+            if job["status"] != "running":
+                return job
+            await asyncio.sleep(0.05)
+    finally:
+        done.set()
+
+
+async def main(args):
+    async with Backend() as backend:
+        started = time.perf_counter()
+        await asyncio.to_thread(build_tree, backend.workspace / "big", args.dirs, args.files)
+        built = time.perf_counter() - started
+        async with httpx.AsyncClient(base_url=backend.url, timeout=60) as client:
+            idle = summarize([await timed_probe(client) for _ in range(args.probes)])
+            done = asyncio.Event()
+            started = time.perf_counter()
+            r = await client.delete("/workspaces/", params={"name": "big"})
+            r.raise_for_status()
+            accepted = time.perf_counter() - started
+            probing = asyncio.create_task(probe_until(client, done, args.interval))
+            job = await wait_for_job(client, r.json()["job_id"], done)
+            during = await probing
+            elapsed = time.perf_counter() - started
+            server = (await client.get("/io/stats/")).json()["loop_lag"]
+    lag = summarize(during)
+    print(f"{args.files} files in {args.dirs} dirs built in {built:.2f}s")
+    print(f"  DELETE answered in {accepted * 1000:.1f}ms; job {job['status']} after {elapsed:.2f}s, "
+          f"{job['files_deleted']} files and {job['dirs_deleted']} dirs removed")
+    print(f"  probe, idle:           {idle}")
+    print(f"  probe, during delete:  {lag}")
+    print(f"  server loop lag:       {server}")
+    if job["status"] != "done":
+        sys.exit(f"delete job ended as {job['status']}: {job['error']}")
+    if lag["n"] and lag["max_ms"] > args.max_lag_ms:
+        sys.exit(f"loop lag {lag['max_ms']}ms during the delete exceeds {args.max_lag_ms}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--files", type=int, default=100_000)
+    parser.add_argument("--dirs", type=int, default=2_000)
+    parser.add_argument("--probes", type=int, default=50, help="idle probes before the delete")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between probes")
+    parser.add_argument("--max-lag-ms", type=float, default=100.0)
+    asyncio.run(main(parser.parse_args()))
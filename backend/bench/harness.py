@@ -0,0 +1,121 @@
+"""Shared pieces of the load tests: a backend on a spare port and the
+terminal echo probe. Needs httpx and websockets (uvicorn[standard])."""
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Backend:
+    """uvicorn serving main:app in a child process, on a throwaway
+    workspace, with extra environment variables."""
+
+    def __init__(self, env=None):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.ws_url = f"ws://127.0.0.1:{self.port}"
+        self.env = env or {}
+        self._workspace = None
+        self._process = None
+
+    @property
+    def workspace(self) -> Path:
+        return Path(self._workspace.name)
+
+    async def __aenter__(self):
+        self._workspace = tempfile.TemporaryDirectory(prefix="onpoint-bench-")
+        env = {
+            **os.environ,
+            "ONPOINT_WORKSPACE": self._workspace.name,
+            # Shells start without the user's rc files, which can take
+            # longer than anything measured here, and leave no history
+            "HOME": self._workspace.name,
+            "HISTFILE": "/dev/null",
+            **self.env,
+        }
+        self._process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+            "--port", str(self.port), "--log-level", "warning",
+            cwd=BACKEND_DIR, env=env,
+        )
+        deadline = time.monotonic() + 30
+        async with httpx.AsyncClient() as client:
+            while True:
+                try:
+                    await client.get(f"{self.url}/terminal/sessions/")
+                    return self
+                except httpx.TransportError:
+                    if self._process.returncode is not None or time.monotonic() > deadline:
+                        raise RuntimeError("backend did not start")
+                    await asyncio.sleep(0.2)
+
+    async def __aexit__(self, *exc):
+        self._process.terminate()
+        try:
+            await asyncio.wait_for(self._process.wait(), 10)
+        except asyncio.TimeoutError:
+            self._process.kill()
+            await self._process.wait()
+        self._workspace.cleanup()
+
+
+async def open_terminal(backend: Backend):
+    ws = await websockets.connect(f"{backend.ws_url}/ws/terminal/", max_size=None)
+    # Wait for the prompt, then let the rest of the shell's startup output
+    # drain
+    await ws.recv()
+    await drain(ws)
+    return ws
+
+
+async def drain(ws, quiet=0.2):
+    while True:
+        try:
+            await asyncio.wait_for(ws.recv(), quiet)
+        except asyncio.TimeoutError:
+            return
+
+
+async def echo_latency(ws, probes: int, interval: float = 0.02):
+    """Seconds from sending each keystroke to seeing it echoed."""
+    samples = []
+    for i in range(probes):
+        key = "abcdefghijklmnopqrstuvwxyz"[i % 26]
+        started = time.perf_counter()
+        await ws.send(key)
+        while key not in await ws.recv():
+            pass
+        samples.append(time.perf_counter() - started)
+        if i % 26 == 25:
+            # Ctrl-U: clear the typed line so it never wraps
+            await ws.send("\x15")
+            await drain(ws, 0.05)
+        await asyncio.sleep(interval)
+    await ws.send("\x15")
+    await drain(ws, 0.05)
+    return samples
+
+
+def summarize(samples) -> dict:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"n": 0}
+
+    def pct(p):
+        return round(ordered[min(int(len(ordered) * p), len(ordered) - 1)] * 1000, 2)
+
+    return {"n": len(ordered), "p50_ms": pct(0.5), "p99_ms": pct(0.99), "max_ms": round(ordered[-1] * 1000, 2)}
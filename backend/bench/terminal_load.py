@@ -0,0 +1,68 @@
+"""Keystroke echo latency and output throughput with 100 terminals open.
+
+Opens --terminals WebSocket terminals on a fresh backend and measures:
+echo latency with every terminal typing at once, then throughput with
+every terminal printing --megabytes of output, while one more terminal
+keeps measuring echo latency.
+
+    cd backend && python bench/terminal_load.py
+"""
+import argparse
+import asyncio
+import time
+
+from harness import Backend, drain, echo_latency, open_terminal, summarize
+
+# Quoted in the command so the echoed command line never matches
+DONE_COMMAND = "echo __DO''NE__"
+DONE = "__DONE__"
+
+
+async def flood(ws, size: int):
+    """Have the shell print size bytes; returns the characters received."""
+    await ws.send(f"head -c {size} /dev/zero | tr '\\0' x; {DONE_COMMAND}\r")
+    received, tail = 0, ""
+    while True:
+        message = await ws.recv()
+        received += len(message)
+        if DONE in tail + message:
+            return received
+        # Enough to catch the marker split across two messages
+        tail = (tail + message)[-len(DONE):]
+
+
+async def main(args):
+    async with Backend() as backend:
+        started = time.perf_counter()
+        terminals = await asyncio.gather(*(open_terminal(backend) for _ in range(args.terminals)))
+        opened = time.perf_counter() - started
+        probe = await open_terminal(backend)
+
+        samples = await asyncio.gather(*(echo_latency(ws, args.probes, args.interval) for ws in terminals))
+        typing = summarize([s for per_terminal in samples for s in per_terminal])
+
+        size = int(args.megabytes * 1024 * 1024)
+        started = time.perf_counter()
+        flooding = asyncio.gather(*(flood(ws, size) for ws in terminals))
+        during = await echo_latency(probe, args.probes, args.interval)
+        received = sum(await flooding)
+        elapsed = time.perf_counter() - started
+
+        for ws in terminals + [probe]:
+            await drain(ws, 0.01)
+            await ws.close()
+    print(f"{args.terminals} terminals opened in {opened:.2f}s")
+    print(f"  echo, all typing at once:   {typing}")
+    print(f"  echo, while all are output: {summarize(during)}")
+    print(f"  output: {received / 1024 / 1024:.1f}MB in {elapsed:.2f}s, "
+          f"{received / 1024 / 1024 / elapsed:.1f}MB/s total, "
+          f"{received / 1024 / 1024 / elapsed / args.terminals:.2f}MB/s per terminal")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--terminals", type=int, default=100)
+    parser.add_argument("--megabytes", type=float, default=1.0, help="output printed by each terminal")
+    parser.add_argument("--probes", type=int, default=30, help="keystrokes per terminal")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between keystrokes")
+    asyncio.run(main(parser.parse_args()))
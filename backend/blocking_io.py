@@ -0,0 +1,213 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from env import env_int
+
+# How many finished delete jobs to remember for polling
+MAX_FINISHED = 100
+
+
+class IOPool:
+    """Bounded thread pool for blocking filesystem and SQLite work.
+
+    Kept apart from the loop's default executor, so a burst of tree walks
+    or deletes queues here instead of starving everything else that uses
+    to_thread, and the event loop itself never touches the disk.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or env_int("ONPOINT_IO_WORKERS", min(32, (os.cpu_count() or 1) * 4))
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="onpoint-io")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+
+    def _call(self, fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn from any thread; returns a concurrent Future."""
+        with self._lock:
+            self.pending += 1
+        return self._executor.submit(self._call, fn, args, kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self.pending
+        return {
+            "workers": self.workers,
+            "active": min(pending, self.workers),
+            "queued": max(pending - self.workers, 0),
+            "completed": self.completed,
+        }
+
+
+class DeleteJob:
+    def __init__(self, path: str):
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.status = "running"
+        self.files = 0
+        self.dirs = 0
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+
+    def snapshot(self) -> dict:
+        end = self.finished or time.time()
+        return {
+            "job_id": self.id,
+            "path": self.path,
+            "status": self.status,
+            "files_deleted": self.files,
+            "dirs_deleted": self.dirs,
+            "elapsed": round(end - self.started, 3),
+            "error": self.error,
+        }
+
+
+class TreeDeleter:
+    """Deletes directory trees in the background.
+
+    The tree is first renamed into trash_dir, which is a single metadata
+    operation on the same filesystem, so the path is gone (and free to be
+    reused) as soon as start() returns. Its files are then removed on the
+    I/O pool, with progress readable from the job.
+    """
+
+    def __init__(self, trash_dir: Path, pool: IOPool):
+        self.trash = Path(trash_dir)
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def start(self, path: Path, label: str = None) -> DeleteJob:
+        job = DeleteJob(label or str(path))
+        self.trash.mkdir(parents=True, exist_ok=True)
+        target = self.trash / job.id
+        try:
+            os.rename(path, target)
+        except OSError:
+            # Another filesystem (a mount inside the workspace): delete in
+            # place, the path just stays visible until the job finishes
+            target = Path(path)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self.pool.submit(self._run, job, target)
+        return job
+
+    def purge(self):
+        """Delete whatever a previous run left in the trash."""
+        if not self.trash.is_dir():
+            return []
+        return [self.start(p, p.name) for p in self.trash.iterdir() if p.is_dir()]
+
+    def _run(self, job: DeleteJob, root: Path):
+        errors = []
+        try:
+            for dirpath, dirnames, filenames in os.walk(root, topdown=False, onerror=errors.append):
+                for name in filenames:
+                    try:
+                        os.unlink(os.path.join(dirpath, name))
+                        job.files += 1
+                    except OSError as e:
+                        errors.append(e)
+                for name in dirnames:
+                    p = os.path.join(dirpath, name)
+                    try:
+                        # os.walk lists symlinks to directories without
+                        # following them
+                        if os.path.islink(p):
+                            os.unlink(p)
+                            job.files += 1
+                        else:
+                            os.rmdir(p)
+                            job.dirs += 1
+                    except OSError as e:
+                        errors.append(e)
+            os.rmdir(root)
+            job.dirs += 1
+            job.status = "done"
+        except Exception as e:
+            job.status = "error"
+            job.error = str(errors[0] if errors else e)
+        finally:
+            job.finished = time.time()
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.status != "running"]
+        for job in sorted(finished, key=lambda j: j.finished)[:max(len(finished) - MAX_FINISHED, 0)]:
+            del self._jobs[job.id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "running": sum(j.status == "running" for j in jobs),
+            "failed": sum(j.status == "error" for j in jobs),
+        }
+
+
+class LoopLagMonitor:
+    """Measures event-loop lag: how late a short sleep wakes up.
+
+    Anything that blocks the loop (a synchronous read, a big JSON dump, a
+    tree walk) delays every connection by the same amount and shows up
+    here directly.
+    """
+
+    def __init__(self, interval=0.1, window=600, on_sample=None):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+        self.on_sample = on_sample
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started - self.interval, 0.0)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if self.on_sample is not None:
+                self.on_sample(lag)
+
+    def stats(self) -> dict:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {"samples": 0}
+
+        def pct(p):
+            return round(ordered[min(int(len(ordered) * p), len(ordered) - 1)] * 1000, 2)
+
+        return {
+            "samples": len(ordered),
+            "current_ms": round(self.samples[-1] * 1000, 2),
+            "p50_ms": pct(0.5),
+            "p99_ms": pct(0.99),
+            "window_max_ms": round(ordered[-1] * 1000, 2),
+            "max_ms": round(self.max_lag * 1000, 2),
+        }
@@ -0,0 +1,221 @@
+import ast
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+INDEXED_SUFFIXES = {'.py', '.js', '.json'}
+SNIPPET_LINES = 20
+# Internal data dirs (.onpoint_versions, .onpoint_index) never get indexed
+SKIP_PREFIX = '.onpoint'
+
+
+def walk_workspace(dir_path: Path, skip_dirs=()):
+    # Yields (path, is_dir, stat) depth-first in sorted order, matching the
+    # layout the old recursive_index produced.
+    try:
+        with os.scandir(dir_path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.name.startswith(SKIP_PREFIX):
+            continue
+        try:
+            # Symlinks are skipped outright: following them can loop forever
+            # or pull in files from outside the workspace
+            if entry.is_symlink():
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name in skip_dirs:
+                    continue
+                yield Path(entry.path), True, None
+                yield from walk_workspace(Path(entry.path), skip_dirs)
+            elif entry.is_file(follow_symlinks=False):
+                yield Path(entry.path), False, entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+
+
+def _collect_symbols(node, parent=None, out=None):
+    # Depth-first so symbols come out in source order, with methods
+    # attributed to the class that defines them
+    if out is None:
+        out = []
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, ast.ClassDef):
+            out.append({"name": child.name, "kind": "class", "line": child.lineno, "parent": parent})
+            _collect_symbols(child, child.name, out)
+        elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            if isinstance(node, ast.ClassDef):
+                kind = "method"
+            else:
+                kind = "function"
+            if isinstance(child, ast.AsyncFunctionDef):
+                kind = "async_" + kind
+            out.append({"name": child.name, "kind": kind, "line": child.lineno, "parent": parent})
+            _collect_symbols(child, child.name, out)
+        else:
+            _collect_symbols(child, parent, out)
+    return out
+
+
+def parse_source(code: str, suffix: str):
+    funcs, classes, symbols = [], [], []
+    if suffix == '.py':
+        try:
+            symbols = _collect_symbols(ast.parse(code))
+        except Exception:
+            pass
+        funcs = [s["name"] for s in symbols if s["kind"] != "class"]
+        classes = [s["name"] for s in symbols if s["kind"] == "class"]
+    return funcs, classes, symbols
+
+
+def index_file(path: Path, rel_path: str, st=None) -> dict:
+    if st is None:
+        st = path.stat()
+    try:
+        data = path.read_bytes()
+    except Exception:
+        data = b''
+    code = data.decode('utf-8', errors='ignore')
+    funcs, classes, symbols = parse_source(code, path.suffix)
+    return {
+        "path": rel_path,
+        "type": path.suffix[1:],
+        "functions": funcs,
+        "classes": classes,
+        "symbols": symbols,
+        "snippet": '\n'.join(code.splitlines()[:SNIPPET_LINES]),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "hash": hashlib.sha1(data).hexdigest(),
+    }
+
+
+def _index_job(job):
+    path, rel, size, mtime_ns = job
+    item = index_file(Path(path), rel)
+    # Keep the stat taken during the walk so the next diff lines up with it
+    item["size"], item["mtime_ns"] = size, mtime_ns
+    return item
+
+
+# Parsing is CPU-bound: more processes than CPUs only adds overhead
+MAX_WORKERS = os.cpu_count() or 1
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def clamp_workers(workers: int) -> int:
+    return max(1, min(workers, MAX_WORKERS))
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    # One shared pool. A request for another size replaces it; the old one
+    # finishes the chunks already queued on it and then exits
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn: forking a threaded server process is not safe
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def parse_files(jobs, workers: int = 1, chunksize: int = 0):
+    """Parse (path, rel, size, mtime_ns) jobs, yielding records in job order.
+
+    With workers > 1 (capped at MAX_WORKERS) the parsing is fanned out over
+    a process pool in chunks so each IPC round-trip carries several files.
+    """
+    workers = clamp_workers(workers)
+    if workers <= 1 or len(jobs) < 2:
+        for job in jobs:
+            yield _index_job(job)
+        return
+    if chunksize <= 0:
+        chunksize = max(1, min(64, len(jobs) // (workers * 4)))
+    yield from _get_pool(workers).map(_index_job, jobs, chunksize=chunksize)
+
+
+def shutdown_pools():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+class IndexCancelled(Exception):
+    pass
+
+
+def build_index(dir_path: Path, base_dir: Path, known=None, exclude=(), workers: int = 1,
+                stats=None, cancel=None):
+    """Diff dir_path against the records in known (path -> size/mtime_ns/hash),
+    re-parsing only files whose size/mtime changed and whose content hash no
+    longer matches.
+
+    workers > 1 parses the changed files on a process pool. stats, if given,
+    is updated in place as the walk progresses so a caller on another thread
+    can report it; setting the cancel event aborts with IndexCancelled.
+
+    Returns (changes, stats): changes holds the records to upsert, the
+    mtimes to refresh for touched-but-identical files, and removed paths.
+    """
+    known = known or {}
+    exclude = {Path(p) for p in exclude}
+    upserts, touched, jobs = [], {}, []
+    if stats is None:
+        stats = {}
+    stats.update({"scanned": 0, "reused": 0, "parsed": 0, "removed": 0})
+    seen = set()
+    for path, is_dir, st in walk_workspace(dir_path):
+        if cancel is not None and cancel.is_set():
+            raise IndexCancelled()
+        stats["scanned"] += 1
+        rel = str(path.relative_to(base_dir))
+        if is_dir:
+            seen.add(rel)
+            if rel not in known:
+                upserts.append({"path": rel, "type": "directory"})
+            continue
+        if path.suffix not in INDEXED_SUFFIXES or path in exclude:
+            continue
+        seen.add(rel)
+        old = known.get(rel)
+        if old and old.get("size") == st.st_size and old.get("mtime_ns") == st.st_mtime_ns:
+            stats["reused"] += 1
+            continue
+        if old and old.get("hash") and old.get("size") == st.st_size:
+            # Touched but maybe not edited: compare content before re-parsing.
+            try:
+                digest = hashlib.sha1(path.read_bytes()).hexdigest()
+            except OSError:
+                digest = None
+            if digest == old["hash"]:
+                touched[rel] = st.st_mtime_ns
+                stats["reused"] += 1
+                continue
+        jobs.append((str(path), rel, st.st_size, st.st_mtime_ns))
+    stats["to_parse"] = len(jobs)
+    results = parse_files(jobs, workers)
+    try:
+        for item in results:
+            if cancel is not None and cancel.is_set():
+                raise IndexCancelled()
+            upserts.append(item)
+            stats["parsed"] += 1
+    finally:
+        results.close()
+    removed = sorted(set(known) - seen)
+    stats["removed"] = sum(1 for p in removed if known[p].get("type") != "directory")
+    return {"upsert": upserts, "touched": touched, "removed": removed}, stats
@@ -0,0 +1,90 @@
+import asyncio
+
+from env import env_int
+
+
+def trim_context(code: str, cursor: int, max_prefix: int, max_suffix: int):
+    """Window of code around cursor, cut at line boundaries where possible."""
+    cursor = max(0, min(cursor, len(code)))
+    prefix, suffix = code[:cursor], code[cursor:]
+    if len(prefix) > max_prefix:
+        prefix = prefix[-max_prefix:]
+        newline = prefix.find("\n")
+        if 0 <= newline < len(prefix) - 1:
+            prefix = prefix[newline + 1:]
+    if len(suffix) > max_suffix:
+        suffix = suffix[:max_suffix]
+        newline = suffix.rfind("\n")
+        if newline > 0:
+            suffix = suffix[:newline]
+    return prefix, suffix
+
+
+class _Session:
+    __slots__ = ("key", "task")
+
+    def __init__(self, key, task):
+        self.key = key
+        self.task = task
+
+
+class CompletionScheduler:
+    """Keeps at most one completion in flight per editor session.
+
+    A new request waits out a short debounce window before going upstream.
+    If another request from the same session arrives meanwhile, the older
+    one is cancelled (debouncing or not) and its caller gets superseded;
+    a request for the same context as the pending one just joins it.
+    """
+
+    def __init__(self, debounce=None, max_prefix=None, max_suffix=None):
+        self.debounce = debounce if debounce is not None else env_int("ONPOINT_COMPLETION_DEBOUNCE_MS", 75) / 1000
+        self.max_prefix = max_prefix or env_int("ONPOINT_COMPLETION_PREFIX_CHARS", 4000)
+        self.max_suffix = max_suffix or env_int("ONPOINT_COMPLETION_SUFFIX_CHARS", 1000)
+        self._sessions = {}
+        self.counters = {"requests": 0, "superseded": 0, "coalesced": 0, "completed": 0, "errors": 0}
+
+    async def _run(self, compute):
+        await asyncio.sleep(self.debounce)
+        return await compute()
+
+    async def submit(self, session_id: str, key, compute):
+        """Return (superseded, result). key identifies the trimmed context;
+        compute() is only called once the debounce window has passed."""
+        self.counters["requests"] += 1
+        session = self._sessions.get(session_id)
+        if session is not None and session.key == key and not session.task.done():
+            self.counters["coalesced"] += 1
+            task = session.task
+        else:
+            if session is not None and not session.task.done():
+                session.task.cancel()
+            task = asyncio.ensure_future(self._run(compute))
+            session = self._sessions[session_id] = _Session(key, task)
+            task.add_done_callback(lambda t, s=session_id, own=session: self._finished(s, own, t))
+        # wait() does not cancel the task when this caller is cancelled, and
+        # does not raise when the task is cancelled by a newer request
+        await asyncio.wait({task})
+        if task.cancelled():
+            self.counters["superseded"] += 1
+            return True, None
+        return False, task.result()
+
+    def _finished(self, session_id, session, task):
+        if self._sessions.get(session_id) is session:
+            del self._sessions[session_id]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.counters["errors"] += 1
+        else:
+            self.counters["completed"] += 1
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "pending": len(self._sessions),
+            "debounce_ms": round(self.debounce * 1000),
+            "max_prefix_chars": self.max_prefix,
+            "max_suffix_chars": self.max_suffix,
+        }
@@ -0,0 +1,159 @@
+import re
+import threading
+from collections import OrderedDict
+
+from env import env_int
+
+# Rough chars-per-token for code and English; good enough for budgeting
+# without pulling in a provider tokenizer
+CHARS_PER_TOKEN = 4
+DEFAULT_BUDGET = 8000
+# Shares of the budget for the workspace outline and the chat history; the
+# ranked snippets get whatever is left
+PREFIX_SHARE = 0.25
+HISTORY_SHARE = 0.35
+CACHE_SIZE = 32
+
+_WORD = re.compile(r"[A-Za-z][A-Za-z0-9]*")
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z0-9]+|[A-Z]+")
+_STOPWORDS = {
+    "the", "and", "for", "this", "that", "with", "what", "how", "does", "can", "you",
+    "are", "is", "it", "in", "of", "to", "a", "an", "on", "me", "my", "do", "why",
+    "self", "return", "def", "class", "import", "from", "none", "true", "false",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def terms(text: str) -> set:
+    """Lower-cased words of text, with snake_case and camelCase identifiers
+    also split into their parts."""
+    out = set()
+    for word in _WORD.findall(text):
+        lower = word.lower()
+        if lower not in _STOPWORDS and len(lower) > 1:
+            out.add(lower)
+        for part in _CAMEL.findall(word):
+            part = part.lower()
+            if part not in _STOPWORDS and len(part) > 2:
+                out.add(part)
+    return out
+
+
+def default_budget() -> int:
+    return env_int("ONPOINT_CHAT_CONTEXT_TOKENS", DEFAULT_BUDGET)
+
+
+def format_entry(item: dict) -> str:
+    text = f"\n- File: {item['path']} ({item['type']})"
+    if item.get('functions'):
+        text += f"\n  Functions: {', '.join(item['functions'])}"
+    if item.get('classes'):
+        text += f"\n  Classes: {', '.join(item['classes'])}"
+    text += f"\n  Snippet:\n{item['snippet']}\n"
+    return text
+
+
+class _Workspace:
+    __slots__ = ("fingerprint", "prefix", "entries")
+
+    def __init__(self, fingerprint, prefix, entries):
+        self.fingerprint = fingerprint
+        self.prefix = prefix
+        self.entries = entries
+
+
+class ContextAssembler:
+    """Builds chat prompts that fit a token budget.
+
+    The workspace part that does not depend on the conversation (directory
+    listing plus a one-line outline per indexed file) is built once per
+    index fingerprint and reused across turns. Full snippets are ranked
+    against the latest user message and packed until the budget runs out.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def workspace(self, key: str, fingerprint, build_prefix, load_items, prefix_budget: int):
+        """Cached (prefix, entries) for a workspace. build_prefix(outline)
+        returns the prefix text; load_items() returns the index entries."""
+        cache_key = (key, prefix_budget)
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached is not None and cached.fingerprint == fingerprint:
+                self._cache.move_to_end(cache_key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        items = [i for i in load_items() if i['type'] != 'directory']
+        # Newest files first so the outline keeps them when it is truncated
+        items.sort(key=lambda i: -(i.get('mtime_ns') or 0))
+        entries = []
+        for rank, item in enumerate(items):
+            entries.append({
+                "item": item,
+                "text": format_entry(item),
+                "symbol_terms": terms(' '.join(item.get('functions', []) + item.get('classes', []))),
+                "path_terms": terms(item['path']),
+                "snippet_terms": terms(item.get('snippet', '')),
+                "recency": 1.0 - rank / max(len(items), 1),
+            })
+        outline, used = [], 0
+        for entry in entries:
+            item = entry["item"]
+            names = item.get('functions', []) + item.get('classes', [])
+            line = f"- {item['path']}" + (f": {', '.join(names[:12])}" if names else "")
+            cost = estimate_tokens(line)
+            if used + cost > prefix_budget:
+                outline.append(f"- ... {len(entries) - len(outline)} more files")
+                break
+            outline.append(line)
+            used += cost
+        workspace = _Workspace(fingerprint, build_prefix('\n'.join(outline)), entries)
+        with self._lock:
+            self._cache[cache_key] = workspace
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        return workspace
+
+    @staticmethod
+    def rank(entries, query: str, open_file: str = None):
+        query_terms = terms(query)
+        scored = []
+        for entry in entries:
+            score = (
+                3.0 * len(query_terms & entry["symbol_terms"])
+                + 2.0 * len(query_terms & entry["path_terms"])
+                + 1.0 * len(query_terms & entry["snippet_terms"])
+            )
+            if open_file and entry["item"]['path'] == open_file:
+                score += 10.0
+            if score <= 0:
+                continue
+            scored.append((score + entry["recency"], entry))
+        scored.sort(key=lambda s: -s[0])
+        return [entry for _, entry in scored]
+
+    @staticmethod
+    def pack(texts, budget: int):
+        # Greedy in the given order; entries that do not fit are skipped so
+        # smaller ones further down can still use the space
+        picked, used = [], 0
+        for text in texts:
+            cost = estimate_tokens(text)
+            if used + cost <= budget:
+                picked.append(text)
+                used += cost
+        return picked, used
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"workspaces": len(self._cache), "hits": self.hits, "misses": self.misses}
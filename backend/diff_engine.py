@@ -0,0 +1,242 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Myers' search runs in linear space (divide and conquer on the middle
+# snake). Past this many steps in total the remaining unmatched ranges are
+# reported as plain replacements, so a diff of two unrelated files costs
+# bounded time instead of O(ND)
+MAX_DIFF_COST = 2_000_000
+# Checked before hashing or diffing anything
+MAX_DIFF_BYTES = 8 * 1024 * 1024
+MAX_DIFF_LINES = 200_000
+CACHE_SIZE = 256
+
+
+class DiffTooLarge(ValueError):
+    pass
+
+
+def intern_lines(a_lines, b_lines):
+    # Map every distinct line to a small int so comparisons are int compares
+    table = {}
+    a_ids = [table.setdefault(line, len(table)) for line in a_lines]
+    b_ids = [table.setdefault(line, len(table)) for line in b_lines]
+    return a_ids, b_ids
+
+
+def _middle_snake(a, a0, a1, b, b0, b1, budget):
+    """The middle snake of a[a0:a1] against b[b0:b1], found by running the
+    search from both ends at once. Returns (x, y, u, v) relative to a0/b0,
+    or None once budget[0] steps have been spent."""
+    n, m = a1 - a0, b1 - b0
+    delta = n - m
+    odd = delta & 1
+    off = (n + m + 1) // 2 + 1
+    vf = [0] * (2 * off + 1)
+    vb = [0] * (2 * off + 1)
+    for d in range(off):
+        budget[0] -= 2 * d + 1
+        if budget[0] < 0:
+            return None
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[off + k - 1] < vf[off + k + 1]):
+                x = vf[off + k + 1]
+            else:
+                x = vf[off + k - 1] + 1
+            y = x - k
+            sx, sy = x, y
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1
+                y += 1
+            vf[off + k] = x
+            c = delta - k
+            if odd and -d < c < d and x + vb[off + c] >= n:
+                return sx, sy, x, y
+        for c in range(-d, d + 1, 2):
+            if c == -d or (c != d and vb[off + c - 1] < vb[off + c + 1]):
+                x = vb[off + c + 1]
+            else:
+                x = vb[off + c - 1] + 1
+            y = x - c
+            sx, sy = x, y
+            while x < n and y < m and a[a1 - 1 - x] == b[b1 - 1 - y]:
+                x += 1
+                y += 1
+            vb[off + c] = x
+            k = delta - c
+            if not odd and -d <= k <= d and x + vf[off + k] >= n:
+                return n - x, m - y, n - sx, m - sy
+    return None
+
+
+def _diff_ops(a, a0, a1, b, b0, b1, ops, budget):
+    # Appends one op per line ('equal', 'delete' or 'insert') to ops
+    prefix = 0
+    while a0 + prefix < a1 and b0 + prefix < b1 and a[a0 + prefix] == b[b0 + prefix]:
+        prefix += 1
+    ops.extend(["equal"] * prefix)
+    a0 += prefix
+    b0 += prefix
+    suffix = 0
+    while a0 < a1 - suffix and b0 < b1 - suffix and a[a1 - 1 - suffix] == b[b1 - 1 - suffix]:
+        suffix += 1
+    a1 -= suffix
+    b1 -= suffix
+    if a0 == a1 or b0 == b1:
+        snake = None
+    else:
+        snake = _middle_snake(a, a0, a1, b, b0, b1, budget)
+    if snake is None:
+        ops.extend(["delete"] * (a1 - a0))
+        ops.extend(["insert"] * (b1 - b0))
+    else:
+        x, y, u, v = snake
+        _diff_ops(a, a0, a0 + x, b, b0, b0 + y, ops, budget)
+        ops.extend(["equal"] * (u - x))
+        _diff_ops(a, a0 + u, a1, b, b0 + v, b1, ops, budget)
+    ops.extend(["equal"] * suffix)
+
+
+def _ops_to_opcodes(ops, i=0, j=0):
+    # Collapse per-line ops into difflib-style opcodes; a run of deletes and
+    # inserts between two equal runs becomes one 'replace'
+    opcodes = []
+    pos = 0
+    while pos < len(ops):
+        if ops[pos] == "equal":
+            start = pos
+            while pos < len(ops) and ops[pos] == "equal":
+                pos += 1
+            count = pos - start
+            opcodes.append(("equal", i, i + count, j, j + count))
+            i += count
+            j += count
+            continue
+        dels = ins = 0
+        while pos < len(ops) and ops[pos] != "equal":
+            if ops[pos] == "delete":
+                dels += 1
+            else:
+                ins += 1
+            pos += 1
+        tag = "replace" if dels and ins else ("delete" if dels else "insert")
+        opcodes.append((tag, i, i + dels, j, j + ins))
+        i += dels
+        j += ins
+    return opcodes
+
+
+def diff_opcodes(a_lines, b_lines):
+    a, b = intern_lines(a_lines, b_lines)
+    ops = []
+    _diff_ops(a, 0, len(a), b, 0, len(b), ops, [MAX_DIFF_COST])
+    return _ops_to_opcodes(ops)
+
+
+def group_opcodes(opcodes, n=3):
+    # Same grouping as difflib.SequenceMatcher.get_grouped_opcodes
+    codes = list(opcodes)
+    if not codes:
+        codes = [("equal", 0, 1, 0, 1)]
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+    nn = n + n
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > nn:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def _format_range(start, stop):
+    # Unified diff range syntax, as in difflib
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def build_hunks(a_lines, b_lines, context=3):
+    hunks = []
+    added = removed = 0
+    for group in group_opcodes(diff_opcodes(a_lines, b_lines), context):
+        first, last = group[0], group[-1]
+        hunk = {
+            "old_start": first[1] + 1,
+            "old_lines": last[2] - first[1],
+            "new_start": first[3] + 1,
+            "new_lines": last[4] - first[3],
+            "header": f"@@ -{_format_range(first[1], last[2])} +{_format_range(first[3], last[4])} @@",
+            "lines": [],
+        }
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                hunk["lines"].extend({"op": " ", "text": line} for line in a_lines[i1:i2])
+                continue
+            if tag in ("replace", "delete"):
+                hunk["lines"].extend({"op": "-", "text": line} for line in a_lines[i1:i2])
+                removed += i2 - i1
+            if tag in ("replace", "insert"):
+                hunk["lines"].extend({"op": "+", "text": line} for line in b_lines[j1:j2])
+                added += j2 - j1
+        hunks.append(hunk)
+    return hunks, {"added": added, "removed": removed}
+
+
+def render_unified(hunks, fromfile="a", tofile="b"):
+    if not hunks:
+        return ""
+    out = [f"--- {fromfile}", f"+++ {tofile}"]
+    for hunk in hunks:
+        out.append(hunk["header"])
+        out.extend(line["op"] + line["text"] for line in hunk["lines"])
+    return "\n".join(out)
+
+
+class DiffCache:
+    """LRU of computed diffs keyed by the content hashes of both sides."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def diff(self, a_text: str, b_text: str, context: int = 3):
+        # len() is characters, a lower bound on the encoded size
+        if len(a_text) + len(b_text) > MAX_DIFF_BYTES:
+            raise DiffTooLarge(f"Diff inputs are limited to {MAX_DIFF_BYTES} bytes")
+        a_lines, b_lines = a_text.splitlines(), b_text.splitlines()
+        if len(a_lines) + len(b_lines) > MAX_DIFF_LINES:
+            raise DiffTooLarge(f"Diff inputs are limited to {MAX_DIFF_LINES} lines")
+        a_hash = hashlib.sha256(a_text.encode("utf-8", errors="surrogatepass")).hexdigest()
+        b_hash = hashlib.sha256(b_text.encode("utf-8", errors="surrogatepass")).hexdigest()
+        key = (a_hash, b_hash, context)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return {**cached, "cached": True}
+            self.misses += 1
+        hunks, stats = build_hunks(a_lines, b_lines, context)
+        result = {"a_hash": a_hash, "b_hash": b_hash, "hunks": hunks, "stats": stats}
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return {**result, "cached": False}
@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import json
+import os
+from collections import deque
+from pathlib import Path
+
+# Entries returned by one depth > 1 listing, across all levels
+MAX_TREE_ENTRIES = 10000
+
+
+def _sort_key(entry: dict):
+    # Directories first, then case-insensitive name with the exact name as a
+    # tie-breaker so the order is total and stable across calls
+    return (not entry["is_dir"], entry["name"].casefold(), entry["name"])
+
+
+def scan_dir(dir_path: Path):
+    """One scandir pass per directory; DirEntry caches the type and stat so
+    nothing is stat'ed twice."""
+    entries = []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+                is_link = entry.is_symlink()
+                try:
+                    st = entry.stat()
+                except OSError:
+                    # A broken symlink: list the link itself
+                    st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            entries.append({
+                "name": entry.name,
+                "is_dir": is_dir,
+                "is_link": is_link,
+                "size": None if is_dir else st.st_size,
+                "mtime": st.st_mtime,
+            })
+    entries.sort(key=_sort_key)
+    return entries
+
+
+def encode_cursor(entry: dict) -> str:
+    raw = json.dumps([entry["is_dir"], entry["name"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    is_dir, name = json.loads(raw)
+    return _sort_key({"is_dir": bool(is_dir), "name": str(name)})
+
+
+def paginate(entries, cursor: str = None, limit: int = None):
+    """Returns (page, next_cursor). The cursor names the last entry served,
+    so entries added or removed elsewhere in the directory do not shift the
+    next page."""
+    start = 0
+    if cursor:
+        after = decode_cursor(cursor)
+        while start < len(entries) and _sort_key(entries[start]) <= after:
+            start += 1
+    end = len(entries) if not limit else min(len(entries), start + limit)
+    page = entries[start:end]
+    next_cursor = encode_cursor(page[-1]) if page and end < len(entries) else None
+    return page, next_cursor
+
+
+def list_tree(dir_path: Path, entries, depth: int, load, max_entries=MAX_TREE_ENTRIES):
+    """Returns (entries, truncated): entries of dir_path with the subtree of
+    each directory under "children", depth levels deep in all.
+
+    load(dir_path) returns the sorted entries of one directory. Levels are
+    filled breadth first until max_entries is reached; directories left
+    unexpanded then have no "children" and truncated is True. Symlinked
+    directories are listed but never entered, so the walk cannot leave
+    the workspace or loop.
+    """
+    result = list(entries)
+    count = len(result)
+    queue = deque([(dir_path, result, depth)])
+    while queue:
+        path, level, depth = queue.popleft()
+        if depth <= 1:
+            continue
+        for i, entry in enumerate(level):
+            if not entry["is_dir"] or entry.get("is_link"):
+                continue
+            try:
+                # A copy: load may return a cached list
+                children = list(load(path / entry["name"]))
+            except OSError:
+                children = []
+            count += len(children)
+            if count > max_entries:
+                return result, True
+            level[i] = dict(entry, children=children)
+            queue.append((path / entry["name"], children, depth - 1))
+    return result, False
+
+
+def listing_etag(payload) -> str:
+    digest = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison of etag against an If-None-Match header's list of
+    entity tags."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == opaque:
+            return True
+    return False
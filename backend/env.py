@@ -0,0 +1,16 @@
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    """int from the environment; default when unset or not a number."""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return float(default)
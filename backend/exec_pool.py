@@ -0,0 +1,400 @@
+import asyncio
+import codecs
+import os
+import resource
+import shutil
+import signal
+import tempfile
+import time
+from collections import deque
+
+from env import env_float, env_int
+
+# The interpreters start idle and block reading the script from the fd
+# passed as their first argument, so a job only pays for running the code
+PYTHON_BOOTSTRAP = r"""
+import os, sys
+def _run():
+    fd = int(sys.argv.pop(1))
+    chunks = []
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(fd)
+    source = b"".join(chunks).decode("utf-8")
+    # There is no script.py on disk; let tracebacks show source lines anyway
+    import linecache
+    linecache.cache["script.py"] = (len(source), None, source.splitlines(True), "script.py")
+    sys.argv[0] = "script.py"
+    # Run in a real __main__ module so pickle and multiprocessing can find
+    # classes and functions the script defines, as with `python3 script.py`
+    import types
+    main = types.ModuleType("__main__")
+    main.__file__ = "script.py"
+    main.__builtins__ = __builtins__
+    sys.modules["__main__"] = main
+    try:
+        code = compile(source, "script.py", "exec")
+        exec(code, main.__dict__)
+    except SystemExit:
+        raise
+    except BaseException as e:
+        import traceback
+        # Hide this bootstrap's own frame from the user's traceback
+        tb = None if isinstance(e, SyntaxError) else e.__traceback__.tb_next
+        traceback.print_exception(type(e), e, tb)
+        sys.exit(1)
+_run()
+"""
+
+NODE_BOOTSTRAP = r"""
+const fs = require('fs'), path = require('path'), Module = require('module');
+const fd = Number(process.argv[1]);
+const source = fs.readFileSync(fd, 'utf8');
+fs.closeSync(fd);
+const filename = path.join(process.cwd(), 'script.js');
+process.argv.splice(1, 1, filename);
+const m = new Module(filename, null);
+m.filename = filename;
+m.paths = Module._nodeModulePaths(process.cwd());
+m._compile(source, filename);
+"""
+
+LANGUAGES = ("python", "javascript")
+
+
+class Worker:
+    """One pre-started interpreter in its own scratch directory and process
+    group. Runs a single job and is then thrown away."""
+
+    def __init__(self, language, proc, code_fd, workdir, run_io=asyncio.to_thread):
+        self.language = language
+        self.proc = proc
+        self.code_fd = code_fd
+        self.workdir = workdir
+        self.run_io = run_io
+        self.warm = False
+
+    @property
+    def alive(self):
+        return self.proc.returncode is None
+
+    async def send_code(self, code: str):
+        # Blocking writes off the loop; the child is already reading
+        data = code.encode("utf-8")
+        fd, self.code_fd = self.code_fd, None
+
+        def write_all():
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
+
+        await self.run_io(write_all)
+
+    def kill(self):
+        if self.alive:
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    async def dispose(self):
+        self.kill()
+        if self.code_fd is not None:
+            os.close(self.code_fd)
+            self.code_fd = None
+        try:
+            await self.proc.wait()
+        except Exception:
+            pass
+        # Programs can leave any number of files behind
+        await self.run_io(shutil.rmtree, self.workdir, ignore_errors=True)
+
+
+class Job:
+    """One execution: waits for a slot, runs on a worker and reports events
+    through emit(). stdin and kill can be used while it runs."""
+
+    def __init__(self, pool, language, code, timeout, interactive):
+        self.pool = pool
+        self.language = language
+        self.code = code
+        self.timeout = timeout
+        self.interactive = interactive
+        self.worker = None
+        self.killed = False
+        self._stdin_lock = asyncio.Lock()
+
+    async def write_stdin(self, data: str):
+        worker = self.worker
+        if worker is None or worker.proc.stdin.is_closing():
+            return
+        async with self._stdin_lock:
+            try:
+                worker.proc.stdin.write(data.encode("utf-8"))
+                await worker.proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    def close_stdin(self):
+        if self.worker is not None and not self.worker.proc.stdin.is_closing():
+            self.worker.proc.stdin.close()
+
+    def kill(self):
+        self.killed = True
+        if self.worker is not None:
+            self.worker.kill()
+
+    async def _pump(self, stream, name, emit, budget):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            chunk = await stream.read(65536)
+            if not chunk:
+                break
+            # Past the cap keep reading so the child never blocks on a full pipe
+            over = len(chunk) > budget["left"]
+            chunk = chunk[:max(budget["left"], 0)]
+            budget["left"] -= len(chunk)
+            text = decoder.decode(chunk) if chunk else ""
+            if text:
+                await emit({"type": name, "data": text})
+            if over and budget["truncated"] is None:
+                budget["truncated"] = name
+                await emit({"type": "truncated", "stream": name, "limit": self.pool.max_output})
+        tail = decoder.decode(b"", final=True)
+        if tail and not budget["truncated"]:
+            await emit({"type": name, "data": tail})
+
+    async def run(self, emit) -> dict:
+        pool = self.pool
+        queued_at = time.perf_counter()
+        pool.queued += 1
+        try:
+            await pool.slot().acquire()
+        finally:
+            pool.queued -= 1
+        pool.running += 1
+        result = {"exit_code": None, "timed_out": False, "killed": False, "truncated": False,
+                  "queue_wait_ms": 0.0, "run_ms": 0.0, "warm": False, "error": None}
+        try:
+            if self.killed:
+                result.update(exit_code=-1, killed=True)
+                return result
+            try:
+                self.worker = worker = await pool.acquire(self.language)
+            except Exception as e:
+                result["queue_wait_ms"] = round((time.perf_counter() - queued_at) * 1000, 1)
+                result.update(exit_code=-2, error=str(e))
+                pool.record(result["queue_wait_ms"], 0.0, error=True)
+                return result
+            started = time.perf_counter()
+            result["queue_wait_ms"] = round((started - queued_at) * 1000, 1)
+            result["warm"] = worker.warm
+            await emit({"type": "started", "queue_wait_ms": result["queue_wait_ms"], "warm": worker.warm})
+            if not self.interactive:
+                worker.proc.stdin.close()
+            await worker.send_code(self.code)
+            if self.killed:
+                worker.kill()
+            budget = {"left": pool.max_output, "truncated": None}
+            pumps = asyncio.gather(
+                self._pump(worker.proc.stdout, "stdout", emit, budget),
+                self._pump(worker.proc.stderr, "stderr", emit, budget),
+            )
+            try:
+                await asyncio.wait_for(asyncio.shield(pumps), self.timeout)
+            except asyncio.TimeoutError:
+                result["timed_out"] = True
+                worker.kill()
+                await pumps
+            await worker.proc.wait()
+            result["run_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            result["killed"] = self.killed
+            result["truncated"] = budget["truncated"] is not None
+            result["exit_code"] = -1 if result["timed_out"] or self.killed else worker.proc.returncode
+            pool.record(result["queue_wait_ms"], result["run_ms"], timed_out=result["timed_out"])
+            return result
+        finally:
+            pool.running -= 1
+            pool.slot().release()
+            if self.worker is not None:
+                await self.worker.dispose()
+
+
+class ExecutionPool:
+    """Pre-warmed, rlimit-capped interpreter workers for code execution.
+
+    Keeps `warm` idle workers per language ready, and lets at most
+    `concurrency` jobs run at once; the rest wait in FIFO order. Each job
+    gets a fresh process, refilled in the background after it is taken.
+    """
+
+    def __init__(self, warm=None, concurrency=None, timeout=None, memory_mb=None, cpu_seconds=None,
+                 max_output=None, run_io=None):
+        self.warm = warm if warm is not None else env_int("ONPOINT_EXEC_WARM", 2)
+        self.concurrency = concurrency or env_int("ONPOINT_EXEC_CONCURRENCY", os.cpu_count() or 2)
+        self.timeout = timeout or env_float("ONPOINT_EXEC_TIMEOUT", 6)
+        self.memory_mb = memory_mb or env_int("ONPOINT_EXEC_MEMORY_MB", 512)
+        self.cpu_seconds = cpu_seconds or env_int("ONPOINT_EXEC_CPU_SECONDS", int(self.timeout) + 1)
+        # Interactive runs wait on the user for stdin, so get a longer limit
+        self.interactive_timeout = env_float("ONPOINT_EXEC_INTERACTIVE_TIMEOUT", 300)
+        # Bytes of stdout + stderr kept per job; the rest is drained and dropped
+        self.max_output = max_output or env_int("ONPOINT_EXEC_MAX_OUTPUT", 1024 * 1024)
+        # Runs blocking calls (code pipe writes, scratch dir cleanup)
+        self.run_io = run_io or asyncio.to_thread
+        self._idle = {language: deque() for language in LANGUAGES}
+        self._spawning = {language: 0 for language in LANGUAGES}
+        self._semaphore = None
+        self.queued = 0
+        self.running = 0
+        self.counters = {
+            "completed": 0, "timeouts": 0, "errors": 0, "warm_starts": 0, "cold_starts": 0,
+            # Every finished job, whatever the outcome; the averages use it
+            "jobs_total": 0, "queue_wait_ms_total": 0.0, "run_ms_total": 0.0,
+        }
+
+    def command(self, language, code_fd):
+        if language == "python":
+            return ["python3", "-c", PYTHON_BOOTSTRAP, str(code_fd)]
+        # V8 reserves far more address space than it uses, so node is
+        # capped by heap size instead of RLIMIT_AS
+        return ["node", f"--max-old-space-size={self.memory_mb}", "-e", NODE_BOOTSTRAP, str(code_fd)]
+
+    def _limits(self, language):
+        memory = self.memory_mb * 1024 * 1024
+        cpu = self.cpu_seconds
+
+        def apply():
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+            resource.setrlimit(resource.RLIMIT_FSIZE, (64 * 1024 * 1024,) * 2)
+            if language == "python":
+                resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+        return apply
+
+    async def spawn(self, language) -> Worker:
+        workdir = tempfile.mkdtemp(prefix=f"onpoint-exec-{language}-")
+        read_fd, write_fd = os.pipe()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *self.command(language, read_fd),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=workdir,
+                pass_fds=(read_fd,),
+                preexec_fn=self._limits(language),
+                start_new_session=True,
+            )
+        except BaseException:
+            os.close(write_fd)
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise
+        finally:
+            os.close(read_fd)
+        return Worker(language, proc, write_fd, workdir, self.run_io)
+
+    async def _refill(self, language):
+        idle = self._idle[language]
+        while len(idle) + self._spawning[language] < self.warm:
+            self._spawning[language] += 1
+            try:
+                idle.append(await self.spawn(language))
+            except Exception:
+                return
+            finally:
+                self._spawning[language] -= 1
+
+    async def prewarm(self):
+        for language in LANGUAGES:
+            if shutil.which("python3" if language == "python" else "node"):
+                await self._refill(language)
+
+    async def acquire(self, language) -> Worker:
+        """A ready worker for language: a warm one if available."""
+        idle = self._idle[language]
+        worker = None
+        while idle:
+            candidate = idle.popleft()
+            if candidate.alive:
+                worker = candidate
+                worker.warm = True
+                break
+            asyncio.ensure_future(candidate.dispose())
+        if worker is None:
+            self.counters["cold_starts"] += 1
+            worker = await self.spawn(language)
+        else:
+            self.counters["warm_starts"] += 1
+        if self.warm:
+            asyncio.ensure_future(self._refill(language))
+        return worker
+
+    def slot(self):
+        """Async context manager limiting how many jobs run at once."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def record(self, queue_wait_ms, run_ms, timed_out=False, error=False):
+        self.counters["jobs_total"] += 1
+        self.counters["queue_wait_ms_total"] += queue_wait_ms
+        self.counters["run_ms_total"] += run_ms
+        if timed_out:
+            self.counters["timeouts"] += 1
+        if error:
+            self.counters["errors"] += 1
+        if not timed_out and not error:
+            self.counters["completed"] += 1
+
+    def job(self, language: str, code: str, timeout: float = None, interactive: bool = False):
+        timeout = timeout or (self.interactive_timeout if interactive else self.timeout)
+        return Job(self, language, code, timeout, interactive)
+
+    async def run(self, language: str, code: str, timeout: float = None) -> dict:
+        """Run code to completion and return its buffered output."""
+        output = {"stdout": [], "stderr": []}
+
+        async def collect(event):
+            if event["type"] in output:
+                output[event["type"]].append(event["data"])
+            elif event["type"] == "truncated":
+                output[event["stream"]].append(f"\n[output truncated after {self.max_output} bytes]\n")
+
+        result = await self.job(language, code, timeout).run(collect)
+        stderr = "".join(output["stderr"])
+        if result["error"]:
+            stderr += f"Execution error: {result['error']}"
+        elif result["timed_out"]:
+            stderr += "Execution timed out."
+        return {
+            "stdout": "".join(output["stdout"]),
+            "stderr": stderr,
+            "exit_code": result["exit_code"],
+            "queue_wait_ms": result["queue_wait_ms"],
+            "run_ms": result["run_ms"],
+            "warm": result["warm"],
+            "truncated": result["truncated"],
+        }
+
+    async def close(self):
+        for idle in self._idle.values():
+            while idle:
+                await idle.popleft().dispose()
+
+    def stats(self) -> dict:
+        jobs = self.counters["jobs_total"] or 1
+        return {
+            **{k: v for k, v in self.counters.items() if not k.endswith("_total")},
+            "queued": self.queued,
+            "running": self.running,
+            "idle": {language: len(idle) for language, idle in self._idle.items()},
+            "concurrency": self.concurrency,
+            "avg_queue_wait_ms": round(self.counters["queue_wait_ms_total"] / jobs, 1),
+            "avg_run_ms": round(self.counters["run_ms_total"] / jobs, 1),
+        }
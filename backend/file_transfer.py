@@ -0,0 +1,380 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+CHUNK_SIZE = 1024 * 1024
+# Uploads not touched for this long are discarded
+UPLOAD_EXPIRY = 24 * 3600
+_RANGE = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int):
+    """(start, end) inclusive for a single-range Range header, or None to
+    serve the whole file (no header, several ranges or a malformed one)."""
+    if not header:
+        return None
+    m = _RANGE.match(header)
+    if not m:
+        return None
+    first, last = m.group(1), m.group(2)
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def iter_file(path: Path, start: int = 0, end: int = None, chunk_size: int = CHUNK_SIZE):
+    # end is inclusive; None reads to EOF
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def file_etag(st) -> str:
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    for chunk in iter_file(path):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fsync_dir(path: Path):
+    # Makes a rename in path durable, not just the renamed file's data
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def stage_file(target: Path, write, fsync: bool = False):
+    """Write a sibling temp file of target with write(f), carrying over
+    target's permissions. Returns (temp path, write's result)."""
+    fd, tmp = tempfile.mkstemp(dir=str(target.parent), prefix=f".{target.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            result = write(f)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if target.exists():
+            os.chmod(tmp, target.stat().st_mode & 0o7777)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return tmp, result
+
+
+def replace_with(target: Path, write, fsync: bool = False):
+    """Write a sibling temp file with write(f) and rename it over target,
+    so readers and crashes see either the old content or the new."""
+    tmp, result = stage_file(target, write, fsync)
+    try:
+        os.replace(tmp, target)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    if fsync:
+        fsync_dir(target.parent)
+    return result
+
+
+def write_atomic(target: Path, data: bytes, fsync: bool = False):
+    replace_with(target, lambda f: f.write(data), fsync)
+
+
+def write_batch(entries, fsync: bool = False):
+    """Atomically write several (target, data) pairs, all or nothing.
+
+    Everything is staged to temp files first, so a failed write leaves no
+    target touched. The renames then follow; if one fails, the targets
+    already replaced get their old content back from a hard link taken
+    just before their rename.
+    """
+    staged = []
+    try:
+        for target, data in entries:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            staged.append((target, stage_file(target, lambda f, d=data: f.write(d), fsync)[0]))
+    except BaseException:
+        for _, tmp in staged:
+            os.unlink(tmp)
+        raise
+    done = []
+    try:
+        for target, tmp in staged:
+            backup = None
+            if target.exists():
+                backup = tmp + ".old"
+                os.link(target, backup)
+            try:
+                os.replace(tmp, target)
+            except BaseException:
+                if backup:
+                    os.unlink(backup)
+                raise
+            done.append((target, backup))
+    except BaseException:
+        for target, backup in reversed(done):
+            if backup:
+                os.replace(backup, target)
+            else:
+                target.unlink(missing_ok=True)
+        for _, tmp in staged:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        raise
+    for _, backup in done:
+        if backup:
+            os.unlink(backup)
+    if fsync:
+        for parent in {target.parent for target, _ in staged}:
+            fsync_dir(parent)
+
+
+class PatchError(ValueError):
+    pass
+
+
+class UploadError(ValueError):
+    pass
+
+
+def _check_edits(edits, limit):
+    # Edits are [start, end) ranges with replacement text; they must be in
+    # bounds and must not overlap
+    ordered = sorted(edits, key=lambda e: (e["start"], e["end"]))
+    previous_end = 0
+    for edit in ordered:
+        if edit["start"] < 0 or edit["end"] < edit["start"] or edit["end"] > limit:
+            raise PatchError(f"Edit {edit['start']}-{edit['end']} is out of range (0-{limit})")
+        if edit["start"] < previous_end:
+            raise PatchError("Edits overlap")
+        previous_end = edit["end"]
+    return ordered
+
+
+def _copy(src, out, digest, count=None):
+    # Copy count bytes (None: to EOF) from src to out, hashing as we go
+    copied = 0
+    while count is None or copied < count:
+        chunk = src.read(CHUNK_SIZE if count is None else min(CHUNK_SIZE, count - copied))
+        if not chunk:
+            break
+        out.write(chunk)
+        digest.update(chunk)
+        copied += len(chunk)
+    return copied
+
+
+def _emit(out, digest, text: str):
+    data = text.encode("utf-8")
+    out.write(data)
+    digest.update(data)
+    return len(data)
+
+
+def patch_bytes(path: Path, edits, fsync: bool = False, before=None):
+    """Apply byte-offset edits by streaming the file into its replacement,
+    so memory use does not depend on file size. Returns (size, sha256).
+
+    before(), if given, runs once the edits are known to be valid and
+    before the file is touched.
+    """
+    ordered = _check_edits(edits, path.stat().st_size)
+    if before is not None:
+        before()
+
+    def write(out):
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, "rb") as src:
+            position = 0
+            for edit in ordered:
+                size += _copy(src, out, digest, edit["start"] - position)
+                size += _emit(out, digest, edit["text"])
+                position = edit["end"]
+                src.seek(position)
+            size += _copy(src, out, digest)
+        return size, digest.hexdigest()
+
+    return replace_with(path, write, fsync)
+
+
+def patch_lines(path: Path, edits, fsync: bool = False, before=None):
+    """Like patch_bytes, with start/end as 0-based line numbers. Replacement
+    text is inserted as-is, so it should carry its own line endings."""
+    with open(path, "rb") as f:
+        line_count = sum(1 for _ in f)
+    ordered = _check_edits(edits, line_count)
+    if before is not None:
+        before()
+
+    def write(out):
+        digest = hashlib.sha256()
+        size = 0
+        pending = list(ordered)
+        with open(path, "rb") as src:
+            lineno = 0
+            line = src.readline()
+            while True:
+                while pending and pending[0]["start"] == lineno:
+                    edit = pending.pop(0)
+                    size += _emit(out, digest, edit["text"])
+                    # Skip the replaced lines
+                    while lineno < edit["end"] and line:
+                        line = src.readline()
+                        lineno += 1
+                if not line:
+                    break
+                out.write(line)
+                digest.update(line)
+                size += len(line)
+                line = src.readline()
+                lineno += 1
+        return size, digest.hexdigest()
+
+    return replace_with(path, write, fsync)
+
+
+class UploadManager:
+    """Resumable uploads staged under a directory until complete.
+
+    Each upload is a .part file plus a small JSON manifest, so uploads can
+    be resumed after a dropped connection or a server restart by asking
+    for the current offset and sending the rest.
+    """
+
+    def __init__(self, root: Path):
+        # Created by the first upload, not up front
+        self.root = Path(root)
+        self._lock = threading.Lock()
+
+    def _part(self, upload_id):
+        return self.root / f"{upload_id}.part"
+
+    def _manifest(self, upload_id):
+        return self.root / f"{upload_id}.json"
+
+    def create(self, path: str, size: int, sha256: str = None) -> dict:
+        self.expire()
+        upload_id = uuid.uuid4().hex
+        self.root.mkdir(parents=True, exist_ok=True)
+        info = {"id": upload_id, "path": path, "size": size, "sha256": sha256 and sha256.lower(),
+                "created": time.time()}
+        self._part(upload_id).touch()
+        self._manifest(upload_id).write_text(json.dumps(info))
+        return dict(info, offset=0)
+
+    def get(self, upload_id: str):
+        if not re.fullmatch(r"[0-9a-f]{32}", upload_id or ""):
+            return None
+        try:
+            info = json.loads(self._manifest(upload_id).read_text())
+            info["offset"] = self._part(upload_id).stat().st_size
+        except (OSError, ValueError):
+            return None
+        return info
+
+    def append(self, upload_id: str, offset: int, chunks) -> int:
+        """Append chunks at offset, which must equal the bytes received so
+        far. Returns the new offset."""
+        info = self.get(upload_id)
+        if info is None:
+            raise KeyError(upload_id)
+        with self._lock:
+            part = self._part(upload_id)
+            current = part.stat().st_size
+            if offset != current:
+                raise ValueError(current)
+            with open(part, "ab") as f:
+                for chunk in chunks:
+                    if current + len(chunk) > info["size"]:
+                        raise OverflowError(info["size"])
+                    f.write(chunk)
+                    current += len(chunk)
+        return current
+
+    def complete(self, upload_id: str, target: Path, fsync: bool = False) -> dict:
+        """Verify size and hash, then move the upload into place."""
+        info = self.get(upload_id)
+        if info is None:
+            raise KeyError(upload_id)
+        part = self._part(upload_id)
+        if info["offset"] != info["size"]:
+            raise UploadError(f"Upload incomplete: {info['offset']} of {info['size']} bytes")
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        def write(out):
+            digest = hashlib.sha256()
+            with open(part, "rb") as src:
+                _copy(src, out, digest)
+            return digest.hexdigest()
+
+        # Copied next to target rather than renamed from the upload dir,
+        # which may be on another filesystem; the copy also keeps target's
+        # permissions and is hashed on the way
+        tmp, digest = stage_file(target, write, fsync)
+        if info["sha256"] and digest != info["sha256"]:
+            os.unlink(tmp)
+            self.abort(upload_id)
+            raise UploadError("Content hash mismatch; upload discarded")
+        try:
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        if fsync:
+            fsync_dir(target.parent)
+        self.abort(upload_id)
+        return {"path": info["path"], "size": info["size"], "sha256": digest}
+
+    def abort(self, upload_id: str) -> bool:
+        found = False
+        for p in (self._part(upload_id), self._manifest(upload_id)):
+            try:
+                p.unlink()
+                found = True
+            except FileNotFoundError:
+                pass
+        return found
+
+    def expire(self, now: float = None):
+        now = time.time() if now is None else now
+        for manifest in self.root.glob("*.json"):
+            part = manifest.with_suffix(".part")
+            try:
+                touched = part.stat().st_mtime if part.exists() else manifest.stat().st_mtime
+            except OSError:
+                continue
+            if now - touched > UPLOAD_EXPIRY:
+                self.abort(manifest.stem)
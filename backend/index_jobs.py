@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+import uuid
+
+from code_index import IndexCancelled
+
+FINISHED_STATES = {"done", "cancelled", "error"}
+# How many finished jobs to remember for polling
+MAX_FINISHED = 100
+
+
+class IndexJob:
+    def __init__(self, workspace: str):
+        self.id = uuid.uuid4().hex
+        self.workspace = workspace
+        self.status = "running"
+        self.stats = {}
+        self.result = None
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self._waiters = []
+
+    async def wait(self):
+        """Wait for the job without holding a thread."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters.append((loop, future))
+        # done_event is set before waiters are woken, so checking it after
+        # registering cannot miss the wakeup
+        if self.done_event.is_set():
+            return
+        await future
+
+    def _wake(self):
+        self.done_event.set()
+        waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+
+    def snapshot(self) -> dict:
+        end = self.finished or time.time()
+        return {
+            "job_id": self.id,
+            "workspace": self.workspace,
+            "status": self.status,
+            "progress": dict(self.stats),
+            "elapsed": round(end - self.started, 3),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class IndexJobManager:
+    """Runs index walks on background threads, at most one per workspace.
+
+    Starting a job for a workspace that already has one running returns the
+    running job instead of launching a second walk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._running = {}
+
+    def start(self, workspace: str, run):
+        # run(stats, cancel_event) does the work and returns the result dict
+        with self._lock:
+            job_id = self._running.get(workspace)
+            if job_id is not None:
+                return self._jobs[job_id], True
+            job = IndexJob(workspace)
+            self._jobs[job.id] = job
+            self._running[workspace] = job.id
+            self._prune()
+        threading.Thread(target=self._run, args=(job, run), name=f"index-{job.id[:8]}", daemon=True).start()
+        return job, False
+
+    def _run(self, job: IndexJob, run):
+        try:
+            job.result = run(job.stats, job.cancel_event)
+            job.status = "done"
+        except IndexCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "error"
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                if self._running.get(job.workspace) == job.id:
+                    del self._running[job.workspace]
+            job._wake()
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.status in FINISHED_STATES]
+        finished.sort(key=lambda j: j.finished or 0)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        job = self._jobs.get(job_id)
+        if job is not None and job.status == "running":
+            job.cancel_event.set()
+        return job
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    hash TEXT,
+    functions TEXT,
+    classes TEXT,
+    snippet TEXT
+);
+CREATE INDEX IF NOT EXISTS files_type ON files(type);
+CREATE TABLE IF NOT EXISTS symbols (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    line INTEGER,
+    parent TEXT
+);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols(name);
+CREATE INDEX IF NOT EXISTS symbols_path ON symbols(path);
+"""
+
+# Bump when the stored records change shape; older databases are dropped
+# and rebuilt by the next index run
+SCHEMA_VERSION = 2
+
+_FILE_COLUMNS = ("path", "type", "size", "mtime_ns", "hash", "functions", "classes", "snippet")
+
+
+class IndexStore:
+    """Per-workspace code index kept in SQLite, one row per file."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                conn.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS symbols;")
+                conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def known(self) -> dict:
+        # Only the columns the incremental indexer needs to decide what changed
+        with self._connect() as conn:
+            rows = conn.execute("SELECT path, type, size, mtime_ns, hash FROM files").fetchall()
+        return {r["path"]: dict(r) for r in rows}
+
+    def known_prefix(self, rel_dir: str) -> dict:
+        like = _escape_like(rel_dir.rstrip("/") + "/") + "%"
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT path, type, size, mtime_ns, hash FROM files WHERE path LIKE ? ESCAPE '\\'", (like,)
+            ).fetchall()
+        return {r["path"]: dict(r) for r in rows}
+
+    def remove_prefix(self, rel_path: str):
+        # Drops rel_path itself and, if it was a directory, everything below it
+        like = _escape_like(rel_path.rstrip("/") + "/") + "%"
+        with self._lock, self._connect() as conn:
+            for table in ("files", "symbols"):
+                conn.execute(
+                    "DELETE FROM %s WHERE path = ? OR path LIKE ? ESCAPE '\\'" % table, (rel_path, like)
+                )
+
+    def apply(self, upserts=(), touched=None, removed=()):
+        with self._lock, self._connect() as conn:
+            for path in removed:
+                conn.execute("DELETE FROM files WHERE path = ?", (path,))
+                conn.execute("DELETE FROM symbols WHERE path = ?", (path,))
+            for item in upserts:
+                row = (
+                    item["path"], item["type"], item.get("size"), item.get("mtime_ns"), item.get("hash"),
+                    json.dumps(item.get("functions", [])), json.dumps(item.get("classes", [])),
+                    item.get("snippet"),
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO files (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?)" % ", ".join(_FILE_COLUMNS),
+                    row,
+                )
+                conn.execute("DELETE FROM symbols WHERE path = ?", (item["path"],))
+                conn.executemany(
+                    "INSERT INTO symbols (path, name, kind, line, parent) VALUES (?, ?, ?, ?, ?)",
+                    [(item["path"], sym["name"], sym["kind"], sym.get("line"), sym.get("parent"))
+                     for sym in item.get("symbols", [])],
+                )
+            for path, mtime_ns in (touched or {}).items():
+                conn.execute("UPDATE files SET mtime_ns = ? WHERE path = ?", (mtime_ns, path))
+
+    def query(self, path_prefix="", type=None, symbol=None, offset=0, limit=500):
+        where, args = [], []
+        if path_prefix:
+            where.append("f.path LIKE ? ESCAPE '\\'")
+            args.append(_escape_like(path_prefix) + "%")
+        if type:
+            where.append("f.type = ?")
+            args.append(type)
+        if symbol:
+            where.append("f.path IN (SELECT path FROM symbols WHERE name LIKE ? ESCAPE '\\')")
+            args.append("%" + _escape_like(symbol) + "%")
+        clause = ("WHERE " + " AND ".join(where)) if where else ""
+        with self._connect() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM files f %s" % clause, args).fetchone()[0]
+            rows = conn.execute(
+                "SELECT * FROM files f %s ORDER BY f.path LIMIT ? OFFSET ?" % clause,
+                args + [limit, offset],
+            ).fetchall()
+        return [_row_to_item(r) for r in rows], total
+
+    def search_symbols(self, query: str, kind=None, path_prefix="", limit=50):
+        """Symbols whose name contains query, best matches first: exact,
+        then prefix, then substring; shorter names before longer ones."""
+        where = ["name LIKE ? ESCAPE '\\'"]
+        args = ["%" + _escape_like(query) + "%"]
+        if kind:
+            where.append("kind = ?")
+            args.append(kind)
+        if path_prefix:
+            where.append("path LIKE ? ESCAPE '\\'")
+            args.append(_escape_like(path_prefix) + "%")
+        sql = (
+            "SELECT path, name, kind, line, parent, "
+            "CASE WHEN name = ? THEN 0 WHEN lower(name) = lower(?) THEN 1 "
+            "WHEN name LIKE ? ESCAPE '\\' THEN 2 ELSE 3 END AS rank "
+            "FROM symbols WHERE %s ORDER BY rank, length(name), path, line LIMIT ?" % " AND ".join(where)
+        )
+        with self._connect() as conn:
+            rows = conn.execute(sql, [query, query, _escape_like(query) + "%"] + args + [limit]).fetchall()
+        return [dict(r) for r in rows]
+
+    def get(self, path: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM files WHERE path = ?", (path,)).fetchone()
+        return _row_to_item(row) if row else None
+
+    def iter_all(self):
+        with self._connect() as conn:
+            for row in conn.execute("SELECT * FROM files ORDER BY path"):
+                yield _row_to_item(row)
+
+    def fingerprint(self):
+        # Changes whenever a file is added, removed or re-indexed
+        with self._connect() as conn:
+            return tuple(conn.execute(
+                "SELECT COUNT(*), COALESCE(MAX(mtime_ns), 0), COALESCE(SUM(size), 0) FROM files"
+            ).fetchone())
+
+
+def _escape_like(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _row_to_item(row) -> dict:
+    item = {"path": row["path"], "type": row["type"]}
+    if row["type"] == "directory":
+        return item
+    item.update({
+        "functions": json.loads(row["functions"] or "[]"),
+        "classes": json.loads(row["classes"] or "[]"),
+        "snippet": row["snippet"] or "",
+        "size": row["size"],
+        "mtime_ns": row["mtime_ns"],
+        "hash": row["hash"],
+    })
+    return item
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store_path(index_dir: Path, workspace_rel: str) -> Path:
+    key = hashlib.sha1(workspace_rel.strip("/").encode()).hexdigest()[:16]
+    return Path(index_dir) / f"{key}.sqlite3"
+
+
+def get_store(index_dir: Path, workspace_rel: str) -> IndexStore:
+    db_path = store_path(index_dir, workspace_rel)
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = _stores[db_path] = IndexStore(db_path)
+        return store
@@ -0,0 +1,293 @@
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+
+# A checkpoint (byte offset of a line start) is kept every STRIDE lines, so
+# the index for a 10M-line file is ~40K offsets instead of 10M
+STRIDE = 256
+# Files are read with pread in chunks rather than memory-mapped: a file
+# truncated in place (logrotate's copytruncate) then just reads short, where
+# touching a mapped page past the new end would kill the server with SIGBUS
+CHUNK_SIZE = 4 * 1024 * 1024
+READ_SIZE = 256 * 1024
+# Lines longer than this are cut when served; the editor gets a flag
+MAX_LINE_BYTES = 16 * 1024
+MAX_HIT_TEXT = 200
+CACHE_SIZE = 8
+
+_skip_patterns = {}
+
+
+def _skip(n: int):
+    # Matches exactly n lines. Only ever run where at least n newlines are
+    # known to follow, so it always succeeds in a single linear pass
+    pattern = _skip_patterns.get(n)
+    if pattern is None:
+        pattern = _skip_patterns[n] = re.compile(rb"(?:[^\n]*\n){%d}" % n)
+    return pattern
+
+
+def _decode(data: bytes) -> str:
+    return data.decode("utf-8", errors="replace").rstrip("\r")
+
+
+class LineIndex:
+    """A file with a sparse line-offset index.
+
+    Newlines are counted a chunk at a time in C, and any line is reached by
+    jumping to the checkpoint before it and skipping at most STRIDE - 1
+    lines. Only the requested window is ever read.
+
+    The index keeps the file open. close() releases it, deferred until
+    every reader that acquire()d the index has called release(); used as
+    a context manager the index is released on exit.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb", buffering=0)
+        self._state_lock = threading.Lock()
+        self._users = 0
+        self._closing = False
+        try:
+            self._build()
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _build(self):
+        self.mtime_ns = os.fstat(self._file.fileno()).st_mtime_ns
+        self.checkpoints = array("Q", [0])
+        newlines, need, size, last = 0, STRIDE, 0, b"\n"
+        for base, chunk in self._chunks(0, None, CHUNK_SIZE):
+            n = chunk.count(b"\n")
+            newlines += n
+            pos = 0
+            while n >= need:
+                pos = _skip(need).match(chunk, pos).end()
+                self.checkpoints.append(base + pos)
+                n -= need
+                need = STRIDE
+            need -= n
+            size = base + len(chunk)
+            last = chunk[-1:]
+        # What was actually read: if the file shrank meanwhile, the cache
+        # sees a size mismatch and rebuilds
+        self.size = size
+        self.total_lines = newlines + (1 if size and last != b"\n" else 0)
+
+    def acquire(self):
+        with self._state_lock:
+            self._users += 1
+        return self
+
+    def release(self):
+        with self._state_lock:
+            self._users -= 1
+            done = self._closing and not self._users
+        if done:
+            self._file.close()
+
+    def close(self):
+        with self._state_lock:
+            self._closing = True
+            done = not self._users
+        if done:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _chunks(self, start: int, end, size=READ_SIZE):
+        # (offset, data) from start up to end (None: EOF); stops early on a
+        # short read
+        offset = start
+        while end is None or offset < end:
+            data = os.pread(self._file.fileno(), size if end is None else min(size, end - offset), offset)
+            if not data:
+                return
+            yield offset, data
+            offset += len(data)
+
+    def matches(self, st) -> bool:
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime_ns
+
+    def _skip_lines(self, offset: int, count: int) -> int:
+        if not count:
+            return offset
+        for base, chunk in self._chunks(offset, None):
+            n = chunk.count(b"\n")
+            if n >= count:
+                return base + _skip(count).match(chunk).end()
+            count -= n
+        return self.size
+
+    def line_offset(self, line: int) -> int:
+        return self._skip_lines(self.checkpoints[line // STRIDE], line % STRIDE)
+
+    def _locate(self, offset: int, near=None):
+        """(line, line start, offset) for a byte offset. near is an earlier
+        result to count on from, so a search walks the file only once."""
+        k = bisect_right(self.checkpoints, offset) - 1
+        line, line_start, pos = k * STRIDE, self.checkpoints[k], self.checkpoints[k]
+        if near is not None and pos <= near[2] <= offset:
+            line, line_start, pos = near
+        for base, chunk in self._chunks(pos, offset):
+            n = chunk.count(b"\n")
+            if n:
+                line += n
+                line_start = base + chunk.rfind(b"\n") + 1
+        return line, line_start, offset
+
+    def line_of(self, offset: int) -> int:
+        return self._locate(offset)[0]
+
+    def _find_newline(self, offset: int) -> int:
+        for base, chunk in self._chunks(offset, None):
+            i = chunk.find(b"\n")
+            if i >= 0:
+                return base + i
+        return -1
+
+    def read_lines(self, start: int, count: int):
+        lines, truncated = [], []
+        count = min(count, self.total_lines - start)
+        if count <= 0:
+            return lines, truncated
+        offset = self.line_offset(start)
+        buf, pos = b"", 0
+        while len(lines) < count:
+            newline = buf.find(b"\n", pos)
+            if newline >= 0:
+                line = buf[pos:newline]
+                pos = newline + 1
+            elif len(buf) - pos > MAX_LINE_BYTES:
+                # A very long line: keep its head and skip to its end
+                line = buf[pos:]
+                newline = self._find_newline(offset + len(buf))
+                if newline < 0:
+                    newline = self.size
+                offset, buf, pos = newline + 1, b"", 0
+            else:
+                more = os.pread(self._file.fileno(), READ_SIZE, offset + len(buf))
+                if more:
+                    offset, buf, pos = offset + pos, buf[pos:] + more, 0
+                    continue
+                # Last line without a trailing newline (or the file shrank)
+                if pos >= len(buf):
+                    break
+                line, pos = buf[pos:], len(buf)
+            if len(line) > MAX_LINE_BYTES:
+                truncated.append(start + len(lines))
+                line = line[:MAX_LINE_BYTES]
+            lines.append(_decode(line))
+        return lines, truncated
+
+    def _search_chunks(self, start: int):
+        # Chunks cut after their last newline, so a match within one line
+        # is never split; only lines longer than CHUNK_SIZE are cut
+        offset = start
+        while True:
+            data = os.pread(self._file.fileno(), CHUNK_SIZE, offset)
+            if not data:
+                return
+            if len(data) == CHUNK_SIZE:
+                cut = data.rfind(b"\n")
+                if cut >= 0:
+                    data = data[:cut + 1]
+            yield offset, data
+            offset += len(data)
+
+    def search(self, pattern, start_offset: int = 0, limit: int = 100):
+        """Hits of a compiled bytes pattern from start_offset on. Returns
+        (hits, next_offset); next_offset is None once the file is done.
+        Matches spanning a chunk boundary are not found."""
+        hits, near = [], None
+        fd = self._file.fileno()
+        for base, chunk in self._search_chunks(start_offset):
+            for m in pattern.finditer(chunk):
+                offset = base + m.start()
+                if len(hits) >= limit:
+                    return hits, offset
+                near = self._locate(offset, near)
+                line, line_start, _ = near
+                into = offset - line_start
+                # Text from the line start, or around the hit in a long line
+                window = line_start if into <= MAX_HIT_TEXT else offset - MAX_HIT_TEXT // 2
+                text = os.pread(fd, MAX_HIT_TEXT * 4, window).split(b"\n", 1)[0]
+                hits.append({
+                    "line": line,
+                    "column": (len(os.pread(fd, into, line_start).decode("utf-8", errors="replace"))
+                               if into <= MAX_LINE_BYTES else into) + 1,
+                    "offset": offset,
+                    "length": m.end() - m.start(),
+                    "text": _decode(text).strip()[:MAX_HIT_TEXT],
+                })
+        return hits, None
+
+
+class LineIndexCache:
+    """Keeps the indexes of recently viewed large files, rebuilt whenever
+    a file's size or mtime changes.
+
+    get() returns the index already acquired; release it (or use it in a
+    with block) when done, so an index evicted meanwhile can close its file.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.builds = 0
+
+    def get(self, path: Path) -> LineIndex:
+        key = str(path)
+        st = Path(path).stat()
+        with self._lock:
+            index = self._entries.get(key)
+            if index is not None and index.matches(st):
+                self._entries.move_to_end(key)
+                return index.acquire()
+        index = LineIndex(path).acquire()
+        retired = []
+        with self._lock:
+            self.builds += 1
+            old = self._entries.pop(key, None)
+            if old is not None:
+                retired.append(old)
+            self._entries[key] = index
+            while len(self._entries) > self.size:
+                retired.append(self._entries.popitem(last=False)[1])
+        # Readers still using a retired index keep its file open until
+        # they release it
+        for old in retired:
+            old.close()
+        return index
+
+    def discard(self, path: Path):
+        """Drop path's index, e.g. because the file was rewritten."""
+        with self._lock:
+            index = self._entries.pop(str(path), None)
+        if index is not None:
+            index.close()
+
+    def clear(self):
+        with self._lock:
+            indexes, self._entries = list(self._entries.values()), OrderedDict()
+        for index in indexes:
+            index.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "builds": self.builds,
+                "checkpoints": sum(len(i.checkpoints) for i in self._entries.values()),
+            }
@@ -1,22 +1,43 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pathlib import Path
 import shutil
 import os
+import hashlib
 from pydantic import BaseModel
-import tempfile
-import subprocess
 import uuid
-from datetime import datetime
 import json
-import google.generativeai as genai
 from dotenv import load_dotenv
-from difflib import unified_diff
-import requests
 import httpx
-import pty
 import asyncio
+import mimetypes
+import re
+import threading
+import time
+from collections import deque
+from ai_cache import DiskTier, ResponseCache
+from blocking_io import IOPool, LoopLagMonitor, TreeDeleter
+from code_index import MAX_WORKERS, SKIP_PREFIX, IndexCancelled, build_index, clamp_workers, shutdown_pools
+from completion_scheduler import CompletionScheduler, trim_context
+from context_assembler import HISTORY_SHARE, PREFIX_SHARE, ContextAssembler, default_budget, estimate_tokens
+from index_store import get_store, store_path
+from index_jobs import IndexJobManager
+from diff_engine import DiffCache, DiffTooLarge, render_unified
+from env import env_float, env_int
+from dir_listing import etag_matches, list_tree, listing_etag, paginate, scan_dir
+from exec_pool import ExecutionPool
+from file_transfer import (
+    PatchError, RangeNotSatisfiable, UploadError, UploadManager, file_etag, iter_file, parse_range,
+    patch_bytes, patch_lines, replace_with, sha256_file, write_atomic, write_batch,
+)
+from line_index import LineIndexCache
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry, RequestMetrics, SampledLog
+from search_index import SearchIndex
+from terminal import TerminalLimitError, TerminalManager, parse_control
+from upstream import UpstreamPool
+from version_store import DEFAULT_RETENTION, VersionStore
+from workspace_watcher import DirCache, WatcherRegistry, WorkspaceWatcher
 
 load_dotenv()
 
@@ -30,44 +51,330 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus metrics, scraped from /metrics; point-in-time values (queue
+# depth, open terminals...) are read from their owners at scrape time
+metrics = Registry()
+HTTP_SECONDS = metrics.histogram(
+    "onpoint_http_request_seconds", "HTTP request latency until the last body byte", ("method", "route", "status")
+)
+MODEL_SECONDS = metrics.histogram(
+    "onpoint_model_request_seconds", "Model call latency, retries included", ("provider", "mode")
+)
+MODEL_ERRORS = metrics.counter("onpoint_model_errors_total", "Failed model calls", ("provider", "kind"))
+MODEL_TOKENS = metrics.counter("onpoint_model_tokens_total", "Tokens reported by the provider", ("provider", "type"))
+INDEX_SECONDS = metrics.histogram(
+    "onpoint_index_duration_seconds", "Workspace index run duration", ("status",),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+INDEX_FILES = metrics.counter("onpoint_index_files_total", "Files handled by index runs", ("result",))
+LOOP_LAG = metrics.histogram(
+    "onpoint_event_loop_lag_seconds", "How late a 100ms sleep on the event loop wakes up",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+app.add_middleware(RequestMetrics, histogram=HTTP_SECONDS)
+
+# Model responses are logged as sampled JSON lines, not dumped on every call
+ai_log = SampledLog("onpoint.ai")
+
 BASE_DIR = Path(os.environ.get("ONPOINT_WORKSPACE", "./workspace")).resolve()
 BASE_DIR.mkdir(parents=True, exist_ok=True)
 
 VERSIONS_DIR = BASE_DIR / ".onpoint_versions"
 VERSIONS_DIR.mkdir(exist_ok=True)
+versions = VersionStore(VERSIONS_DIR)
+
+INDEX_DIR = BASE_DIR / ".onpoint_index"
 
 SETTINGS_FILE = BASE_DIR / "settings.json"
 
+# Every write goes to a temp file renamed over the target; with this set
+# the data and the rename are also fsynced before the request returns
+FSYNC_WRITES = os.environ.get("ONPOINT_FSYNC", "").lower() in ("1", "true", "yes")
+
+# Blocking filesystem work started from async handlers runs on this pool,
+# never on the event loop; deleted trees are cleared from the trash on it
+io_pool = IOPool()
+trash = TreeDeleter(BASE_DIR / ".onpoint_trash", io_pool)
+loop_lag = LoopLagMonitor(on_sample=LOOP_LAG.observe)
+
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-else:
+if not GEMINI_API_KEY:
     print("WARNING: GEMINI_API_KEY not set. AI endpoints will not work.")
 
+GEMINI_MODELS_URL = os.environ.get("GEMINI_MODELS_URL", "https://generativelanguage.googleapis.com/v1beta/models")
+DEEPSEEK_URL = os.environ.get("DEEPSEEK_URL", "http://localhost:11434/api/generate")
+# Wall-clock budget for one model call, retries included
+AI_DEADLINE = env_float("ONPOINT_AI_DEADLINE", 120)
+
+# Shared by every outbound model call; see upstream.py for the env knobs
+upstream = UpstreamPool()
+
+@app.on_event("shutdown")
+async def close_upstream():
+    await upstream.close()
+
+def gemini_text(result: dict):
+    return result["candidates"][0]["content"]["parts"][0]["text"]
+
+def record_usage(provider: str, result: dict):
+    # Gemini reports usageMetadata; Ollama-style servers prompt_eval_count
+    # and eval_count
+    usage = result.get("usageMetadata") or {}
+    prompt = usage.get("promptTokenCount", result.get("prompt_eval_count"))
+    completion = usage.get("candidatesTokenCount", result.get("eval_count"))
+    if prompt:
+        MODEL_TOKENS.labels(provider, "prompt").inc(prompt)
+    if completion:
+        MODEL_TOKENS.labels(provider, "completion").inc(completion)
+    return prompt, completion
+
+def error_kind(e: BaseException):
+    if isinstance(e, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(e, httpx.HTTPStatusError):
+        return f"http_{e.response.status_code}"
+    if isinstance(e, httpx.TransportError):
+        return "transport"
+    return "other"
+
+def record_model_error(provider: str, e: BaseException, **fields):
+    MODEL_ERRORS.labels(provider, error_kind(e)).inc()
+    # httpx errors quote the request URL, which carries the API key
+    error = re.sub(r"([?&]key=)[^&\s']+", r"\1***", str(e))
+    ai_log.error("model_error", provider=provider, kind=error_kind(e), error=error, **fields)
+
+async def model_post(provider: str, url: str, **kwargs):
+    """upstream.post_json, timed and counted per provider."""
+    started = time.perf_counter()
+    try:
+        result = await upstream.post_json(provider, url, **kwargs)
+    except Exception as e:
+        record_model_error(provider, e)
+        raise
+    finally:
+        MODEL_SECONDS.labels(provider, "generate").observe(time.perf_counter() - started)
+    prompt_tokens, completion_tokens = record_usage(provider, result)
+    ai_log.info(
+        "model_response", provider=provider, seconds=round(time.perf_counter() - started, 3),
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, response=result,
+    )
+    return result
+
 # Helper to call Gemini
 async def gemini_generate(prompt: str, model: str = "gemini-2.0-flash"):
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
     try:
-        response = genai.GenerativeModel(model).generate_content(prompt)
-        return response.text.strip()
+        result = await asyncio.wait_for(
+            model_post(
+                "gemini", f"{GEMINI_MODELS_URL}/{model}:generateContent",
+                params={"key": os.environ.get("GEMINI_API_KEY")}, json=payload
+            ),
+            AI_DEADLINE,
+        )
+        return gemini_text(result).strip()
+    except asyncio.TimeoutError as e:
+        record_model_error("gemini", e, model=model)
+        return f"[Gemini error: no response within {AI_DEADLINE:g}s]"
     except Exception as e:
         return f"[Gemini error: {e}]"
 
 # Helper to call Deepseek
 async def deepseek_generate(prompt: str, model: str = "deepseek-coder"):
-    url = "http://localhost:11434/api/generate"
     payload = {
         "model": model,
         "prompt": prompt,
         "stream": False
     }
     try:
-        r = requests.post(url, json=payload, timeout=120)
-        r.raise_for_status()
-        data = r.json()
+        data = await asyncio.wait_for(model_post("deepseek", DEEPSEEK_URL, json=payload), AI_DEADLINE)
         return data.get("response") or data.get("message") or "[No response from Deepseek]"
+    except asyncio.TimeoutError as e:
+        record_model_error("deepseek", e, model=model)
+        return f"[Deepseek error: no response within {AI_DEADLINE:g}s]"
     except Exception as e:
         return f"[Deepseek error: {e}]"
 
+# Responses for identical model + prompt are reused; set ONPOINT_AI_CACHE_DB
+# to a file path to keep them across restarts as well
+ai_cache = ResponseCache(
+    ttl=env_float("ONPOINT_AI_CACHE_TTL", 3600),
+    max_entries=env_int("ONPOINT_AI_CACHE_ENTRIES", 1000),
+    max_bytes=env_int("ONPOINT_AI_CACHE_BYTES", 64 * 1024 * 1024),
+    disk=DiskTier(
+        Path(os.environ["ONPOINT_AI_CACHE_DB"]),
+        env_int("ONPOINT_AI_CACHE_DISK_BYTES", 512 * 1024 * 1024),
+    ) if os.environ.get("ONPOINT_AI_CACHE_DB") else None,
+    run_io=io_pool.run,
+)
+
+completions = CompletionScheduler()
+chat_context = ContextAssembler()
+
+async def cached_gemini_generate(prompt: str, model: str = "gemini-2.0-flash"):
+    return await ai_cache.get_or_compute(
+        model, prompt, lambda: gemini_generate(prompt, model),
+        cacheable=lambda text: not text.startswith("[Gemini error")
+    )
+
+# Streaming variants: yield text chunks as the provider produces them
+async def gemini_stream(prompt: str, model: str = "gemini-2.0-flash"):
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    lines = upstream.stream_lines(
+        "gemini", "POST", f"{GEMINI_MODELS_URL}/{model}:streamGenerateContent",
+        params={"key": os.environ.get("GEMINI_API_KEY"), "alt": "sse"}, json=payload
+    )
+    # Every event carries the usage so far; the last one is the total
+    usage = None
+    try:
+        async for line in lines:
+            if not line.startswith("data:"):
+                continue
+            try:
+                data = json.loads(line[5:])
+                usage = data.get("usageMetadata") or usage
+                chunk = gemini_text(data)
+            except (ValueError, KeyError, IndexError):
+                continue
+            if chunk:
+                yield chunk
+    finally:
+        if usage:
+            record_usage("gemini", {"usageMetadata": usage})
+
+async def deepseek_stream(prompt: str, model: str = "deepseek-coder"):
+    payload = {"model": model, "prompt": prompt, "stream": True}
+    async for line in upstream.stream_lines("deepseek", "POST", DEEPSEEK_URL, json=payload):
+        if not line.strip():
+            continue
+        data = json.loads(line)
+        if data.get("response"):
+            yield data["response"]
+        if data.get("done"):
+            record_usage("deepseek", data)
+            break
+
+STREAM_PROVIDERS = {"gemini": gemini_stream, "deepseek": deepseek_stream}
+
+def sse_event(data: dict, event: str = None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def stream_ai(request: Request, prompt: str, provider: str = "gemini", on_done=None):
+    """SSE response forwarding model output chunk by chunk.
+
+    Each chunk is a {"text": ...} event; a final "done" event carries the
+    full text (plus whatever `await on_done(text)` returns). If the client
+    goes away the generator is closed, which closes the upstream stream so
+    an abandoned generation stops being billed.
+    """
+    generate = STREAM_PROVIDERS.get(provider)
+    if generate is None:
+        raise HTTPException(status_code=400, detail=f"Unknown provider: {provider}")
+
+    async def events():
+        parts = []
+        chunks = generate(prompt)
+        started = time.perf_counter()
+        deadline = time.monotonic() + AI_DEADLINE
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), deadline - time.monotonic())
+                except StopAsyncIteration:
+                    break
+                if await request.is_disconnected():
+                    return
+                parts.append(chunk)
+                yield sse_event({"text": chunk})
+            text = "".join(parts)
+            yield sse_event({"text": text, **(await on_done(text) if on_done else {})}, "done")
+            ai_log.info("model_stream", provider=provider, seconds=round(time.perf_counter() - started, 3),
+                        chars=len(text), response=text)
+        except asyncio.TimeoutError as e:
+            record_model_error(provider, e, mode="stream")
+            yield sse_event({"error": f"no complete response within {AI_DEADLINE:g}s"}, "error")
+        except Exception as e:
+            record_model_error(provider, e, mode="stream")
+            yield sse_event({"error": str(e)}, "error")
+        finally:
+            MODEL_SECONDS.labels(provider, "stream").observe(time.perf_counter() - started)
+            await chunks.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+dir_cache = DirCache()
+diff_cache = DiffCache()
+watchers = WatcherRegistry()
+
+@app.on_event("startup")
+async def migrate_legacy_versions():
+    # Finished before serving: a save racing the import would get a lower
+    # id than older imported snapshots, and history is ordered by id.
+    # A no-op once the store has been migrated
+    await io_pool.run(versions.migrate_legacy)
+
+# "version_retention" in the global settings.json overrides these
+COMPACTION_INTERVAL = 3600
+compaction_history = deque(maxlen=20)
+
+def load_retention_policy():
+    settings = {}
+    if SETTINGS_FILE.exists():
+        try:
+            with open(SETTINGS_FILE, "r") as f:
+                settings = json.load(f)
+        except Exception:
+            pass
+    policy = settings.get("version_retention") if isinstance(settings, dict) else None
+    return policy if isinstance(policy, dict) else {}
+
+def compact_versions():
+    policy = load_retention_policy()
+    report = versions.compact({k: v for k, v in policy.items() if k in DEFAULT_RETENTION})
+    compaction_history.append(report)
+    return report
+
+def compaction_interval(policy: dict) -> float:
+    # A hand-edited settings.json must not be able to stop the loop
+    try:
+        interval = float(policy.get("interval_seconds", COMPACTION_INTERVAL))
+    except (TypeError, ValueError):
+        print(f"[WARN] Invalid version_retention.interval_seconds: {policy.get('interval_seconds')!r}")
+        interval = COMPACTION_INTERVAL
+    if interval != interval or interval == float("inf"):
+        interval = COMPACTION_INTERVAL
+    return max(60, interval)
+
+async def compaction_loop():
+    while True:
+        try:
+            policy = await io_pool.run(load_retention_policy)
+            interval = compaction_interval(policy)
+        except Exception as e:
+            print(f"[WARN] Could not load the version retention policy: {e}")
+            interval = COMPACTION_INTERVAL
+        await asyncio.sleep(interval)
+        try:
+            await io_pool.run(compact_versions)
+        except Exception as e:
+            print(f"[WARN] Version compaction failed: {e}")
+
+@app.on_event("startup")
+async def start_version_compaction():
+    app.state.compaction_task = asyncio.create_task(compaction_loop())
+
+@app.on_event("shutdown")
+async def stop_version_compaction():
+    app.state.compaction_task.cancel()
+
+@app.on_event("shutdown")
+def stop_index_pools():
+    shutdown_pools()
+
+@app.on_event("shutdown")
+def stop_watchers():
+    watchers.stop_all()
+
 def safe_path(rel_path: str) -> Path:
     p = (BASE_DIR / rel_path).resolve()
     if not str(p).startswith(str(BASE_DIR)):
@@ -75,31 +382,96 @@ def safe_path(rel_path: str) -> Path:
     return p
 
 def save_version(file_path: Path):
+    # Identical content to the latest version is deduplicated by the store
     if not file_path.exists() or not file_path.is_file():
-        return
-    rel_path = file_path.relative_to(BASE_DIR)
-    ts = datetime.now().strftime("%Y%m%d%H%M%S")
-    version_path = VERSIONS_DIR / rel_path
-    version_path.parent.mkdir(parents=True, exist_ok=True)
-    backup_path = version_path.with_name(f"{version_path.name}.{ts}")
-    shutil.copy2(file_path, backup_path)
+        return None
+    return versions.save_file(str(file_path.relative_to(BASE_DIR)), file_path)
+
+def load_version(version_path: str):
+    # version_path is a version id as returned by /file/versions/
+    try:
+        version_id = int(version_path)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Version not found")
+    version, data = versions.read(version_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return version, data
+
+def load_listing(dir_path: Path):
+    if watchers.covering(dir_path) is not None:
+        # Watched workspaces serve listings from memory
+        return dir_cache.get(dir_path, scan_dir)
+    return scan_dir(dir_path)
 
 @app.get("/files/")
 def list_files(path: str = ""):
     dir_path = safe_path(path)
     if not dir_path.is_dir():
         raise HTTPException(status_code=404, detail="Directory not found")
-    return [{
-        "name": f.name,
-        "is_dir": f.is_dir()
-    } for f in dir_path.iterdir()]
+    return load_listing(dir_path)
+
+@app.get("/files/list/")
+def list_files_paged(
+    request: Request,
+    path: str = "",
+    depth: int = Query(1, ge=1, le=8),
+    cursor: str = None,
+    limit: int = Query(None, ge=1, le=5000),
+):
+    # Paginates the top level only; with depth > 1 each directory entry
+    # carries its subtree under "children", up to MAX_TREE_ENTRIES in all
+    dir_path = safe_path(path)
+    if not dir_path.is_dir():
+        raise HTTPException(status_code=404, detail="Directory not found")
+    if_none_match = request.headers.get("if-none-match")
+    etag = None
+    if watchers.covering(dir_path) is not None:
+        # Watched listings only change through dir_cache invalidations, so
+        # the cache generation validates them before anything is scanned.
+        # Read first: a change landing mid-request just costs a refetch
+        etag = listing_etag([dir_cache.generation, path, depth, cursor, limit])
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+    try:
+        page, next_cursor = paginate(load_listing(dir_path), cursor, limit)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    page, truncated = list_tree(dir_path, page, depth, load_listing)
+    body = {"path": path, "entries": page, "next_cursor": next_cursor, "truncated": truncated}
+    if etag is None:
+        # Unwatched: a file's size or mtime shows in no directory metadata,
+        # so only the scanned entries can tell whether anything changed
+        etag = listing_etag(body)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(body, headers={"ETag": etag})
 
 @app.get("/file/")
-def read_file(path: str):
+def read_file(path: str, request: Request):
     file_path = safe_path(path)
     if not file_path.is_file():
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(str(file_path))
+    st = file_path.stat()
+    headers = {"Accept-Ranges": "bytes", "ETag": file_etag(st)}
+    range_header = request.headers.get("range")
+    # If-Range: only honour the range if the file is still the one the
+    # client started reading
+    if range_header and request.headers.get("if-range", headers["ETag"]) == headers["ETag"]:
+        try:
+            byte_range = parse_range(range_header, st.st_size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{st.st_size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            return StreamingResponse(
+                iter_file(file_path, start, end),
+                status_code=206,
+                media_type=mimetypes.guess_type(file_path.name)[0] or "text/plain",
+                headers={**headers, "Content-Range": f"bytes {start}-{end}/{st.st_size}",
+                         "Content-Length": str(end - start + 1)},
+            )
+    return FileResponse(str(file_path), headers=headers)
 
 @app.post("/file/")
 def write_file(path: str = Form(...), content: str = Form(...)):
@@ -107,22 +479,206 @@ def write_file(path: str = Form(...), content: str = Form(...)):
     file_path.parent.mkdir(parents=True, exist_ok=True)
     if file_path.exists():
         save_version(file_path)
-    file_path.write_text(content)
+    write_atomic(file_path, content.encode("utf-8"), FSYNC_WRITES)
+    line_indexes.discard(file_path)
     return {"status": "ok"}
 
+class SaveFile(BaseModel):
+    path: str
+    content: str
+    expected_sha256: str = None  # reject the batch if the file has changed
+
+class SaveBatch(BaseModel):
+    files: list[SaveFile]
+    fsync: bool = None  # defaults to ONPOINT_FSYNC
+
+@app.post("/files/save/")
+def save_files(req: SaveBatch):
+    # Save All: every file is checked before any is written, the previous
+    # contents are versioned in one transaction, and the files are swapped
+    # in all or nothing
+    targets = [safe_path(f.path) for f in req.files]
+    if len(set(targets)) != len(targets):
+        raise HTTPException(status_code=400, detail="Duplicate path in batch")
+    previous = []
+    for f, file_path in zip(req.files, targets):
+        if file_path.is_dir():
+            raise HTTPException(status_code=400, detail=f"{f.path} is a directory")
+        data = file_path.read_bytes() if file_path.is_file() else None
+        if f.expected_sha256 and (data is None or hashlib.sha256(data).hexdigest() != f.expected_sha256.lower()):
+            raise HTTPException(status_code=409, detail=f"{f.path} has changed")
+        if data is not None:
+            previous.append((str(file_path.relative_to(BASE_DIR)), data))
+    versions.save_many(previous)
+    contents = [f.content.encode("utf-8") for f in req.files]
+    write_batch(list(zip(targets, contents)), FSYNC_WRITES if req.fsync is None else req.fsync)
+    for target in targets:
+        line_indexes.discard(target)
+    return {
+        "status": "ok",
+        "files": [
+            {"path": f.path, "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+            for f, data in zip(req.files, contents)
+        ],
+    }
+
 @app.post("/file/upload/")
 def upload_file(path: str = Form(...), file: UploadFile = File(...)):
     file_path = safe_path(path)
     file_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    replace_with(file_path, lambda f: shutil.copyfileobj(file.file, f), FSYNC_WRITES)
+    line_indexes.discard(file_path)
     return {"status": "ok"}
 
+# Large-file mode: windowed line reads and search with pread, so huge
+# files never have to be sent or held whole
+line_indexes = LineIndexCache()
+MAX_LINES_PER_REQUEST = 5000
+
+@app.get("/file/lines/")
+def read_file_lines(path: str, start: int = Query(0, ge=0), count: int = Query(200, ge=1, le=MAX_LINES_PER_REQUEST)):
+    # start is a 0-based line number, as in /file/patch/
+    file_path = safe_path(path)
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+    with line_indexes.get(file_path) as index:
+        lines, truncated = index.read_lines(start, count)
+    return {
+        "path": path,
+        "start": start,
+        "lines": lines,
+        "truncated": truncated,
+        "total_lines": index.total_lines,
+        "size": index.size,
+        "mtime_ns": index.mtime_ns,
+    }
+
+@app.get("/file/lines/search/")
+def search_file_lines(
+    path: str,
+    query: str,
+    mode: str = "substring",
+    case_sensitive: bool = False,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    # Page through hits by passing next_offset back as offset. Case folding
+    # is ASCII-only since matching runs on the raw bytes
+    file_path = safe_path(path)
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+    if not query:
+        raise HTTPException(status_code=400, detail="Empty query")
+    raw = query.encode("utf-8")
+    try:
+        flags = re.MULTILINE | (0 if case_sensitive else re.IGNORECASE)
+        pattern = re.compile(raw if mode == "regex" else re.escape(raw), flags)
+    except re.error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid regex: {e}")
+    with line_indexes.get(file_path) as index:
+        hits, next_offset = index.search(pattern, offset, limit)
+    return {"path": path, "hits": hits, "next_offset": next_offset, "total_lines": index.total_lines}
+
+class PatchEdit(BaseModel):
+    # Replace [start, end) with text; an insert has start == end
+    start: int
+    end: int
+    text: str = ""
+
+class PatchRequest(BaseModel):
+    path: str
+    edits: list[PatchEdit]
+    unit: str = "line"  # "line" (0-based line numbers) or "byte"
+    expected_sha256: str = None  # reject the patch if the file has changed
+
+@app.post("/file/patch/")
+def patch_file(req: PatchRequest):
+    file_path = safe_path(req.path)
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+    if req.unit not in ("line", "byte"):
+        raise HTTPException(status_code=400, detail="unit must be 'line' or 'byte'")
+    if req.expected_sha256 and sha256_file(file_path) != req.expected_sha256.lower():
+        raise HTTPException(status_code=409, detail="File has changed")
+    edits = [{"start": e.start, "end": e.end, "text": e.text} for e in req.edits]
+    patch = patch_bytes if req.unit == "byte" else patch_lines
+    try:
+        # Only a patch that passed validation gets a version saved
+        size, digest = patch(file_path, edits, FSYNC_WRITES, before=lambda: save_version(file_path))
+    except PatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    line_indexes.discard(file_path)
+    return {"status": "ok", "size": size, "sha256": digest}
+
+# Resumable uploads: create, PUT chunks at the current offset (GET the
+# upload to find it after a dropped connection), then complete
+UPLOADS_DIR = BASE_DIR / ".onpoint_uploads"
+uploads = UploadManager(UPLOADS_DIR)
+MAX_UPLOAD_CHUNK = 64 * 1024 * 1024
+
+class UploadCreate(BaseModel):
+    path: str
+    size: int
+    sha256: str = None
+
+@app.post("/file/uploads/")
+def create_upload(req: UploadCreate):
+    safe_path(req.path)
+    if req.size < 0:
+        raise HTTPException(status_code=400, detail="Invalid size")
+    return uploads.create(req.path, req.size, req.sha256)
+
+@app.get("/file/uploads/{upload_id}")
+def get_upload(upload_id: str):
+    info = uploads.get(upload_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return info
+
+@app.put("/file/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_UPLOAD_CHUNK:
+            raise HTTPException(status_code=413, detail=f"Chunks are limited to {MAX_UPLOAD_CHUNK} bytes")
+    try:
+        new_offset = await io_pool.run(uploads.append, upload_id, offset, [bytes(body)])
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail={"message": "Offset mismatch", "offset": e.args[0]})
+    except OverflowError:
+        raise HTTPException(status_code=400, detail="Chunk runs past the declared size")
+    return {"id": upload_id, "offset": new_offset}
+
+@app.post("/file/uploads/{upload_id}/complete")
+def complete_upload(upload_id: str):
+    info = uploads.get(upload_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    target = safe_path(info["path"])
+    if target.is_file():
+        save_version(target)
+    try:
+        result = uploads.complete(upload_id, target, FSYNC_WRITES)
+    except UploadError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    line_indexes.discard(target)
+    return {"status": "ok", **result}
+
+@app.delete("/file/uploads/{upload_id}")
+def abort_upload(upload_id: str):
+    if not uploads.get(upload_id) or not uploads.abort(upload_id):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"status": "aborted"}
+
 @app.delete("/file/")
 def delete_file(path: str):
     file_path = safe_path(path)
     if file_path.is_file():
         file_path.unlink()
+        line_indexes.discard(file_path)
         return {"status": "deleted"}
     raise HTTPException(status_code=404, detail="File not found")
 
@@ -132,27 +688,48 @@ def create_folder(path: str = Form(...)):
     folder_path.mkdir(parents=True, exist_ok=True)
     return {"status": "created"}
 
+def forget_tree(dir_path: Path):
+    # Drop in-memory state for a tree that is being deleted or moved, so a
+    # tree later created under the same path starts fresh
+    watchers.stop_under(dir_path)
+    dir_cache.invalidate(dir_path)
+    prefix = str(dir_path) + "/"
+    with search_indexes_lock:
+        for key in [k for k in search_indexes if k == str(dir_path) or k.startswith(prefix)]:
+            del search_indexes[key]
+
+def start_delete(path: str):
+    # The tree is moved to the trash right away and emptied in the
+    # background; poll /delete_jobs/{job_id} for progress
+    dir_path = safe_path(path)
+    if not dir_path.is_dir() or dir_path == BASE_DIR:
+        return None
+    forget_tree(dir_path)
+    return trash.start(dir_path, str(dir_path.relative_to(BASE_DIR)))
+
 @app.delete("/folder/")
-def delete_folder(path: str):
-    folder_path = safe_path(path)
-    if folder_path.is_dir():
-        shutil.rmtree(folder_path)
-        return {"status": "deleted"}
-    raise HTTPException(status_code=404, detail="Folder not found")
+async def delete_folder(path: str):
+    job = await io_pool.run(start_delete, path)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Folder not found")
+    return {"status": "deleted", "job_id": job.id}
 
 @app.post("/rename/")
 def rename_path(old_path: str = Form(...), new_path: str = Form(...)):
     src = safe_path(old_path)
     dst = safe_path(new_path)
+    if src.is_dir():
+        forget_tree(src)
     src.rename(dst)
     return {"status": "renamed"}
 
 @app.get("/workspaces/")
 def list_workspaces():
-    # List all top-level folders (projects) in BASE_DIR
+    # List all top-level folders (projects) in BASE_DIR, leaving out the
+    # server's own .onpoint_* data directories
     return [
         {"name": f.name, "path": str(f.relative_to(BASE_DIR))}
-        for f in BASE_DIR.iterdir() if f.is_dir()
+        for f in BASE_DIR.iterdir() if f.is_dir() and not f.name.startswith(SKIP_PREFIX)
     ]
 
 @app.post("/workspaces/")
@@ -162,17 +739,24 @@ def create_workspace(name: str = Form(...)):
     return {"status": "created", "name": name}
 
 @app.delete("/workspaces/")
-def delete_workspace(name: str):
-    ws_path = safe_path(name)
-    if ws_path.is_dir():
-        shutil.rmtree(ws_path)
-        return {"status": "deleted", "name": name}
-    raise HTTPException(status_code=404, detail="Workspace not found")
+async def delete_workspace(name: str):
+    job = await io_pool.run(start_delete, name)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Workspace not found")
+    return {"status": "deleted", "name": name, "job_id": job.id}
+
+@app.get("/delete_jobs/{job_id}")
+def delete_job_status(job_id: str):
+    job = trash.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Delete job not found")
+    return job.snapshot()
 
 @app.post("/workspaces/rename/")
 def rename_workspace(old_name: str = Form(...), new_name: str = Form(...)):
     old_path = safe_path(old_name)
     new_path = safe_path(new_name)
+    forget_tree(old_path)
     old_path.rename(new_path)
     return {"status": "renamed", "old_name": old_name, "new_name": new_name}
 
@@ -183,10 +767,23 @@ class CodeRequest(BaseModel):
 class ChatHistoryRequest(BaseModel):
     history: list  # [{role: 'user'|'assistant', content: str}]
     current_directory: str = None  # relative to BASE_DIR
+    open_file: str = None  # relative to BASE_DIR; ranked first in the context
+    max_context_tokens: int = None  # defaults to ONPOINT_CHAT_CONTEXT_TOKENS
 
 class ChatRequest(BaseModel):
     message: str
 
+class DiffSide(BaseModel):
+    # Exactly one of: a working file, a stored version id, or inline text
+    path: str = None
+    version: str = None
+    text: str = None
+
+class DiffRequest(BaseModel):
+    a: DiffSide
+    b: DiffSide
+    context: int = 3
+
 class ExecRequest(BaseModel):
     code: str
     language: str  # "python" or "javascript"
@@ -194,89 +791,157 @@ class ExecRequest(BaseModel):
 @app.post("/ai/suggest/")
 async def ai_suggest(req: CodeRequest):
     prompt = f"Suggest an improvement or next step for this {req.language} code:\n\n{req.code}\n\nRespond with only the code suggestion or next edit, no explanation."
-    suggestion = await gemini_generate(prompt)
+    suggestion = await cached_gemini_generate(prompt)
     return {"suggestion": suggestion}
 
+def review_prompt(req: CodeRequest):
+    return f"Review the following {req.language} code and provide feedback, suggestions, and possible improvements.\n\n{req.code}"
+
 @app.post("/ai/review/")
 async def ai_review(req: CodeRequest):
-    prompt = f"Review the following {req.language} code and provide feedback, suggestions, and possible improvements.\n\n{req.code}"
-    review = await gemini_generate(prompt)
+    review = await cached_gemini_generate(review_prompt(req))
     return {"review": review}
 
-@app.post("/ai/chat/")
-async def ai_chat(req: ChatHistoryRequest):
-    prompt = "You are a helpful coding assistant."
-    if req.current_directory:
-        dir_path = safe_path(req.current_directory)
-        dir_listing = get_directory_listing(dir_path)
-        prompt += (
+@app.post("/ai/review/stream/")
+async def ai_review_stream(req: CodeRequest, request: Request, provider: str = "gemini"):
+    return stream_ai(request, review_prompt(req), provider)
+
+def chat_prefix(req: ChatHistoryRequest, prefix_budget: int):
+    # The part of the prompt that only changes with the workspace; cached
+    # per workspace by the context assembler
+    intro = "You are a helpful coding assistant."
+    if not req.current_directory:
+        return intro, []
+    dir_path = safe_path(req.current_directory)
+
+    def build_prefix(outline):
+        prompt = intro + (
             f"\nCurrent directory: {req.current_directory}\n"
-            f"Directory contents:\n{dir_listing}\n"
+            f"Directory contents:\n{get_directory_listing(dir_path)}\n"
             f"First, explain the structure and contents of this directory to the user in clear language. Then continue the conversation as normal. it is in kali linux"
         )
-        # Load and include code index
-        settings_path = dir_path / 'settings.json'
-        if settings_path.exists():
-            try:
-                with open(settings_path, 'r') as f:
-                    settings = json.load(f)
-                code_index = settings.get('code_index', [])
-                if code_index:
-                    prompt += '\nHere is an index of code in this directory:'
-                    for item in code_index:
-                        prompt += f"\n- File: {item['path']} ({item['type']})"
-                        if item.get('functions'):
-                            prompt += f"\n  Functions: {', '.join(item['functions'])}"
-                        if item.get('classes'):
-                            prompt += f"\n  Classes: {', '.join(item['classes'])}"
-                        prompt += f"\n  Snippet:\n{item['snippet']}\n"
-            except Exception:
-                pass
-    prompt += "\nHere is the conversation so far:\n"
-    for msg in req.history:
-        role = "User" if msg['role'] == 'user' else 'Assistant'
-        prompt += f"{role}: {msg['content']}\n"
+        if outline:
+            prompt += f"\nHere is an outline of the code indexed in this directory:\n{outline}\n"
+        return prompt
+
+    store = None
+    if has_workspace_index(dir_path):
+        try:
+            store = workspace_index(dir_path)
+            fingerprint = (dir_path.stat().st_mtime_ns, store.fingerprint())
+        except Exception:
+            store = None
+    if store is None:
+        fingerprint = (dir_path.stat().st_mtime_ns, None)
+    workspace = chat_context.workspace(
+        req.current_directory, fingerprint, build_prefix,
+        store.iter_all if store is not None else list, prefix_budget
+    )
+    return workspace.prefix, workspace.entries
+
+def chat_prompt(req: ChatHistoryRequest):
+    budget = req.max_context_tokens or default_budget()
+    prompt, entries = chat_prefix(req, int(budget * PREFIX_SHARE))
+
+    # Most recent messages that fit the history share; the latest message
+    # is always kept
+    lines = [
+        f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}\n" for msg in req.history
+    ]
+    history, history_used = [], 0
+    for line in reversed(lines):
+        cost = estimate_tokens(line)
+        if history and history_used + cost > budget * HISTORY_SHARE:
+            break
+        history.insert(0, line)
+        history_used += cost
+
+    if entries:
+        query = next((m['content'] for m in reversed(req.history) if m['role'] == 'user'), "")
+        ranked = ContextAssembler.rank(entries, query, req.open_file)
+        remaining = budget - estimate_tokens(prompt) - history_used
+        snippets, _ = ContextAssembler.pack([e["text"] for e in ranked], remaining)
+        if snippets:
+            prompt += '\nHere is the code most relevant to the question:' + ''.join(snippets)
+    prompt += "\nHere is the conversation so far:\n" + ''.join(history)
     prompt += "Assistant:"
-    response = await gemini_generate(prompt)
+    return prompt
+
+@app.post("/ai/chat/")
+async def ai_chat(req: ChatHistoryRequest):
+    response = await gemini_generate(await io_pool.run(chat_prompt, req))
     return {"response": response}
 
+@app.post("/ai/chat/stream/")
+async def ai_chat_stream(req: ChatHistoryRequest, request: Request, provider: str = "gemini"):
+    return stream_ai(request, await io_pool.run(chat_prompt, req), provider)
+
+# Pre-warmed interpreter workers shared by the execution endpoints
+execution = ExecutionPool(run_io=io_pool.run)
+
+@app.on_event("startup")
+async def prewarm_execution():
+    await execution.prewarm()
+
+@app.on_event("shutdown")
+async def stop_execution():
+    await execution.close()
+
 @app.post("/execute/")
-def execute_code(req: ExecRequest):
+async def execute_code(req: ExecRequest):
     if req.language not in ("python", "javascript"):
         raise HTTPException(status_code=400, detail="Unsupported language")
-    with tempfile.TemporaryDirectory() as tmpdir:
-        if req.language == "python":
-            file_path = Path(tmpdir) / "script.py"
-            file_path.write_text(req.code)
-            cmd = ["python3", str(file_path)]
-        else:
-            file_path = Path(tmpdir) / "script.js"
-            file_path.write_text(req.code)
-            cmd = ["node", str(file_path)]
+    return await execution.run(req.language, req.code)
+
+@app.get("/execute/stats/")
+def execution_stats():
+    return execution.stats()
+
+@app.websocket("/ws/execute/")
+async def websocket_execute(websocket: WebSocket):
+    # First message: {"language", "code"}. Then the client may send
+    # {"type": "stdin", "data"}, {"type": "stdin_close"} or {"type": "kill"}.
+    # Output arrives as {"type": "stdout"|"stderr", "data"} events, then
+    # one {"type": "exit", ...}
+    await websocket.accept()
+    try:
+        start = await websocket.receive_json()
+    except (WebSocketDisconnect, ValueError):
+        return
+    if start.get("language") not in ("python", "javascript") or not isinstance(start.get("code"), str):
+        await websocket.send_json({"type": "error", "detail": "Unsupported language"})
+        await websocket.close()
+        return
+    job = execution.job(start["language"], start["code"], interactive=True)
+
+    async def control():
         try:
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=6
-            )
-            return {
-                "stdout": result.stdout,
-                "stderr": result.stderr,
-                "exit_code": result.returncode
-            }
-        except subprocess.TimeoutExpired:
-            return {
-                "stdout": "",
-                "stderr": "Execution timed out.",
-                "exit_code": -1
-            }
-        except Exception as e:
-            return {
-                "stdout": "",
-                "stderr": f"Execution error: {str(e)}",
-                "exit_code": -2
-            }
+            while True:
+                try:
+                    message = json.loads(await websocket.receive_text())
+                except ValueError:
+                    continue
+                kind = message.get("type") if isinstance(message, dict) else None
+                if kind == "stdin":
+                    await job.write_stdin(str(message.get("data", "")))
+                elif kind == "stdin_close":
+                    job.close_stdin()
+                elif kind == "kill":
+                    job.kill()
+        except (WebSocketDisconnect, RuntimeError):
+            # Nobody is left to see the output
+            job.kill()
+
+    control_task = asyncio.create_task(control())
+    try:
+        result = await job.run(websocket.send_json)
+        await websocket.send_json({"type": "exit", **result})
+        await websocket.close()
+    except (WebSocketDisconnect, RuntimeError):
+        # Client went away; run()'s cleanup has already killed the worker
+        pass
+    finally:
+        control_task.cancel()
 
 def get_directory_listing(path: Path, max_files=20):
     # List up to max_files in the directory, show file names and types
@@ -291,8 +956,7 @@ def get_directory_listing(path: Path, max_files=20):
             entries.append(f"[D] {entry.name}/")
     return '\n'.join(entries)
 
-@app.post("/ai/suggest_changes/")
-async def ai_suggest_changes(path: str = Form(...)):
+def suggest_changes_prompt(path: str):
     file_path = safe_path(path)
     if not file_path.exists() or not file_path.is_file():
         raise HTTPException(status_code=404, detail="File not found")
@@ -308,72 +972,130 @@ async def ai_suggest_changes(path: str = Form(...)):
         f"Filename: {file_path.name}\n"
         f"Code:\n{original_code}"
     )
-    improved_code = await gemini_generate(prompt)
-    # Generate diff
-    diff = list(unified_diff(
-        original_code.splitlines(),
-        improved_code.splitlines(),
-        fromfile=f"original/{file_path.name}",
-        tofile=f"suggested/{file_path.name}",
-        lineterm=''  # no extra newlines
-    ))
+    return file_path, original_code, prompt
+
+def cached_diff(a_text: str, b_text: str, context: int = 3):
+    try:
+        return diff_cache.diff(a_text, b_text, context)
+    except DiffTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+def suggested_changes(file_path: Path, original_code: str, improved_code: str):
+    result = cached_diff(original_code, improved_code)
+    diff = render_unified(result["hunks"], f"original/{file_path.name}", f"suggested/{file_path.name}")
     return {
-        "diff": '\n'.join(diff),
+        "diff": diff,
+        "hunks": result["hunks"],
         "suggested": improved_code,
         "original": original_code,
         "filename": file_path.name,
         "path": str(file_path.relative_to(BASE_DIR))
     }
 
-@app.post("/ai/apply_change/")
-async def ai_apply_change(path: str = Form(...), new_content: str = Form(...)):
+@app.post("/ai/suggest_changes/")
+async def ai_suggest_changes(path: str = Form(...)):
+    file_path, original_code, prompt = await io_pool.run(suggest_changes_prompt, path)
+    improved_code = await gemini_generate(prompt)
+    return await io_pool.run(suggested_changes, file_path, original_code, improved_code)
+
+@app.post("/ai/suggest_changes/stream/")
+async def ai_suggest_changes_stream(request: Request, path: str = Form(...), provider: str = "gemini"):
+    # Streams the suggested code; the final "done" event carries the diff
+    file_path, original_code, prompt = await io_pool.run(suggest_changes_prompt, path)
+
+    async def on_done(text):
+        # Diffing a large file takes a while; keep it off the event loop
+        return await io_pool.run(suggested_changes, file_path, original_code, text.strip())
+
+    return stream_ai(request, prompt, provider, on_done=on_done)
+
+def resolve_diff_side(side: DiffSide):
+    given = [k for k in ("path", "version", "text") if getattr(side, k) is not None]
+    if len(given) != 1:
+        raise HTTPException(status_code=400, detail="Each side needs exactly one of path, version or text")
+    if side.path is not None:
+        file_path = safe_path(side.path)
+        if not file_path.is_file():
+            raise HTTPException(status_code=404, detail="File not found")
+        return file_path.read_text(errors="replace"), side.path
+    if side.version is not None:
+        version, data = load_version(side.version)
+        return data.decode("utf-8", errors="replace"), f"{version['path']}@{version['timestamp']}"
+    return side.text, "text"
+
+@app.post("/diff/")
+def diff_contents(req: DiffRequest):
+    if req.context < 0:
+        raise HTTPException(status_code=400, detail="context must be >= 0")
+    a_text, a_label = resolve_diff_side(req.a)
+    b_text, b_label = resolve_diff_side(req.b)
+    result = cached_diff(a_text, b_text, req.context)
+    return {
+        **result,
+        "unified": render_unified(result["hunks"], a_label, b_label),
+        "identical": result["a_hash"] == result["b_hash"],
+    }
+
+def apply_change(path: str, new_content: str):
     file_path = safe_path(path)
     if not file_path.exists() or not file_path.is_file():
         raise HTTPException(status_code=404, detail="File not found")
     # Save version before overwrite
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    version_file = VERSIONS_DIR / f"{file_path.name}.{ts}"
-    with open(file_path, "r") as f:
-        orig = f.read()
-    with open(version_file, "w") as f:
-        f.write(orig)
-    # Write new content
-    with open(file_path, "w") as f:
-        f.write(new_content)
+    save_version(file_path)
+    write_atomic(file_path, new_content.encode("utf-8"), FSYNC_WRITES)
+    line_indexes.discard(file_path)
     return {"status": "applied", "path": str(file_path.relative_to(BASE_DIR))}
 
-@app.get("/file/versions/")
-def list_versions(path: str):
+@app.post("/ai/apply_change/")
+async def ai_apply_change(path: str = Form(...), new_content: str = Form(...)):
+    return await io_pool.run(apply_change, path, new_content)
+
+def version_listing(path: str):
     file_path = safe_path(path)
-    rel_path = file_path.relative_to(BASE_DIR)
-    version_glob = (VERSIONS_DIR / rel_path).parent.glob(f"{file_path.name}.*")
-    versions = [
+    rel_path = str(file_path.relative_to(BASE_DIR))
+    return [
         {
-            "filename": v.name,
-            "timestamp": v.name.split(".")[-1],
-            "path": str(v.relative_to(VERSIONS_DIR))
+            "filename": f"{file_path.name}.{v['timestamp']}",
+            "timestamp": v["timestamp"],
+            "path": str(v["id"]),
+            "hash": v["hash"],
+            "size": v["size"]
         }
-        for v in version_glob if v.is_file()
+        for v in versions.list(rel_path)
     ]
-    versions.sort(key=lambda x: x["timestamp"], reverse=True)
-    return versions
+
+@app.get("/file/versions/")
+async def list_versions(path: str):
+    return await io_pool.run(version_listing, path)
 
 @app.get("/file/version/")
 def get_version(version_path: str):
-    version_file = VERSIONS_DIR / version_path
-    if not version_file.exists():
-        raise HTTPException(status_code=404, detail="Version not found")
-    return FileResponse(str(version_file))
+    version, data = load_version(version_path)
+    media_type = mimetypes.guess_type(version["path"])[0] or "text/plain"
+    return Response(content=data, media_type=media_type)
 
 @app.post("/file/restore/")
 def restore_version(path: str = Form(...), version_path: str = Form(...)):
     file_path = safe_path(path)
-    version_file = VERSIONS_DIR / version_path
-    if not version_file.exists():
-        raise HTTPException(status_code=404, detail="Version not found")
-    shutil.copy2(version_file, file_path)
+    _, data = load_version(version_path)
+    # Keep what is being replaced; free if it is already the latest version
+    save_version(file_path)
+    write_atomic(file_path, data, FSYNC_WRITES)
+    line_indexes.discard(file_path)
     return {"status": "restored"}
 
+@app.get("/versions/stats/")
+def version_store_stats():
+    return {
+        **versions.stats(),
+        "retention": {**DEFAULT_RETENTION, **load_retention_policy()},
+        "compactions": list(compaction_history),
+    }
+
+@app.post("/versions/compact/")
+def run_version_compaction():
+    return compact_versions()
+
 @app.get("/settings/")
 def get_settings():
     if SETTINGS_FILE.exists():
@@ -383,8 +1105,7 @@ def get_settings():
 
 @app.post("/settings/")
 def update_settings(settings: dict):
-    with open(SETTINGS_FILE, "w") as f:
-        json.dump(settings, f, indent=2)
+    write_atomic(SETTINGS_FILE, json.dumps(settings, indent=2).encode("utf-8"), FSYNC_WRITES)
     return {"status": "ok"}
 
 @app.get("/workspace/settings/")
@@ -404,99 +1125,274 @@ def update_workspace_settings(name: str = Form(...), settings: str = Form(...)):
         settings_obj = json.loads(settings)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
-    with open(settings_path, "w") as f:
-        json.dump(settings_obj, f, indent=2)
+    write_atomic(settings_path, json.dumps(settings_obj, indent=2).encode("utf-8"), FSYNC_WRITES)
     return {"status": "ok"}
 
-def recursive_index(dir_path, rel_path=""):
-    index = []
-    for entry in sorted(dir_path.iterdir()):
-        entry_rel = str(entry.relative_to(BASE_DIR))
-        if entry.is_dir():
-            index.append({
-                "path": entry_rel,
-                "type": "directory"
-            })
-            index.extend(recursive_index(entry, rel_path=entry_rel))
-        elif entry.is_file() and entry.suffix in {'.py', '.js', '.json'}:
-            try:
-                with open(entry, 'r', encoding='utf-8', errors='ignore') as f:
-                    code = f.read()
-                snippet = '\n'.join(code.splitlines()[:20])
-            except Exception:
-                snippet = ''
-            funcs, classes = ([], [])
-            if entry.suffix == '.py':
-                try:
-                    import ast
-                    tree = ast.parse(code)
-                    funcs = [n.name for n in ast.walk(tree) if isinstance(n, ast.FunctionDef)]
-                    classes = [n.name for n in ast.walk(tree) if isinstance(n, ast.ClassDef)]
-                except Exception:
-                    pass
-            index.append({
-                "path": entry_rel,
-                "type": entry.suffix[1:],
-                "functions": funcs,
-                "classes": classes,
-                "snippet": snippet
-            })
-    return index
+def workspace_index(dir_path: Path):
+    return get_store(INDEX_DIR, str(dir_path.relative_to(BASE_DIR)))
 
-@app.post("/index_code_recursive/")
-def index_code_recursive(current_directory: str = Form(...)):
-    dir_path = safe_path(current_directory)
-    if not dir_path.exists() or not dir_path.is_dir():
-        raise HTTPException(status_code=404, detail="Directory not found")
-    index = recursive_index(dir_path)
-    ws_settings_path = dir_path / 'settings.json'
+def has_workspace_index(dir_path: Path):
+    return store_path(INDEX_DIR, str(dir_path.relative_to(BASE_DIR))).exists()
+
+def index_workers(dir_path: Path):
+    # "index_workers" in the workspace settings.json; 0 means one per CPU,
+    # and more than that is capped to it
     settings = {}
+    ws_settings_path = dir_path / 'settings.json'
     if ws_settings_path.exists():
         try:
             with open(ws_settings_path, 'r') as f:
                 settings = json.load(f)
         except Exception:
-            settings = {}
-    settings['code_index'] = index
-    with open(ws_settings_path, 'w') as f:
-        json.dump(settings, f, indent=2)
-    return {"status": "ok", "count": len(index)}
+            pass
+    try:
+        workers = int(settings.get('index_workers', 1))
+    except (TypeError, ValueError):
+        workers = 1
+    return clamp_workers(workers if workers > 0 else MAX_WORKERS)
 
-@app.get("/get_code_index/")
-def get_code_index(current_directory: str = Query(...)):
-    dir_path = safe_path(current_directory)
+def recursive_index(dir_path, workers=None, stats=None, cancel=None):
+    # Incremental: only files changed since the last run are re-parsed
+    store = workspace_index(dir_path)
+    if workers is None:
+        workers = index_workers(dir_path)
+    changes, stats = build_index(
+        dir_path, BASE_DIR, known=store.known(), exclude=[dir_path / 'settings.json'],
+        workers=workers, stats=stats, cancel=cancel
+    )
+    store.apply(changes["upsert"], changes["touched"], changes["removed"])
+    return stats
+
+def drop_legacy_code_index(dir_path: Path):
+    # Older versions kept the whole index inside the workspace settings.json
     ws_settings_path = dir_path / 'settings.json'
-    if ws_settings_path.exists():
+    if not ws_settings_path.exists():
+        return
+    try:
         with open(ws_settings_path, 'r') as f:
             settings = json.load(f)
-        return {"code_index": settings.get('code_index', [])}
-    return {"code_index": []}
+    except Exception:
+        return
+    if isinstance(settings, dict) and 'code_index' in settings:
+        del settings['code_index']
+        write_atomic(ws_settings_path, json.dumps(settings, indent=2).encode("utf-8"), FSYNC_WRITES)
+
+index_jobs = IndexJobManager()
+
+def start_index_job(current_directory: str, workers: int = None):
+    dir_path = safe_path(current_directory)
+    if not dir_path.exists() or not dir_path.is_dir():
+        raise HTTPException(status_code=404, detail="Directory not found")
+    if workers is None:
+        workers = index_workers(dir_path)
+    else:
+        workers = clamp_workers(workers if workers > 0 else MAX_WORKERS)
+
+    def run(stats, cancel):
+        started = time.perf_counter()
+        status = "error"
+        try:
+            recursive_index(dir_path, workers=workers, stats=stats, cancel=cancel)
+            drop_legacy_code_index(dir_path)
+            # Bring text search up to date here rather than in a /search/ call
+            get_search_index(dir_path).refresh()
+            _, count = workspace_index(dir_path).query(limit=0)
+            status = "done"
+            return {"count": count, "workers": workers, **stats}
+        except IndexCancelled:
+            status = "cancelled"
+            raise
+        finally:
+            INDEX_SECONDS.labels(status).observe(time.perf_counter() - started)
+            for result in ("scanned", "parsed", "reused", "removed"):
+                if stats.get(result):
+                    INDEX_FILES.labels(result).inc(stats[result])
+
+    return index_jobs.start(str(dir_path.relative_to(BASE_DIR)), run)
+
+def get_index_job(job_id: str):
+    job = index_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Index job not found")
+    return job
+
+@app.post("/index_code_recursive/")
+async def index_code_recursive(current_directory: str = Form(...), workers: int = Form(None)):
+    # Blocking variant: waits for (or joins) the workspace's index job
+    job, _ = await io_pool.run(start_index_job, current_directory, workers)
+    await job.wait()
+    if job.status == "cancelled":
+        raise HTTPException(status_code=409, detail="Indexing was cancelled")
+    if job.status == "error":
+        raise HTTPException(status_code=500, detail=f"Indexing failed: {job.error}")
+    return {"status": "ok", **job.result}
+
+@app.post("/index_jobs/")
+def create_index_job(current_directory: str = Form(...), workers: int = Form(None)):
+    job, attached = start_index_job(current_directory, workers)
+    return {**job.snapshot(), "attached": attached}
+
+@app.get("/index_jobs/{job_id}")
+def index_job_status(job_id: str):
+    return get_index_job(job_id).snapshot()
+
+@app.get("/index_jobs/{job_id}/events")
+async def index_job_events(job_id: str, request: Request, interval: float = Query(0.5, gt=0, le=10)):
+    job = get_index_job(job_id)
+
+    async def events():
+        while True:
+            if await request.is_disconnected():
+                break
+            snap = job.snapshot()
+            yield f"data: {json.dumps(snap)}\n\n"
+            if job.done_event.is_set():
+                break
+            await asyncio.sleep(interval)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.delete("/index_jobs/{job_id}")
+def cancel_index_job(job_id: str):
+    job = index_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Index job not found")
+    return job.snapshot()
+
+@app.get("/get_code_index/")
+def get_code_index(
+    current_directory: str = Query(...),
+    path_prefix: str = "",
+    type: str = None,
+    symbol: str = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=5000),
+):
+    dir_path = safe_path(current_directory)
+    if not has_workspace_index(dir_path):
+        return {"code_index": [], "total": 0, "offset": offset, "limit": limit}
+    items, total = workspace_index(dir_path).query(
+        path_prefix=path_prefix, type=type, symbol=symbol, offset=offset, limit=limit
+    )
+    return {"code_index": items, "total": total, "offset": offset, "limit": limit}
+
+@app.post("/watch/")
+def start_watch(current_directory: str = Form(...)):
+    if not watchers.available:
+        raise HTTPException(status_code=501, detail="Filesystem watching requires the watchdog package")
+    dir_path = safe_path(current_directory)
+    if not dir_path.is_dir():
+        raise HTTPException(status_code=404, detail="Directory not found")
+    # Listings cached or validated before an earlier watch ended may be stale
+    dir_cache.invalidate(dir_path)
+    watcher, started = watchers.start(dir_path, lambda: WorkspaceWatcher(
+        dir_path, BASE_DIR, workspace_index(dir_path), dir_cache, exclude=[dir_path / 'settings.json'],
+        search=get_search_index(dir_path)
+    ))
+    # Catch the index up with anything that changed while nobody was watching
+    job, _ = start_index_job(current_directory)
+    return {"status": "watching", "started": started, "index_job": job.id, **watcher.status()}
+
+@app.get("/watch/")
+def list_watches():
+    return [w.status() for w in watchers.all()]
+
+@app.delete("/watch/")
+def stop_watch(current_directory: str):
+    dir_path = safe_path(current_directory)
+    watcher = watchers.stop(dir_path)
+    if watcher is None:
+        raise HTTPException(status_code=404, detail="Directory is not being watched")
+    dir_cache.invalidate(dir_path)
+    return {"status": "stopped", **watcher.status()}
+
+search_indexes = {}
+search_indexes_lock = threading.Lock()
+
+def get_search_index(dir_path: Path):
+    with search_indexes_lock:
+        index = search_indexes.get(str(dir_path))
+        if index is None:
+            index = search_indexes[str(dir_path)] = SearchIndex(dir_path, BASE_DIR)
+        return index
+
+@app.get("/search/")
+def search_code(
+    current_directory: str = Query(...),
+    q: str = Query(..., min_length=1),
+    mode: str = Query("substring", pattern="^(substring|regex|symbol)$"),
+    case_sensitive: bool = False,
+    path_prefix: str = "",
+    kind: str = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    dir_path = safe_path(current_directory)
+    if not dir_path.is_dir():
+        raise HTTPException(status_code=404, detail="Directory not found")
+    started = time.perf_counter()
+    if mode == "symbol":
+        if not has_workspace_index(dir_path):
+            raise HTTPException(status_code=409, detail="Workspace has not been indexed yet")
+        hits = workspace_index(dir_path).search_symbols(q, kind=kind, path_prefix=path_prefix, limit=limit)
+        complete = True
+    else:
+        index = get_search_index(dir_path)
+        if not index.ensure_fresh():
+            # First search on this workspace; the build runs in the background
+            return JSONResponse(
+                {"query": q, "mode": mode, "status": "building", "hits": [], "count": 0, "complete": False},
+                status_code=202,
+                headers={"Retry-After": "1"},
+            )
+        try:
+            hits, complete = index.search(q, mode=mode, case_sensitive=case_sensitive, path_prefix=path_prefix, limit=limit)
+        except re.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid regex: {e}")
+    took_ms = round((time.perf_counter() - started) * 1000, 2)
+    return {"query": q, "mode": mode, "status": "ready", "hits": hits, "count": len(hits), "complete": complete, "took_ms": took_ms}
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_API_URL = f"{GEMINI_MODELS_URL}/gemini-2.0-flash:generateContent"
+
+@app.get("/ai/cache/stats/")
+def ai_cache_stats():
+    return ai_cache.stats()
+
+@app.delete("/ai/cache/")
+async def clear_ai_cache():
+    await ai_cache.clear()
+    return {"status": "cleared"}
+
+@app.get("/api/suggest/stats")
+def suggest_stats():
+    return completions.stats()
 
 @app.post("/api/suggest")
 async def suggest_code(request: Request):
     data = await request.json()
-    code_context = data.get("code", "")
+    code = data.get("code", "")
     language = data.get("language", "python")
-    
+    # cursor counts code points into code, which the editor already cuts to
+    # a window around the cursor; older clients send only the code up to it
+    cursor = data.get("cursor")
+    cursor = len(code) if not isinstance(cursor, int) else cursor
+    session_id = data.get("session_id") or f"anon-{uuid.uuid4()}"
+    prefix, suffix = trim_context(code, cursor, completions.max_prefix, completions.max_suffix)
+
     # Create the prompt for code suggestion
-    prompt = f"Suggest the next lines of {language} code given the following context:\n{code_context}\n"
-    
+    prompt = f"Suggest the next lines of {language} code given the following context:\n{prefix}\n"
+    if suffix.strip():
+        prompt += f"\nThe code after the cursor is:\n{suffix}\n"
+
     # Set up the API request
     headers = {"Content-Type": "application/json"}
     params = {"key": GEMINI_API_KEY}
     payload = {
         "contents": [{"parts": [{"text": prompt}]}]
     }
-    
-    # Make the API request
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(GEMINI_API_URL, headers=headers, params=params, json=payload)
-            response.raise_for_status()
-            result = response.json()
+
+    async def generate():
+        result = await model_post("gemini", GEMINI_API_URL, headers=headers, params=params, json=payload)
 
         # Check if the result contains candidates
         candidates = result.get("candidates", [])
@@ -510,13 +1406,25 @@ async def suggest_code(request: Request):
         # Check if no suggestion is returned
         if not suggestion:
             return {"error": "No code suggestion returned from the first candidate."}
+        return {"suggestion": suggestion.strip()}
+
+    # Make the API request; only the newest request of a session is answered
+    try:
+        superseded, result = await completions.submit(
+            session_id, prompt,
+            lambda: ai_cache.get_or_compute("gemini-2.0-flash", prompt, generate, cacheable=lambda r: "suggestion" in r)
+        )
+        if superseded:
+            return {"suggestion": "", "status": "superseded", "session_id": session_id}
+        if "error" in result:
+            return result
 
         # Return a concise and summarized response
         return {
-            "suggestion": suggestion.strip(),
+            "suggestion": result["suggestion"],
             "status": "success",
             "language": language,
-            "context_length": len(code_context),
+            "context_length": len(prefix) + len(suffix),
             "message": "Code suggestion successfully generated."
         }
 
@@ -543,15 +1451,15 @@ async def analyze_code(request: Request):
             {"parts": [{"text": prompt}]}
         ]
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(GEMINI_API_URL, headers=headers, params=params, json=payload)
-        response.raise_for_status()
-        result = response.json()
-    print("[GEMINI RAW RESPONSE]", result)
-    try:
-        analysis = result["candidates"][0]["content"]["parts"][0]["text"]
-    except Exception:
-        analysis = ""
+
+    async def generate():
+        result = await model_post("gemini", GEMINI_API_URL, headers=headers, params=params, json=payload)
+        try:
+            return result["candidates"][0]["content"]["parts"][0]["text"]
+        except Exception:
+            return ""
+
+    analysis = await ai_cache.get_or_compute("gemini-2.0-flash", prompt, generate, cacheable=bool)
     return {"analysis": analysis}
 
 @app.post("/api/check")
@@ -567,17 +1475,20 @@ async def check_code(request: Request):
             {"parts": [{"text": prompt}]}
         ]
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(GEMINI_API_URL, headers=headers, params=params, json=payload)
-        response.raise_for_status()
-        result = response.json()
-    print("[GEMINI RAW RESPONSE]", result)
-    try:
-        feedback = result["candidates"][0]["content"]["parts"][0]["text"]
-    except Exception:
-        feedback = ""
+
+    async def generate():
+        result = await model_post("gemini", GEMINI_API_URL, headers=headers, params=params, json=payload)
+        try:
+            return result["candidates"][0]["content"]["parts"][0]["text"]
+        except Exception:
+            return ""
+
+    feedback = await ai_cache.get_or_compute("gemini-2.0-flash", prompt, generate, cacheable=bool)
     return {"feedback": feedback}
 
+def api_chat_prompt(question: str, code_context: str, language: str):
+    return f"You are an expert coding assistant. Answer the following user question about their {language} code. If code context is provided, use it to give a more accurate answer.\n\nCode context (if provided):\n{code_context}\n\nUser question: {question}\n\nAI answer:"
+
 @app.post("/api/chat")
 async def chat_with_ai(request: Request):
     try:
@@ -589,7 +1500,7 @@ async def chat_with_ai(request: Request):
         question = data.get("question", "")
         code_context = data.get("code", "")
         language = data.get("language", "python")
-        prompt = f"You are an expert coding assistant. Answer the following user question about their {language} code. If code context is provided, use it to give a more accurate answer.\n\nCode context (if provided):\n{code_context}\n\nUser question: {question}\n\nAI answer:"
+        prompt = api_chat_prompt(question, code_context, language)
         headers = {"Content-Type": "application/json"}
         params = {"key": GEMINI_API_KEY}
         payload = {
@@ -597,15 +1508,11 @@ async def chat_with_ai(request: Request):
                 {"parts": [{"text": prompt}]}
             ]
         }
-        async with httpx.AsyncClient() as client:
-            response = await client.post(GEMINI_API_URL, headers=headers, params=params, json=payload)
-            response.raise_for_status()
-            result = response.json()
-        print("[GEMINI RAW RESPONSE]", result)
+        result = await model_post("gemini", GEMINI_API_URL, headers=headers, params=params, json=payload)
         try:
             answer = result["candidates"][0]["content"]["parts"][0]["text"]
         except Exception as e:
-            print("[ERROR] Failed to parse Gemini response:", result)
+            ai_log.error("model_bad_response", provider="gemini", error=repr(e), response=result)
             answer = ""
         return {"answer": answer}
     except Exception as e:
@@ -613,36 +1520,155 @@ async def chat_with_ai(request: Request):
         print("[ERROR] Exception in /api/chat endpoint:\n", traceback.format_exc())
         return {"error": str(e)}
 
+@app.post("/api/chat/stream")
+async def chat_with_ai_stream(request: Request, provider: str = "gemini"):
+    data = await request.json()
+    prompt = api_chat_prompt(data.get("question", ""), data.get("code", ""), data.get("language", "python"))
+    return stream_ai(request, prompt, provider)
+
+# Shells that survive reconnects; closed when their shell exits or after
+# ONPOINT_TERMINAL_IDLE_TIMEOUT seconds without viewers or input
+terminals = TerminalManager()
+TERMINAL_REAP_INTERVAL = 60
+
+async def terminal_reaper():
+    while True:
+        await asyncio.sleep(TERMINAL_REAP_INTERVAL)
+        try:
+            await terminals.reap()
+        except Exception as e:
+            print(f"Terminal reaping failed: {e}")
+
+@app.on_event("startup")
+async def start_terminal_reaper():
+    app.state.terminal_reaper = asyncio.create_task(terminal_reaper())
+
+@app.on_event("shutdown")
+async def stop_terminals():
+    app.state.terminal_reaper.cancel()
+    await terminals.close_all()
+
+class TerminalCreate(BaseModel):
+    cols: int = 80
+    rows: int = 24
+
+@app.post("/terminal/sessions/")
+async def create_terminal_session(req: TerminalCreate = None):
+    req = req or TerminalCreate()
+    try:
+        session = await terminals.create(req.cols, req.rows)
+    except TerminalLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return session.info()
+
+@app.get("/terminal/sessions/")
+async def list_terminal_sessions():
+    # On the loop, which owns the sessions; a threadpool thread could see
+    # the dict change size mid-iteration
+    return {**terminals.stats(), "sessions": [s.info() for s in terminals.sessions.values()]}
+
+@app.delete("/terminal/sessions/{session_id}")
+async def close_terminal_session(session_id: str):
+    if not await terminals.close(session_id):
+        raise HTTPException(status_code=404, detail="Terminal session not found")
+    return {"status": "closed", "id": session_id}
+
 @app.websocket("/ws/terminal/")
-async def websocket_terminal(websocket: WebSocket):
+async def websocket_terminal(websocket: WebSocket, session_id: str = None):
+    # Text frames are keyboard input, except {"type": "resize", "cols", "rows"}.
+    # With a session_id the shell outlives this connection and scrollback is
+    # replayed on attach; without one it is closed when the socket goes away
     await websocket.accept()
-    master_fd, slave_fd = pty.openpty()
-    process = await asyncio.create_subprocess_exec(
-        '/bin/bash',
-        stdin=slave_fd,
-        stdout=slave_fd,
-        stderr=slave_fd
-    )
-    loop = asyncio.get_event_loop()
-    async def read_pty():
+    ephemeral = not session_id
+    if ephemeral:
+        # Not counted against the persistent session cap, as before sessions
+        session = await terminals.create(persistent=False)
+    else:
+        session = terminals.get(session_id)
+        if session is None:
+            await websocket.close(code=4404, reason="Terminal session not found")
+            return
+    output = session.attach(websocket.send_text)
+
+    async def pump():
         try:
-            while True:
-                await asyncio.sleep(0.01)
-                data = await loop.run_in_executor(None, lambda: os.read(master_fd, 1024))
-                if data:
-                    await websocket.send_text(data.decode(errors='ignore'))
-        except Exception:
+            await output.run()
+            await websocket.close()
+        except (WebSocketDisconnect, RuntimeError):
             pass
-    reader_task = asyncio.create_task(read_pty())
+
+    sender_task = asyncio.create_task(pump())
     try:
         while True:
             data = await websocket.receive_text()
-            os.write(master_fd, data.encode())
-    except WebSocketDisconnect:
+            control = parse_control(data)
+            if control is not None:
+                try:
+                    session.resize(control["cols"], control["rows"])
+                except (KeyError, TypeError, ValueError):
+                    pass
+            else:
+                session.write(data.encode())
+    except (WebSocketDisconnect, RuntimeError):
         pass
     finally:
-        reader_task.cancel()
-        process.terminate()
-        os.close(master_fd)
-        os.close(slave_fd)
-        await websocket.close()
+        sender_task.cancel()
+        session.detach(output)
+        if ephemeral:
+            await terminals.close(session.id)
+
+@app.on_event("startup")
+async def start_io():
+    app.state.loop_lag_task = asyncio.create_task(loop_lag.run())
+    # Trees whose deletion was cut short by a restart
+    await io_pool.run(trash.purge)
+
+@app.on_event("shutdown")
+async def stop_io():
+    app.state.loop_lag_task.cancel()
+    io_pool.shutdown()
+    line_indexes.clear()
+
+@app.get("/io/stats/")
+def io_stats():
+    return {"pool": io_pool.stats(), "loop_lag": loop_lag.stats(), "deletes": trash.stats()}
+
+# Values owned by other subsystems, read when /metrics is scraped
+metrics.callback("onpoint_exec_queue_depth", "Execution jobs waiting for a slot", "gauge", lambda: execution.queued)
+metrics.callback("onpoint_exec_running", "Execution jobs running", "gauge", lambda: execution.running)
+metrics.callback(
+    "onpoint_exec_jobs_total", "Finished execution jobs by outcome", "counter",
+    lambda: [((k,), execution.counters[k]) for k in ("completed", "timeouts", "errors")], ("outcome",),
+)
+metrics.callback(
+    "onpoint_exec_starts_total", "Execution worker starts", "counter",
+    lambda: [(("warm",), execution.counters["warm_starts"]), (("cold",), execution.counters["cold_starts"])],
+    ("kind",),
+)
+metrics.callback("onpoint_terminal_sessions", "Open terminal sessions", "gauge", lambda: len(terminals.sessions))
+metrics.callback(
+    "onpoint_terminal_viewers", "WebSocket connections attached to terminals", "gauge",
+    lambda: sum(len(s.viewers) for s in terminals.sessions.values()),
+)
+metrics.callback("onpoint_terminal_reaped_total", "Terminal sessions reaped", "counter", lambda: terminals.reaped)
+metrics.callback(
+    "onpoint_upstream_events_total", "Outbound model HTTP requests, retries and errors", "counter",
+    lambda: [((p, k), v) for p, counters in list(upstream.stats.items()) for k, v in counters.items()],
+    ("provider", "event"),
+)
+metrics.callback(
+    "onpoint_ai_cache_events_total", "AI response cache lookups and evictions", "counter",
+    lambda: [((k,), v) for k, v in ai_cache.counters.items()], ("event",),
+)
+metrics.callback("onpoint_io_pool_active", "I/O pool threads busy", "gauge", lambda: io_pool.stats()["active"])
+metrics.callback("onpoint_io_pool_queued", "I/O pool calls waiting for a thread", "gauge", lambda: io_pool.stats()["queued"])
+metrics.callback(
+    "onpoint_event_loop_lag_current_seconds", "Most recent event loop lag sample", "gauge",
+    lambda: loop_lag.samples[-1] if loop_lag.samples else 0,
+)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Rendered on the loop: the collectors only read in-memory state, some
+    # of it (terminal sessions) owned by the loop
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,305 @@
+import re
+import threading
+import time
+from array import array
+from pathlib import Path
+
+from code_index import walk_workspace
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    # Before Python 3.11
+    import sre_parse
+
+_REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", None)} - {None}
+
+# Files above this size, or that look binary, are left out of text search
+MAX_FILE_SIZE = 1024 * 1024
+SKIP_DIRS = {'.git', 'node_modules', '__pycache__', '.venv', 'venv'}
+# Unwatched workspaces are re-stat'ed at most this often
+REFRESH_INTERVAL = 30.0
+MAX_HITS_PER_FILE = 20
+# Queries with no usable trigram read files directly; stop after this many
+FULL_SCAN_MAX_FILES = 2000
+
+
+def trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _literal_runs(parsed):
+    """(runs, exact) for a parsed pattern: the literal runs every match
+    contains, and whether the pattern is nothing but one literal run."""
+    runs, current, exact = [], [], True
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            current.append(chr(av))
+            continue
+        if op is sre_parse.AT:
+            # Anchors are zero-width and do not split a run
+            continue
+        if op is sre_parse.SUBPATTERN:
+            sub_runs, sub_exact = _literal_runs(av[-1])
+            if sub_exact:
+                current.extend(''.join(sub_runs))
+                continue
+        elif op in _REPEATS and av[0] >= 1:
+            # Present at least once, but the runs do not join across the
+            # repeat's edges
+            sub_runs = _literal_runs(av[2])[0]
+        else:
+            # Classes, alternations, optional parts, backreferences
+            sub_runs = []
+        exact = False
+        runs.append(''.join(current))
+        current = []
+        runs.extend(sub_runs)
+    runs.append(''.join(current))
+    runs = [r for r in runs if r]
+    return runs, exact and len(runs) <= 1
+
+
+def required_literals(pattern: str):
+    """Literal runs of 3+ characters every match of pattern must contain,
+    read off the parsed pattern so escapes and quantifiers are handled as
+    re handles them."""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, RecursionError):
+        return []
+    return [r for r in _literal_runs(parsed)[0] if len(r) >= 3]
+
+
+class SearchIndex:
+    """Trigram inverted index over the text files of one workspace.
+
+    Every distinct lower-cased trigram gets a small int id, and its posting
+    list is an array of the ids of files containing it; a query intersects
+    the postings of its trigrams and only reads the surviving candidate
+    files to confirm and locate matches.
+
+    Files keep no list of their trigrams. Removing a file just drops its
+    id, and the dead ids are swept out of the postings once they make up
+    half of them.
+    """
+
+    def __init__(self, root: Path, base_dir: Path):
+        self.root = Path(root)
+        self.base_dir = Path(base_dir)
+        self._lock = threading.RLock()
+        self._ids = {}
+        self._files = {}
+        self._gram_ids = {}
+        self._postings = []
+        self._next_id = 0
+        # Posting entries in total, and those naming removed files
+        self._entries = 0
+        self._dead = 0
+        self.last_refresh = 0.0
+        self.watched = False
+        self.building = False
+        self._build_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.last_refresh)
+
+    def _add(self, path: Path, st):
+        rel = str(path.relative_to(self.base_dir))
+        self._remove(rel)
+        if st.st_size > MAX_FILE_SIZE:
+            return
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return
+        if b'\0' in data[:8192]:
+            return
+        file_id = self._next_id
+        self._next_id += 1
+        count = 0
+        for gram in trigrams(data.decode('utf-8', errors='ignore').lower()):
+            gram_id = self._gram_ids.get(gram)
+            if gram_id is None:
+                gram_id = self._gram_ids[gram] = len(self._postings)
+                self._postings.append(array('I'))
+            self._postings[gram_id].append(file_id)
+            count += 1
+        self._ids[rel] = file_id
+        self._files[file_id] = (rel, st.st_size, st.st_mtime_ns, count)
+        self._entries += count
+
+    def _remove(self, rel: str):
+        file_id = self._ids.pop(rel, None)
+        if file_id is None:
+            return
+        self._dead += self._files.pop(file_id)[3]
+
+    def _compact(self):
+        if not self._dead or self._dead * 2 < self._entries:
+            return
+        files = self._files
+        for gram_id, ids in enumerate(self._postings):
+            self._postings[gram_id] = array('I', [i for i in ids if i in files])
+        self._entries -= self._dead
+        self._dead = 0
+
+    def refresh(self):
+        # Re-reads only files whose size or mtime changed. The lock is taken
+        # per file so queries are not held up for the whole walk.
+        with self._lock:
+            before = set(self._ids)
+        seen = set()
+        for path, is_dir, st in walk_workspace(self.root, SKIP_DIRS):
+            if is_dir:
+                continue
+            rel = str(path.relative_to(self.base_dir))
+            seen.add(rel)
+            with self._lock:
+                file_id = self._ids.get(rel)
+                if file_id is not None:
+                    _, size, mtime_ns, _ = self._files[file_id]
+                    if size == st.st_size and mtime_ns == st.st_mtime_ns:
+                        continue
+                self._add(path, st)
+        with self._lock:
+            # Only files that were indexed before the walk began; anything the
+            # watcher added meanwhile stays
+            for rel in before - seen:
+                self._remove(rel)
+            self._compact()
+            self.last_refresh = time.time()
+
+    def schedule_refresh(self) -> bool:
+        """Refresh on a background thread unless one is already running."""
+        with self._build_lock:
+            if self.building:
+                return False
+            self.building = True
+        threading.Thread(target=self._background_refresh, name="search-index", daemon=True).start()
+        return True
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        finally:
+            self.building = False
+
+    def ensure_fresh(self) -> bool:
+        # Never walks inline: a missing or stale index is rebuilt in the
+        # background and the caller learns whether there is one to query yet
+        if not self.last_refresh or (not self.watched and time.time() - self.last_refresh > REFRESH_INTERVAL):
+            self.schedule_refresh()
+        return self.ready
+
+    def update_path(self, path: Path):
+        # Called by the workspace watcher for each changed path
+        with self._lock:
+            try:
+                rel = str(path.relative_to(self.base_dir))
+            except ValueError:
+                return
+            if path.is_symlink():
+                # walk_workspace never follows links; drop anything indexed
+                # under a path that has since become one
+                self._remove_prefix(rel)
+            elif path.is_file():
+                if not any(part in SKIP_DIRS for part in path.relative_to(self.root).parts):
+                    self._add(path, path.stat())
+            elif path.is_dir():
+                for sub, is_dir, st in walk_workspace(path, SKIP_DIRS):
+                    if not is_dir:
+                        self._add(sub, st)
+            else:
+                self._remove_prefix(rel)
+            self._compact()
+
+    def _remove_prefix(self, rel: str):
+        prefix = rel + '/'
+        for gone in [r for r in self._ids if r == rel or r.startswith(prefix)]:
+            self._remove(gone)
+
+    def candidates(self, literals):
+        # literals: lower-cased strings every hit must contain; None = all files
+        with self._lock:
+            if not literals:
+                return sorted(r for r, _, _, _ in self._files.values())
+            postings = []
+            for literal in literals:
+                for gram in trigrams(literal):
+                    gram_id = self._gram_ids.get(gram)
+                    if gram_id is None:
+                        return []
+                    postings.append(self._postings[gram_id])
+            if not postings:
+                ids = self._files.keys()
+            else:
+                # Shortest first keeps the intermediate sets small
+                postings.sort(key=len)
+                ids = set(postings[0])
+                for other in postings[1:]:
+                    ids.intersection_update(other)
+                    if not ids:
+                        return []
+            return sorted(self._files[i][0] for i in ids if i in self._files)
+
+    def search(self, query: str, mode: str = "substring", case_sensitive: bool = False,
+               path_prefix: str = "", limit: int = 100):
+        flags = 0 if case_sensitive else re.IGNORECASE
+        if mode == "regex":
+            regex = re.compile(query, flags)
+            literals = required_literals(query)
+        else:
+            regex = re.compile(re.escape(query), flags)
+            literals = [query] if len(query) >= 3 else None
+        if literals:
+            literals = [lit.lower() for lit in literals]
+        hits = []
+        complete = True
+        scanned = 0
+        for rel in self.candidates(literals):
+            if path_prefix and not rel.startswith(path_prefix):
+                continue
+            if not literals and (scanned >= FULL_SCAN_MAX_FILES or len(hits) >= limit):
+                # Nothing narrowed the candidates; settle for the first hits
+                # rather than reading the whole workspace
+                complete = False
+                break
+            scanned += 1
+            file_hits = self._scan_file(rel, regex)
+            if not file_hits:
+                continue
+            # Files with more matches rank higher; a match in the file name
+            # counts for a lot, and shallow paths beat deep ones
+            score = len(file_hits) + (10 if regex.search(Path(rel).name) else 0) - rel.count('/') * 0.1
+            for hit in file_hits:
+                hit["score"] = round(score, 2)
+            hits.extend(file_hits)
+        hits.sort(key=lambda h: (-h["score"], h["path"], h["line"]))
+        return hits[:limit], complete
+
+    def _scan_file(self, rel: str, regex):
+        try:
+            with open(self.base_dir / rel, 'r', encoding='utf-8', errors='ignore') as f:
+                text = f.read()
+        except OSError:
+            return []
+        hits = []
+        for lineno, line in enumerate(text.splitlines(), 1):
+            m = regex.search(line)
+            if m:
+                hits.append({"path": rel, "line": lineno, "column": m.start() + 1, "text": line.strip()[:200]})
+                if len(hits) >= MAX_HITS_PER_FILE:
+                    break
+        return hits
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "trigrams": len(self._gram_ids),
+                "postings": self._entries - self._dead,
+                "last_refresh": self.last_refresh,
+                "building": self.building,
+            }
@@ -0,0 +1,414 @@
+import asyncio
+import codecs
+import fcntl
+import json
+import os
+import pty
+import signal
+import struct
+import termios
+import time
+import uuid
+from collections import deque
+
+from env import env_int
+
+READ_SIZE = 64 * 1024
+# Reads from the PTY pause while a consumer has this much unsent output
+# and resume once it is back under LOW_WATER, so a fast producer (cat of a
+# big file) is throttled by the kernel instead of growing our buffers
+HIGH_WATER = 1024 * 1024
+LOW_WATER = 64 * 1024
+# Largest single WebSocket message
+MAX_FRAME = 256 * 1024
+
+
+def parse_control(text: str):
+    """The JSON control message in text, or None if it is plain input."""
+    if not text.startswith('{"type"'):
+        return None
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return None
+    if isinstance(message, dict) and message.get("type") == "resize":
+        return message
+    return None
+
+
+def _set_controlling_tty():
+    # Runs in the child after setsid(): make the PTY its controlling
+    # terminal so job control and SIGWINCH on resize work
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+
+class Pty:
+    """A shell on a pseudo-terminal, driven by the event loop.
+
+    The master fd is registered with add_reader, so an idle terminal costs
+    no thread and output is picked up as soon as it is written. on_output
+    is called with raw bytes, on_exit once when the shell goes away.
+    """
+
+    def __init__(self, argv=("/bin/bash",), cwd=None, cols=80, rows=24):
+        self.argv = list(argv)
+        self.cwd = cwd
+        self.cols = cols
+        self.rows = rows
+        self.master_fd = None
+        self.process = None
+        self.on_output = None
+        self.on_exit = None
+        self.closed = False
+        self._loop = None
+        self._reading = False
+        self._paused_by = set()
+        self._pending = bytearray()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self.master_fd, slave_fd = pty.openpty()
+        try:
+            self._set_size(slave_fd)
+            env = dict(os.environ)
+            env.setdefault("TERM", "xterm-256color")
+            self.process = await asyncio.create_subprocess_exec(
+                *self.argv,
+                stdin=slave_fd,
+                stdout=slave_fd,
+                stderr=slave_fd,
+                cwd=self.cwd,
+                env=env,
+                start_new_session=True,
+                preexec_fn=_set_controlling_tty,
+            )
+        except BaseException:
+            os.close(self.master_fd)
+            raise
+        finally:
+            # Only the child keeps the slave open, so its exit shows up as EIO
+            os.close(slave_fd)
+        os.set_blocking(self.master_fd, False)
+        self.resume_reading()
+
+    def _set_size(self, fd):
+        fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", self.rows, self.cols, 0, 0))
+
+    def resize(self, cols: int, rows: int):
+        if self.closed:
+            return
+        self.cols = max(1, min(int(cols), 1000))
+        self.rows = max(1, min(int(rows), 1000))
+        self._set_size(self.master_fd)
+
+    def pause_reading(self, by=None):
+        # Several consumers may pause; reading resumes once all have resumed
+        self._paused_by.add(by)
+        if self._reading and not self.closed:
+            self._loop.remove_reader(self.master_fd)
+            self._reading = False
+
+    def resume_reading(self, by=None):
+        self._paused_by.discard(by)
+        if not self._paused_by and not self._reading and not self.closed:
+            self._loop.add_reader(self.master_fd, self._on_readable)
+            self._reading = True
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.master_fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            # EIO: every process holding the slave side has exited
+            data = b""
+        if not data:
+            self._finish()
+            return
+        if self.on_output is not None:
+            self.on_output(data)
+
+    def write(self, data: bytes):
+        """Queue input for the shell; never blocks the loop."""
+        if self.closed or not data:
+            return
+        if self._pending:
+            self._pending += data
+            return
+        try:
+            written = os.write(self.master_fd, data)
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            return
+        if written < len(data):
+            self._pending += data[written:]
+            self._loop.add_writer(self.master_fd, self._on_writable)
+
+    def _on_writable(self):
+        try:
+            written = os.write(self.master_fd, self._pending)
+        except BlockingIOError:
+            return
+        except OSError:
+            written = len(self._pending)
+        del self._pending[:written]
+        if not self._pending:
+            self._loop.remove_writer(self.master_fd)
+
+    def _finish(self):
+        if self.closed:
+            return
+        if self._reading:
+            self._loop.remove_reader(self.master_fd)
+            self._reading = False
+        if self._pending:
+            self._loop.remove_writer(self.master_fd)
+            self._pending.clear()
+        self.closed = True
+        if self.on_exit is not None:
+            self.on_exit()
+
+    async def close(self):
+        self._finish()
+        if self.process is not None and self.process.returncode is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGHUP)
+            except (ProcessLookupError, PermissionError):
+                pass
+            try:
+                await asyncio.wait_for(self.process.wait(), 2)
+            except asyncio.TimeoutError:
+                try:
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                except (ProcessLookupError, PermissionError):
+                    pass
+                await self.process.wait()
+        if self.master_fd is not None:
+            os.close(self.master_fd)
+            self.master_fd = None
+
+
+class OutputStream:
+    """Coalesces PTY output for one consumer and applies backpressure.
+
+    Whatever arrives while a send is in flight goes out as one message
+    with the next send, so bursts become few large frames without adding
+    latency to single keystroke echoes.
+    """
+
+    def __init__(self, send, terminal: Pty):
+        self.send = send
+        self.terminal = terminal
+        self._buffer = bytearray()
+        self._ready = asyncio.Event()
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._closed = False
+        self.paused = False
+
+    def feed(self, data: bytes):
+        self._buffer += data
+        self._ready.set()
+        if len(self._buffer) > HIGH_WATER and not self.paused:
+            self.paused = True
+            self.terminal.pause_reading(self)
+
+    def close(self):
+        self._closed = True
+        self._ready.set()
+        if self.paused:
+            self.paused = False
+            self.terminal.resume_reading(self)
+
+    async def run(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._buffer:
+                chunk = bytes(self._buffer[:MAX_FRAME])
+                del self._buffer[:MAX_FRAME]
+                text = self._decoder.decode(chunk)
+                if text:
+                    await self.send(text)
+                if self.paused and len(self._buffer) < LOW_WATER:
+                    self.paused = False
+                    self.terminal.resume_reading(self)
+            if self._closed:
+                tail = self._decoder.decode(b"", final=True)
+                if tail:
+                    await self.send(tail)
+                return
+
+
+class TerminalLimitError(Exception):
+    pass
+
+
+def _line_start(data: bytes, offset: int) -> int:
+    """Where to cut data at or after offset so replay starts on a fresh line.
+
+    Cutting mid-line could split a UTF-8 sequence or an escape sequence.
+    Without a newline in reach, fall back to the next UTF-8 character start.
+    """
+    newline = data.find(b"\n", offset)
+    if newline != -1:
+        return newline + 1
+    while offset < len(data) and 0x80 <= data[offset] < 0xC0:
+        offset += 1
+    return offset
+
+
+class TerminalSession:
+    """A shell that outlives the WebSocket connections viewing it.
+
+    Output is fanned out to every attached viewer and kept in a bounded
+    scrollback, which is replayed to viewers that attach later.
+    """
+
+    def __init__(self, session_id, terminal: Pty, scrollback_bytes, persistent=True):
+        self.id = session_id
+        self.persistent = persistent
+        self.terminal = terminal
+        self.scrollback_bytes = scrollback_bytes
+        self.scrollback = deque()
+        self.scrollback_size = 0
+        self.viewers = set()
+        self.created = time.time()
+        self.last_active = self.created
+        self.on_exit = None
+        terminal.on_output = self._on_output
+        terminal.on_exit = self._on_exit
+
+    @property
+    def alive(self):
+        return not self.terminal.closed
+
+    def _on_output(self, data: bytes):
+        self.scrollback.append(data)
+        self.scrollback_size += len(data)
+        # Drop whole chunks from the front, then trim the oldest one
+        while self.scrollback_size - len(self.scrollback[0]) >= self.scrollback_bytes:
+            self.scrollback_size -= len(self.scrollback.popleft())
+        excess = self.scrollback_size - self.scrollback_bytes
+        if excess > 0:
+            first = self.scrollback[0]
+            cut = _line_start(first, excess)
+            if cut < len(first):
+                self.scrollback[0] = first[cut:]
+            else:
+                self.scrollback.popleft()
+            self.scrollback_size -= cut
+        for viewer in self.viewers:
+            viewer.feed(data)
+
+    def _on_exit(self):
+        for viewer in self.viewers:
+            viewer.close()
+        if self.on_exit is not None:
+            self.on_exit(self)
+
+    def attach(self, send) -> OutputStream:
+        viewer = OutputStream(send, self.terminal)
+        # Replay and registration happen in one step, so nothing produced
+        # in between can be missed or duplicated
+        if self.scrollback:
+            viewer.feed(b"".join(self.scrollback))
+        if self.alive:
+            self.viewers.add(viewer)
+        else:
+            viewer.close()
+        self.last_active = time.time()
+        return viewer
+
+    def detach(self, viewer: OutputStream):
+        self.viewers.discard(viewer)
+        viewer.close()
+        self.last_active = time.time()
+
+    def write(self, data: bytes):
+        self.last_active = time.time()
+        self.terminal.write(data)
+
+    def resize(self, cols: int, rows: int):
+        self.terminal.resize(cols, rows)
+
+    def info(self) -> dict:
+        return {
+            "id": self.id,
+            "created": self.created,
+            "last_active": self.last_active,
+            "viewers": len(self.viewers),
+            "cols": self.terminal.cols,
+            "rows": self.terminal.rows,
+            "pid": self.terminal.process.pid if self.terminal.process else None,
+            "alive": self.alive,
+            "persistent": self.persistent,
+            "scrollback_bytes": self.scrollback_size,
+        }
+
+
+class TerminalManager:
+    """Registry of terminal sessions with an idle reaper.
+
+    A session nobody has viewed or typed into for idle_timeout seconds is
+    closed, as is any session whose shell has exited. Only persistent
+    sessions count against max_sessions; an ephemeral one lives exactly as
+    long as its WebSocket.
+    """
+
+    def __init__(self, max_sessions=None, idle_timeout=None, scrollback_bytes=None):
+        self.max_sessions = max_sessions or env_int("ONPOINT_TERMINAL_MAX_SESSIONS", 50)
+        self.idle_timeout = idle_timeout or env_int("ONPOINT_TERMINAL_IDLE_TIMEOUT", 1800)
+        self.scrollback_bytes = scrollback_bytes or env_int("ONPOINT_TERMINAL_SCROLLBACK", 256 * 1024)
+        self.sessions = {}
+        self.reaped = 0
+
+    @property
+    def persistent_count(self) -> int:
+        return sum(1 for s in self.sessions.values() if s.persistent)
+
+    async def create(self, cols=80, rows=24, cwd=None, persistent=True) -> TerminalSession:
+        if persistent and self.persistent_count >= self.max_sessions:
+            raise TerminalLimitError(f"Too many terminal sessions (limit {self.max_sessions})")
+        terminal = Pty(cwd=cwd, cols=cols, rows=rows)
+        await terminal.start()
+        session = TerminalSession(uuid.uuid4().hex, terminal, self.scrollback_bytes, persistent)
+        # The shell exited on its own; reap the process and the PTY
+        session.on_exit = lambda s: asyncio.ensure_future(self.close(s.id))
+        self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id: str):
+        return self.sessions.get(session_id)
+
+    async def close(self, session_id: str) -> bool:
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        await session.terminal.close()
+        return True
+
+    async def reap(self, now: float = None) -> int:
+        now = time.time() if now is None else now
+        idle = [
+            s.id for s in self.sessions.values()
+            if not s.alive or (not s.viewers and now - s.last_active > self.idle_timeout)
+        ]
+        for session_id in idle:
+            await self.close(session_id)
+        self.reaped += len(idle)
+        return len(idle)
+
+    async def close_all(self):
+        for session_id in list(self.sessions):
+            await self.close(session_id)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "persistent_sessions": self.persistent_count,
+            "viewers": sum(len(s.viewers) for s in self.sessions.values()),
+            "max_sessions": self.max_sessions,
+            "idle_timeout": self.idle_timeout,
+            "reaped": self.reaped,
+        }
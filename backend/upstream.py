@@ -0,0 +1,142 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from env import env_float, env_int
+
+try:
+    import h2  # noqa: F401  (httpx only speaks HTTP/2 when h2 is installed)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamPool:
+    """One keep-alive httpx client shared by every outbound model call.
+
+    Each provider gets its own semaphore so a burst against one upstream
+    cannot starve the others, and 429/5xx responses and transport errors
+    are retried with exponential backoff (honouring Retry-After).
+    """
+
+    def __init__(self, concurrency=None, timeout=None, connect_timeout=None,
+                 retries=None, backoff=None, max_connections=None):
+        self.concurrency = concurrency or {
+            "gemini": env_int("ONPOINT_GEMINI_CONCURRENCY", 16),
+            "deepseek": env_int("ONPOINT_DEEPSEEK_CONCURRENCY", 4),
+        }
+        self.timeout = timeout if timeout is not None else env_float("ONPOINT_HTTP_TIMEOUT", 60)
+        self.connect_timeout = (
+            connect_timeout if connect_timeout is not None else env_float("ONPOINT_HTTP_CONNECT_TIMEOUT", 10)
+        )
+        self.retries = retries if retries is not None else env_int("ONPOINT_HTTP_RETRIES", 3)
+        self.backoff = backoff if backoff is not None else env_float("ONPOINT_HTTP_BACKOFF", 0.5)
+        self.max_connections = max_connections or env_int("ONPOINT_HTTP_MAX_CONNECTIONS", 100)
+        self._client = None
+        self._semaphores = {}
+        self.stats = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections // 2,
+                    keepalive_expiry=60,
+                ),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def semaphore(self, provider: str) -> asyncio.Semaphore:
+        sem = self._semaphores.get(provider)
+        if sem is None:
+            sem = self._semaphores[provider] = asyncio.Semaphore(self.concurrency.get(provider, 8))
+        return sem
+
+    def _count(self, provider, key):
+        counters = self.stats.setdefault(provider, {"requests": 0, "retries": 0, "errors": 0})
+        counters[key] += 1
+
+    def _delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return min(float(retry_after), 30.0)
+                except ValueError:
+                    try:
+                        return max(0.0, min(parsedate_to_datetime(retry_after).timestamp() - time.time(), 30.0))
+                    except (TypeError, ValueError):
+                        pass
+        return self.backoff * (2 ** attempt) * (0.5 + random.random())
+
+    async def request(self, provider: str, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request, retrying 429/5xx and transport errors. The final
+        response is returned as-is; callers decide whether to raise_for_status."""
+        for attempt in range(self.retries + 1):
+            self._count(provider, "requests")
+            try:
+                async with self.semaphore(provider):
+                    response = await self.client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    self._count(provider, "errors")
+                    raise
+                self._count(provider, "retries")
+                await asyncio.sleep(self._delay(attempt))
+                continue
+            if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                self._count(provider, "retries")
+                await asyncio.sleep(self._delay(attempt, response))
+                continue
+            if response.status_code >= 400:
+                self._count(provider, "errors")
+            return response
+
+    async def post_json(self, provider: str, url: str, **kwargs):
+        response = await self.request(provider, "POST", url, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def stream_lines(self, provider: str, method: str, url: str, **kwargs):
+        """Yield response lines as they arrive. Retries only happen before
+        the first byte; once streaming has started errors propagate. Closing
+        the generator closes the upstream connection."""
+        started = False
+        for attempt in range(self.retries + 1):
+            self._count(provider, "requests")
+            retry_delay = None
+            try:
+                async with self.semaphore(provider):
+                    async with self.client.stream(method, url, **kwargs) as response:
+                        if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                            retry_delay = self._delay(attempt, response)
+                        else:
+                            if response.status_code >= 400:
+                                self._count(provider, "errors")
+                                await response.aread()
+                            response.raise_for_status()
+                            async for line in response.aiter_lines():
+                                started = True
+                                yield line
+                            return
+            except httpx.TransportError:
+                if started or attempt >= self.retries:
+                    self._count(provider, "errors")
+                    raise
+                retry_delay = self._delay(attempt)
+            self._count(provider, "retries")
+            await asyncio.sleep(retry_delay)
@@ -0,0 +1,349 @@
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    created REAL NOT NULL,
+    hash TEXT NOT NULL REFERENCES blobs(hash)
+);
+CREATE INDEX IF NOT EXISTS versions_path ON versions(path, id);
+CREATE INDEX IF NOT EXISTS versions_hash ON versions(hash);
+"""
+
+TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+# save_file reads and compresses files this much at a time
+CHUNK_SIZE = 1024 * 1024
+# Backups written by older releases: <name>.<YYYYmmddHHMMSS> or
+# <name>.<YYYYmmdd_HHMMSS> (the latter from /ai/apply_change/)
+_LEGACY_SUFFIX = re.compile(r"^(?P<name>.+)\.(?P<ts>\d{8}_?\d{6})$")
+
+DEFAULT_RETENTION = {
+    # Always keep this many newest versions of every file
+    "keep_last": 50,
+    # Beyond this age keep only the newest version per hour...
+    "hourly_after_days": 1,
+    # ...and beyond this age only the newest per day
+    "daily_after_days": 7,
+    # Cap on compressed bytes for the whole store; 0 disables it
+    "max_bytes": 0,
+}
+
+
+class VersionStore:
+    """Content-addressed file history.
+
+    Each distinct content is stored once as a zlib-compressed blob named by
+    its sha256 under objects/; the per-file manifest is a row per version in
+    SQLite. Saving content identical to a file's latest version is a no-op.
+    """
+
+    def __init__(self, root: Path, level: int = 6):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.root / "versions.sqlite3"
+        self.level = level
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest[2:]
+
+    def _write_blob(self, digest: str, data: bytes) -> int:
+        path = self._blob_path(digest)
+        if path.exists():
+            return path.stat().st_size
+        path.parent.mkdir(parents=True, exist_ok=True)
+        packed = zlib.compress(data, self.level)
+        fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(packed)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return len(packed)
+
+    def _write_blob_from(self, f):
+        """Compress the rest of file object f into the store, hashing it on
+        the way. Returns (digest, size, stored_size)."""
+        digest, size, stored = hashlib.sha256(), 0, 0
+        packer = zlib.compressobj(self.level)
+        fd, tmp = tempfile.mkstemp(dir=str(self.objects), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(packer.compress(chunk))
+                out.write(packer.flush())
+                stored = out.tell()
+            path = self._blob_path(digest.hexdigest())
+            if path.exists():
+                os.unlink(tmp)
+                return digest.hexdigest(), size, path.stat().st_size
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return digest.hexdigest(), size, stored
+
+    def _latest_hash(self, conn, rel_path: str):
+        row = conn.execute(
+            "SELECT hash FROM versions WHERE path = ? ORDER BY id DESC LIMIT 1", (rel_path,)
+        ).fetchone()
+        return row["hash"] if row else None
+
+    def _record(self, conn, rel_path, digest, size, stored_size, created):
+        timestamp = datetime.fromtimestamp(created).strftime(TIMESTAMP_FORMAT)
+        conn.execute(
+            "INSERT OR IGNORE INTO blobs (hash, size, stored_size) VALUES (?, ?, ?)",
+            (digest, size, stored_size),
+        )
+        cur = conn.execute(
+            "INSERT INTO versions (path, timestamp, created, hash) VALUES (?, ?, ?, ?)",
+            (rel_path, timestamp, created, digest),
+        )
+        return cur.lastrowid
+
+    def save_file(self, rel_path: str, path: Path, created: float = None):
+        """save() for a file on disk, hashed and compressed a chunk at a
+        time so a large file is never held in memory whole."""
+        created = time.time() if created is None else created
+        with open(path, "rb") as f:
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+            with self._lock:
+                with self._connect() as conn:
+                    if self._latest_hash(conn, rel_path) == digest.hexdigest():
+                        return None
+                f.seek(0)
+                # Hashed again while compressing: if the file changed in
+                # between, the blob is filed under what was actually read
+                entry = self._write_blob_from(f)
+                with self._connect() as conn:
+                    version_id = self._record(conn, rel_path, *entry, created)
+        return self.get(version_id)
+
+    def save(self, rel_path: str, data: bytes, created: float = None):
+        """Record data as the newest version of rel_path.
+
+        Returns the new version row, or None if it matches the latest one.
+        """
+        return self.save_many([(rel_path, data)], created)[0]
+
+    def save_many(self, items, created: float = None):
+        """save() for several (rel_path, data) pairs, recorded in a single
+        transaction. Returns a row or None per item, in order."""
+        created = time.time() if created is None else created
+        digests = [hashlib.sha256(data).hexdigest() for _, data in items]
+        with self._lock:
+            with self._connect() as conn:
+                latest = {rel_path: self._latest_hash(conn, rel_path) for rel_path, _ in items}
+            pending = []
+            for (rel_path, data), digest in zip(items, digests):
+                if latest[rel_path] == digest:
+                    pending.append(None)
+                    continue
+                latest[rel_path] = digest
+                pending.append((rel_path, digest, len(data), self._write_blob(digest, data)))
+            version_ids = []
+            with self._connect() as conn:
+                for entry in pending:
+                    version_ids.append(None if entry is None else self._record(conn, *entry, created))
+        return [self.get(i) if i is not None else None for i in version_ids]
+
+    def list(self, rel_path: str):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT v.id, v.path, v.timestamp, v.created, v.hash, b.size "
+                "FROM versions v JOIN blobs b ON b.hash = v.hash WHERE v.path = ? ORDER BY v.id DESC",
+                (rel_path,),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def get(self, version_id: int):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT v.id, v.path, v.timestamp, v.created, v.hash, b.size "
+                "FROM versions v JOIN blobs b ON b.hash = v.hash WHERE v.id = ?",
+                (version_id,),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def read(self, version_id: int):
+        version = self.get(version_id)
+        if version is None:
+            return None, None
+        try:
+            with open(self._blob_path(version["hash"]), "rb") as f:
+                return version, zlib.decompress(f.read())
+        except FileNotFoundError:
+            # Blob removed behind the manifest's back; treat as gone
+            return None, None
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            versions, paths = conn.execute("SELECT COUNT(*), COUNT(DISTINCT path) FROM versions").fetchone()
+            blobs, stored, logical = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(stored_size), 0), COALESCE(SUM(size), 0) FROM blobs"
+            ).fetchone()
+        return {
+            "versions": versions,
+            "paths": paths,
+            "blobs": blobs,
+            "stored_bytes": stored,
+            "logical_bytes": logical,
+        }
+
+    def compact(self, policy=None, now: float = None) -> dict:
+        """Apply the retention policy and delete unreferenced blobs."""
+        policy = {**DEFAULT_RETENTION, **(policy or {})}
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        hourly_after = float(policy["hourly_after_days"]) * 86400
+        daily_after = float(policy["daily_after_days"]) * 86400
+        keep_last = int(policy["keep_last"])
+        doomed = []
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, path, created FROM versions ORDER BY path, id DESC").fetchall()
+        current_path, position, buckets = None, 0, set()
+        for row in rows:
+            if row["path"] != current_path:
+                current_path, position, buckets = row["path"], 0, set()
+            position += 1
+            if position <= keep_last:
+                continue
+            age = now - row["created"]
+            if age < hourly_after:
+                continue
+            # Rows are newest first, so the first seen in a bucket is kept
+            bucket = int(row["created"] // (86400 if age >= daily_after else 3600))
+            key = (age >= daily_after, bucket)
+            if key in buckets:
+                doomed.append(row["id"])
+            else:
+                buckets.add(key)
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM versions WHERE id = ?", [(i,) for i in doomed])
+        deleted = len(doomed)
+        max_bytes = int(policy["max_bytes"] or 0)
+        if max_bytes:
+            deleted += self._enforce_max_bytes(max_bytes)
+        blobs, reclaimed = self._collect_garbage()
+        return {
+            "versions_deleted": deleted,
+            "blobs_deleted": blobs,
+            "bytes_reclaimed": reclaimed,
+            "duration": round(time.perf_counter() - started, 3),
+            "finished": time.time(),
+        }
+
+    def _enforce_max_bytes(self, max_bytes: int) -> int:
+        # Drop the oldest versions store-wide, never a file's newest one,
+        # until the blobs still referenced fit in max_bytes
+        with self._connect() as conn:
+            total = conn.execute(
+                "SELECT COALESCE(SUM(stored_size), 0) FROM blobs WHERE hash IN (SELECT hash FROM versions)"
+            ).fetchone()[0]
+            if total <= max_bytes:
+                return 0
+            candidates = conn.execute(
+                "SELECT id, hash FROM versions WHERE id NOT IN (SELECT MAX(id) FROM versions GROUP BY path) "
+                "ORDER BY created, id"
+            ).fetchall()
+            refs = dict(conn.execute("SELECT hash, COUNT(*) FROM versions GROUP BY hash").fetchall())
+            sizes = dict(conn.execute("SELECT hash, stored_size FROM blobs").fetchall())
+            deleted = 0
+            for row in candidates:
+                if total <= max_bytes:
+                    break
+                conn.execute("DELETE FROM versions WHERE id = ?", (row["id"],))
+                deleted += 1
+                refs[row["hash"]] -= 1
+                if refs[row["hash"]] == 0:
+                    total -= sizes.get(row["hash"], 0)
+        return deleted
+
+    def _collect_garbage(self):
+        # Under the save lock so a concurrent save cannot reuse a blob
+        # that is about to be removed
+        with self._lock:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT hash, stored_size FROM blobs WHERE hash NOT IN (SELECT hash FROM versions)"
+                ).fetchall()
+                for row in rows:
+                    try:
+                        self._blob_path(row["hash"]).unlink()
+                    except FileNotFoundError:
+                        pass
+                    conn.execute("DELETE FROM blobs WHERE hash = ?", (row["hash"],))
+        return len(rows), sum(r["stored_size"] for r in rows)
+
+    def migrate_legacy(self):
+        """Import full-copy backups left by older releases, then delete them."""
+        marker = self.root / ".migrated"
+        if marker.exists():
+            return 0
+        imported = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if Path(dirpath) == self.root:
+                dirnames[:] = [d for d in dirnames if d != "objects"]
+            # The two legacy timestamp formats interleave when sorted by
+            # name, so order each directory's snapshots by parsed time
+            snapshots = []
+            for name in filenames:
+                m = _LEGACY_SUFFIX.match(name)
+                if not m:
+                    continue
+                try:
+                    created = datetime.strptime(m.group("ts").replace("_", ""), TIMESTAMP_FORMAT).timestamp()
+                except ValueError:
+                    continue
+                snapshots.append((created, name, m.group("name")))
+            for created, name, original in sorted(snapshots):
+                legacy = Path(dirpath) / name
+                rel = str((Path(dirpath) / original).relative_to(self.root))
+                try:
+                    self.save(rel, legacy.read_bytes(), created=created)
+                    legacy.unlink()
+                    imported += 1
+                except (OSError, ValueError):
+                    continue
+        marker.touch()
+        return imported
@@ -0,0 +1,239 @@
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from code_index import INDEXED_SUFFIXES, SKIP_PREFIX, build_index, index_file
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # watcher support is optional
+    Observer = None
+    FileSystemEventHandler = object
+
+# Events are collected and applied in batches so a burst of writes to the
+# same file (editor saves, git checkouts) costs one re-parse.
+FLUSH_INTERVAL = 0.2
+IGNORED_EVENTS = {"opened", "closed_no_write"}
+
+
+class DirCache:
+    """In-memory directory listings, invalidated by watcher events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Bumped on every invalidation so a listing loaded concurrently with
+        # a change is not cached as if it were current
+        self._generation = 0
+        # Keeps generations from an earlier run of the server from matching
+        self._epoch = uuid.uuid4().hex[:8]
+
+    @property
+    def generation(self) -> str:
+        """Changes whenever any cached listing may have; usable as a
+        validator without loading anything."""
+        with self._lock:
+            return f"{self._epoch}.{self._generation}"
+
+    def get(self, dir_path: Path, load):
+        key = str(dir_path)
+        with self._lock:
+            listing = self._entries.get(key)
+            generation = self._generation
+        if listing is None:
+            listing = load(dir_path)
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = listing
+        return listing
+
+    def invalidate(self, path: Path):
+        # A change to path affects its parent's listing and, for a
+        # directory, its own listing and everything below it
+        key = str(path)
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(str(path.parent), None)
+            for cached in [k for k in self._entries if k == key or k.startswith(key + "/")]:
+                del self._entries[cached]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class _Handler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type in IGNORED_EVENTS:
+            return
+        self.watcher.queue(event.src_path)
+        dest = getattr(event, "dest_path", "")
+        if dest:
+            self.watcher.queue(dest)
+
+
+class WorkspaceWatcher:
+    """Keeps one workspace's code index and directory cache in sync with
+    filesystem events."""
+
+    def __init__(self, root: Path, base_dir: Path, store, dir_cache: DirCache, exclude=(), search=None):
+        self.root = Path(root)
+        self.base_dir = Path(base_dir)
+        self.store = store
+        self.dir_cache = dir_cache
+        self.search = search
+        self.exclude = {Path(p) for p in exclude}
+        self.stats = {"events": 0, "applied": 0, "errors": 0, "last_event": None}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._observer = None
+        self._flusher = None
+
+    def start(self):
+        self._observer = Observer()
+        self._observer.schedule(_Handler(self), str(self.root), recursive=True)
+        self._observer.start()
+        if self.search is not None:
+            self.search.watched = True
+        self._flusher = threading.Thread(target=self._flush_loop, name=f"watch-{self.root.name}", daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        if self.search is not None:
+            self.search.watched = False
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+
+    def queue(self, path: str):
+        p = Path(path)
+        if any(part.startswith(SKIP_PREFIX) for part in p.parts):
+            return
+        self.dir_cache.invalidate(p)
+        with self._lock:
+            self._pending.add(p)
+        self.stats["events"] += 1
+        self.stats["last_event"] = time.time()
+        self._wake.set()
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            time.sleep(FLUSH_INTERVAL)
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            for path in sorted(pending):
+                try:
+                    self.apply(path)
+                    self.stats["applied"] += 1
+                except Exception:
+                    self.stats["errors"] += 1
+
+    def apply(self, path: Path):
+        if path in self.exclude or path == self.root:
+            return
+        try:
+            rel = str(path.relative_to(self.base_dir))
+        except ValueError:
+            return
+        if self.search is not None:
+            self.search.update_path(path)
+        if path.is_symlink():
+            # Never followed by walk_workspace, so never indexed
+            self.store.remove_prefix(rel)
+        elif path.is_dir():
+            if self.store.get(rel) is not None:
+                # Already indexed; its children report their own events
+                return
+            # New or moved-in directory: diff its subtree against the index
+            changes, _ = build_index(path, self.base_dir, known=self.store.known_prefix(rel), exclude=self.exclude)
+            upserts = [{"path": rel, "type": "directory"}] + changes["upsert"]
+            self.store.apply(upserts, changes["touched"], changes["removed"])
+        elif path.is_file():
+            if path.suffix in INDEXED_SUFFIXES:
+                self.store.apply([index_file(path, rel)])
+        else:
+            self.store.remove_prefix(rel)
+
+    def status(self) -> dict:
+        return {"path": str(self.root.relative_to(self.base_dir)), **self.stats}
+
+
+class WatcherRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watchers = {}
+
+    @property
+    def available(self) -> bool:
+        return Observer is not None
+
+    def start(self, root: Path, factory):
+        key = str(root)
+        with self._lock:
+            watcher = self._watchers.get(key)
+            if watcher is not None:
+                return watcher, False
+            watcher = factory()
+            watcher.start()
+            self._watchers[key] = watcher
+            return watcher, True
+
+    def stop(self, root: Path):
+        with self._lock:
+            watcher = self._watchers.pop(str(root), None)
+        if watcher is not None:
+            watcher.stop()
+        return watcher
+
+    def stop_under(self, path: Path):
+        """Stop every watcher whose root is path or lies below it."""
+        prefix = str(path) + "/"
+        with self._lock:
+            gone = [k for k in self._watchers if k == str(path) or k.startswith(prefix)]
+            watchers = [self._watchers.pop(k) for k in gone]
+        for watcher in watchers:
+            watcher.stop()
+        return watchers
+
+    def _prune(self):
+        # Watchers whose root was deleted or moved away behind our back
+        with self._lock:
+            gone = [k for k, w in self._watchers.items() if not w.root.is_dir()]
+            watchers = [self._watchers.pop(k) for k in gone]
+        for watcher in watchers:
+            watcher.stop()
+            watcher.dir_cache.invalidate(watcher.root)
+
+    def stop_all(self):
+        with self._lock:
+            watchers, self._watchers = list(self._watchers.values()), {}
+        for watcher in watchers:
+            watcher.stop()
+
+    def covering(self, path: Path):
+        # The watcher whose workspace contains path, if any
+        self._prune()
+        s = str(path)
+        with self._lock:
+            for key, watcher in self._watchers.items():
+                if s == key or s.startswith(key + "/"):
+                    return watcher
+        return None
+
+    def all(self):
+        self._prune()
+        with self._lock:
+            return list(self._watchers.values())
@@ -1,6 +1,9 @@
 import React, { useEffect, useRef } from 'react';
 import { Terminal } from 'xterm';
 import 'xterm/css/xterm.css';
+import { createTerminalSession, terminalSocketUrl } from './api';
+
+const TERMINAL_SESSION_KEY = 'onpoint_terminal_session';
 
 function TerminalPanel({ visible = true }) {
   const terminalRef = useRef(null);
@@ -24,28 +27,67 @@ function TerminalPanel({ visible = true }) {
       xtermRef.current.open(terminalRef.current);
     }
 
-    // Connect to backend WebSocket
-    wsRef.current = new WebSocket('ws://localhost:8000/ws/terminal/');
-    wsRef.current.onopen = () => {
-      xtermRef.current.writeln('Connected to real terminal!');
-    };
-    wsRef.current.onmessage = (event) => {
-      xtermRef.current.write(event.data);
-    };
-    wsRef.current.onclose = () => {
-      xtermRef.current.writeln('\r\n[Connection closed]');
+    // The shell lives on the server under a session id kept for this tab,
+    // so a reload or dropped connection reattaches to the same shell and
+    // its scrollback is replayed
+    let disposed = false;
+    let retryTimer = null;
+    const sendSize = ({ cols, rows }) => {
+      wsRef.current && wsRef.current.readyState === 1 &&
+        wsRef.current.send(JSON.stringify({ type: 'resize', cols, rows }));
     };
-    wsRef.current.onerror = (err) => {
-      xtermRef.current.writeln('\r\n[WebSocket error]');
+
+    const connect = async (attempt = 0) => {
+      let sessionId = sessionStorage.getItem(TERMINAL_SESSION_KEY);
+      if (!sessionId) {
+        try {
+          const session = await createTerminalSession(xtermRef.current.cols, xtermRef.current.rows);
+          sessionId = session.id;
+          sessionStorage.setItem(TERMINAL_SESSION_KEY, sessionId);
+        } catch (e) {
+          xtermRef.current.writeln('\r\n[Could not start terminal]');
+          return;
+        }
+      }
+      if (disposed) return;
+      const ws = new WebSocket(terminalSocketUrl(sessionId));
+      wsRef.current = ws;
+      ws.onopen = () => {
+        attempt = 0;
+        xtermRef.current.reset();
+        sendSize(xtermRef.current);
+      };
+      ws.onmessage = (event) => {
+        xtermRef.current.write(event.data);
+      };
+      ws.onclose = (event) => {
+        if (disposed) return;
+        if (event.code === 4404) {
+          // Session was reaped or the shell exited: start a fresh one
+          sessionStorage.removeItem(TERMINAL_SESSION_KEY);
+          xtermRef.current.writeln('\r\n[Session ended]');
+        } else {
+          xtermRef.current.writeln('\r\n[Connection closed, reconnecting...]');
+        }
+        retryTimer = setTimeout(() => connect(attempt + 1), Math.min(500 * 2 ** attempt, 10000));
+      };
+      ws.onerror = () => {
+        xtermRef.current.writeln('\r\n[WebSocket error]');
+      };
     };
+    connect();
 
     // Send user input to backend
     const onData = (data) => {
       wsRef.current && wsRef.current.readyState === 1 && wsRef.current.send(data);
     };
     xtermRef.current.onData(onData);
+    // Keep the shell's idea of the window size in sync
+    xtermRef.current.onResize(sendSize);
 
     return () => {
+      disposed = true;
+      clearTimeout(retryTimer);
       xtermRef.current && xtermRef.current.dispose();
       wsRef.current && wsRef.current.close();
     };
@@ -24,6 +24,17 @@ export async function writeFile(path, content) {
   return res.json();
 }
 
+// Save All: files is [{ path, content, expected_sha256? }]; written all or nothing
+export async function saveFiles(files, fsync = null) {
+  const res = await fetch(`${API_URL}/files/save/`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ files, fsync }),
+  });
+  if (!res.ok) throw new Error((await res.json()).detail || 'Save failed');
+  return res.json();
+}
+
 // --- AI Endpoints ---
 export async function aiSuggest(code, language = 'python') {
   const res = await fetch(`${API_URL}/ai/suggest/`, {
@@ -112,3 +123,34 @@ export async function indexCode(currentDirectory) {
   });
   return res.json();
 }
+
+// --- Terminal Sessions ---
+export async function createTerminalSession(cols, rows) {
+  const res = await fetch(`${API_URL}/terminal/sessions/`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ cols, rows })
+  });
+  if (!res.ok) throw new Error('Could not start a terminal');
+  return res.json();
+}
+
+export function terminalSocketUrl(sessionId) {
+  return `${API_URL.replace(/^http/, 'ws')}/ws/terminal/?session_id=${encodeURIComponent(sessionId)}`;
+}
+
+// --- Large Files ---
+// Windowed reads for files too big to open whole; start is a 0-based line
+export async function readFileLines(path, start, count = 200) {
+  const params = new URLSearchParams({ path, start, count });
+  const res = await fetch(`${API_URL}/file/lines/?${params}`);
+  if (!res.ok) throw new Error('File not found');
+  return res.json();
+}
+
+export async function searchFileLines(path, query, { mode = 'substring', caseSensitive = false, offset = 0, limit = 100 } = {}) {
+  const params = new URLSearchParams({ path, query, mode, case_sensitive: caseSensitive, offset, limit });
+  const res = await fetch(`${API_URL}/file/lines/search/?${params}`);
+  if (!res.ok) throw new Error('Search failed');
+  return res.json();
+}
@@ -1,21 +1,65 @@
 // Gemini-powered code completion provider for Monaco Editor
 import * as monaco from 'monaco-editor';
 
+// One id per editor model so the backend can drop completions that a newer
+// keystroke has made stale
+const sessionIds = new WeakMap();
+
+function sessionIdFor(model) {
+  let id = sessionIds.get(model);
+  if (!id) {
+    id = `${model.uri.toString()}#${Math.random().toString(36).slice(2)}`;
+    sessionIds.set(model, id);
+  }
+  return id;
+}
+
+// Context sent around the cursor, in UTF-16 units; the backend trims it
+// further, at line boundaries, to its own limits
+const PREFIX_CHARS = 4000;
+const SUFFIX_CHARS = 1000;
+
+function isHighSurrogate(code) {
+  return code >= 0xd800 && code <= 0xdbff;
+}
+
+function isLowSurrogate(code) {
+  return code >= 0xdc00 && code <= 0xdfff;
+}
+
+// The text around the cursor and the cursor's offset into it in code points,
+// which is how the backend (Python) indexes strings. Monaco offsets are
+// UTF-16 units and would drift after every astral character such as an emoji.
+function contextAround(model, position) {
+  const offset = model.getOffsetAt(position);
+  const start = model.getPositionAt(Math.max(0, offset - PREFIX_CHARS));
+  const end = model.getPositionAt(offset + SUFFIX_CHARS);
+  let prefix = model.getValueInRange(monaco.Range.fromPositions(start, position));
+  let suffix = model.getValueInRange(monaco.Range.fromPositions(position, end));
+  // Do not start or end the window in the middle of a surrogate pair
+  if (prefix && isLowSurrogate(prefix.charCodeAt(0))) prefix = prefix.slice(1);
+  if (suffix && isHighSurrogate(suffix.charCodeAt(suffix.length - 1))) suffix = suffix.slice(0, -1);
+  return { code: prefix + suffix, cursor: Array.from(prefix).length };
+}
+
 export function registerGeminiCompletionProvider(language = 'python') {
   monaco.languages.registerCompletionItemProvider(language, {
     triggerCharacters: ['.', ' ', '(', '[', '{', '=', ':'],
-    async provideCompletionItems(model, position) {
-      const codeUntilCursor = model.getValueInRange({
-        startLineNumber: 1,
-        startColumn: 1,
-        endLineNumber: position.lineNumber,
-        endColumn: position.column,
-      });
+    async provideCompletionItems(model, position, context, token) {
+      const controller = new AbortController();
+      const cancellation = token && token.onCancellationRequested(() => controller.abort());
       try {
+        const { code, cursor } = contextAround(model, position);
         const response = await fetch('/api/suggest', {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ code: codeUntilCursor, language }),
+          body: JSON.stringify({
+            code,
+            cursor,
+            session_id: sessionIdFor(model),
+            language,
+          }),
+          signal: controller.signal,
         });
         const data = await response.json();
         if (data.suggestion && data.suggestion.trim()) {
@@ -38,6 +82,8 @@ export function registerGeminiCompletionProvider(language = 'python') {
         }
       } catch (e) {
         // Fail silently
+      } finally {
+        if (cancellation) cancellation.dispose();
       }
       return { suggestions: [] };
     },